@@ -10,6 +10,7 @@ SubModules
     cello.clustering.core
     cello.clustering.common
     cello.clustering.filter
+    cello.clustering.proxclustering
     cello.clustering.labelling
 
 Helpers
@@ -21,11 +22,13 @@ import six
 
 
 import logging
+from itertools import chain
 
+import numpy as np
 import igraph as ig
 
 from cello.clustering.core import OneCluster, ConnectedComponents, MaximalCliques
-from cello.clustering.common import Walktrap, Infomap
+from cello.clustering.common import Walktrap, Infomap, Louvain, Leiden, LabelPropagation
 
 #{ Pack of methods
 def unipartite_clustering_methods():
@@ -33,11 +36,15 @@ def unipartite_clustering_methods():
     
     >>> methods = unipartite_clustering_methods()
     >>> len(methods)
-    2
+    5
     """
     methods = []
     methods.append(Infomap())
     methods.append(Walktrap())
+    # fast methods, for large graphs
+    methods.append(Louvain())
+    methods.append(Leiden())
+    methods.append(LabelPropagation())
     return methods
 
 
@@ -46,10 +53,14 @@ def bipartite_clustering_methods():
     
     >>> methods = bipartite_clustering_methods()
     >>> len(methods)
-    1
+    4
     """
     methods = []
     methods.append(Infomap())
+    # fast methods, for large graphs
+    methods.append(Louvain())
+    methods.append(Leiden())
+    methods.append(LabelPropagation())
     return methods
 #}
 
@@ -139,42 +150,95 @@ def export_clustering(vertex_cover, vertex_id_attr=None):
     has_labels = isinstance(vertex_cover, LabelledVertexCover)
     
     cover = {}
-    if hasattr(vertex_cover, "misc_cluster") : # "misc" cluster id
-        cover['misc'] = vertex_cover.misc_cluster
-    else: # pas de "misc"
-        cover['misc'] = -1
-
-    gid_to_doc = None
-    if hasattr(vertex_cover, 'graph') and '_doc' in vertex_cover.graph.vs.attributes():
-        gid_to_doc = {gid: doc['docnum'] \
-            for gid, doc in enumerate(vertex_cover.graph.vs['_doc']) \
-            if doc is not None
-        }
+    cover['misc'] = _misc_cluster(vertex_cover)
+    offsets, vids, docnums = _cover_columns(vertex_cover, vertex_id_attr)
 
     # label's collection
     if has_labels:
-        cover["labels"] = [label.as_dict(full=True) for label in vertex_cover.all_labels()]
-        full_labels = vertex_cover.labels
+        cover["labels"] = vertex_cover.labels_as_dicts()
 
     # clusters them self
     clusters = []
-    for cnum, vids in enumerate(vertex_cover):
+    for cnum in range(len(offsets) - 1):
+        start, stop = offsets[cnum], offsets[cnum + 1]
         cluster = {}
-        if vertex_id_attr is not None:
-            vs = vertex_cover.graph.vs
-            cluster['vids'] = [vs[i][vertex_id_attr] for i in vids]
-        else :
-            cluster['vids'] = vids
+        cluster['vids'] = vids[start:stop]
         # doc ?
         cluster['docnums'] = []
-        if gid_to_doc:
-            cluster['docnums'] = [gid_to_doc[gid] for gid in vids if gid in gid_to_doc]
+        if docnums is not None:
+            cluster['docnums'] = [docnum for docnum in docnums[start:stop] if docnum is not None]
         # labels ?
         if has_labels:
-            cluster['labels'] = [label.id for label in full_labels[cnum]]
+            cluster['labels'] = vertex_cover.label_ids(cnum)
         # add the cluster
         clusters.append(cluster)
     cover['clusters'] = clusters
     return cover
 
 
+def export_clustering_columns(vertex_cover, vertex_id_attr=None):
+    """ Columnar variant of :func:`export_clustering`: the members of all the
+    clusters are given in one flat list, cluster `i` being
+    `vids[offsets[i]:offsets[i+1]]`. `docnums` is aligned with `vids` (None
+    for vertices without document), and labels of the clusters are given the
+    same way with `label_offsets` and `label_ids`.
+
+    >>> g = ig.Graph.Formula("a--b, a--c, a--d, a--f, d--f")
+    >>> from reliure.schema import Doc
+    >>> g.vs["_doc"] = [Doc(docnum="d_%d" % vid) if vid%2 == 0 else None for vid in range(g.vcount())]
+    >>> from cello.clustering import MaximalCliques
+    >>> cover = MaximalCliques()(g)
+    >>> from pprint import pprint
+    >>> pprint(export_clustering_columns(cover, vertex_id_attr="name"))
+    {'docnums': [None, 'd_0', 'd_2', 'd_0', 'd_0', None, 'd_4'],
+     'misc': -1,
+     'offsets': [0, 2, 4, 7],
+     'vids': ['b', 'a', 'c', 'a', 'a', 'd', 'f']}
+    """
+    from cello.clustering.labelling.model import LabelledVertexCover
+
+    offsets, vids, docnums = _cover_columns(vertex_cover, vertex_id_attr)
+    cover = {}
+    cover['misc'] = _misc_cluster(vertex_cover)
+    cover['offsets'] = offsets.tolist()
+    cover['vids'] = vids
+    cover['docnums'] = docnums if docnums is not None else [None] * len(vids)
+    if isinstance(vertex_cover, LabelledVertexCover):
+        cover["labels"] = vertex_cover.labels_as_dicts()
+        label_ids = [vertex_cover.label_ids(cid) for cid in range(len(vertex_cover))]
+        label_offsets = np.zeros(len(label_ids) + 1, dtype=np.int64)
+        np.cumsum([len(lids) for lids in label_ids], out=label_offsets[1:])
+        cover['label_offsets'] = label_offsets.tolist()
+        cover['label_ids'] = list(chain.from_iterable(label_ids))
+    return cover
+
+
+def _misc_cluster(vertex_cover):
+    """ "misc" cluster id of a cover (-1 if none) """
+    if hasattr(vertex_cover, "misc_cluster") : # "misc" cluster id
+        return vertex_cover.misc_cluster
+    return -1 # pas de "misc"
+
+def _cover_columns(vertex_cover, vertex_id_attr=None):
+    """ Flat view of a cover: clusters offsets, ids of the members (vertex
+    index or `vertex_id_attr`) and docnums of the members (or None if the
+    graph has no '_doc').
+
+    Vertex attributes are fetched once for the whole graph.
+    """
+    clusters = [list(vids) for vids in vertex_cover]
+    offsets = np.zeros(len(clusters) + 1, dtype=np.int64)
+    np.cumsum([len(vids) for vids in clusters], out=offsets[1:])
+    members = list(chain.from_iterable(clusters))
+    graph = getattr(vertex_cover, 'graph', None)
+
+    vids = members
+    if vertex_id_attr is not None:
+        column = graph.vs[vertex_id_attr]
+        vids = [column[vid] for vid in members]
+
+    docnums = None
+    if graph is not None and '_doc' in graph.vs.attributes():
+        vdocnums = [doc['docnum'] if doc is not None else None for doc in graph.vs['_doc']]
+        docnums = [vdocnums[vid] for vid in members]
+    return offsets, vids, docnums
@@ -4,12 +4,63 @@
 
 Mostly wrapper to igraph clustering methods
 """
+import random
+import threading
+from contextlib import contextmanager
+
 import igraph as ig
 
 from reliure.types import Numeric, Boolean
 
 from cello.graphs import EDGE_WEIGHT_ATTR
-from cello.clustering.core import ClusteringMethod
+from cello.clustering.core import ClusteringMethod, Dendrogram, dendrogram_cache
+
+
+#: generator used by igraph out of :func:`seeded` contexts
+_generator = random
+_generator_lock = threading.RLock()
+
+
+def set_random_number_generator(generator):
+    """ Sets the igraph random generator (see
+    :func:`igraph.set_random_number_generator`), it is restored at the end
+    of :func:`seeded` contexts. igraph has no getter of its generator, so one
+    should use this function rather than igraph's one.
+    """
+    global _generator
+    with _generator_lock:
+        ig.set_random_number_generator(generator)
+        _generator = generator
+
+
+@contextmanager
+def seeded(seed=None):
+    """ Context in which igraph randomised methods use the given seed (nothing
+    is changed if `seed` is None). The previous generator (see
+    :func:`set_random_number_generator`) is restored at the end.
+
+    >>> g = ig.Graph.Formula("a--b--c--a, c--d--e--f--d")
+    >>> with seeded(42):
+    ...     first = g.community_label_propagation().membership
+    >>> with seeded(42):
+    ...     first == g.community_label_propagation().membership
+    True
+
+    .. Warning:: igraph generator is global to the process: seeded contexts
+        are serialised by a lock, so concurrent seeded calls are reproducible,
+        but igraph calls done meanwhile in other threads out of any seeded
+        context also use (and change) the seeded generator.
+    """
+    if seed is None:
+        yield
+        return
+    with _generator_lock:
+        previous = _generator
+        ig.set_random_number_generator(random.Random(seed))
+        try:
+            yield
+        finally:
+            ig.set_random_number_generator(previous)
 
 
 class Weighted(ClusteringMethod):
@@ -18,6 +69,18 @@ class Weighted(ClusteringMethod):
         super(Weighted, self).__init__(name=name)
         self.add_option("weighted", Boolean(default=kwargs.get("weighted",True), help="use weighted edge."))
         
+    def weights(self, graph, weighted=True):
+        """ Edges weights given to igraph methods (None if not weighted) """
+        return graph.es[EDGE_WEIGHT_ATTR] if weighted else None
+
+
+class Seeded(Weighted):
+
+    def __init__(self, name=None, **kwargs):
+        super(Seeded, self).__init__(name=name, **kwargs)
+        self.add_option("seed", Numeric(vtype=int, default=kwargs.get("seed"), min=0,
+            help="random seed (not seeded if None)"))
+
     
     
 class Walktrap(Weighted):
@@ -42,63 +105,53 @@ class Walktrap(Weighted):
     >>> clustering(g).membership
     [[]]
 
-    Note: this last exemple illustrate a bug in igraph when there is a simple
-    pair of adjacent vertices and some singletons. There is a fix in the code
-    to avoid this issue.
+    Note: this exemple illustrate a bug in igraph when there is a simple
+    pair of adjacent vertices and some singletons: the dendrogram is not
+    complete, it is fixed by :class:`.Dendrogram`.
 
     >>> g = ig.Graph.Formula("a--b, e")
     >>> g.es[EDGE_WEIGHT_ATTR] = [1.]       # basic weights
     >>> clustering(g).membership
     [[0], [0], [1]]
 
+    The dendrogram is cached (by graph and weights), so other cuts of the same
+    graph are not recomputed:
+
+    >>> g = ig.Graph.Formula("a:b:c--a:b:c, c--d, d:e:f--d:e:f")
+    >>> g.es[EDGE_WEIGHT_ATTR] = [1.]
+    >>> dendrogram = clustering.dendrogram(g)
+    >>> clustering(g, n_clusters=2).membership
+    [[0], [0], [0], [1], [1], [1]]
+    >>> clustering(g, n_clusters=3).membership
+    [[0], [0], [1], [2], [2], [2]]
+    >>> clustering.dendrogram(g) is dendrogram
+    True
     """
     def __init__(self, name=None, **kwargs):
         super(Walktrap, self).__init__(name=name, **kwargs)
         self.add_option("l", Numeric(default=kwargs.get("l", 4), help="length of the random walks"))
+        self.add_option("n_clusters", Numeric(default=kwargs.get("n_clusters", 0), min=0,
+            help="number of clusters (0 for the best modularity)"))
+        self.cache = kwargs.get("cache", dendrogram_cache)
 
-    def __call__(self, graph, l=4, weighted = True):
-        if self.graph_is_trivial(graph, weighted=True):
-            return ig.VertexCover(graph, [])
-        weights = graph.es[EDGE_WEIGHT_ATTR] if weighted else [1]* graph.vcount()
-        vertex_clustering = graph.community_walktrap(weights=weights, steps=l)
-        #self.fix_dendrogram(graph, vertex_clustering)
-        merges = vertex_clustering.merges
-        n = graph.vcount()
-        singles = graph.vs.select(_degree=0)
-        for vtx in singles:
-            last_merge = n - len(singles) + len(merges) - 1
-            merges.append((last_merge, vtx.index))
-        fixed_vertex_clustering = ig.VertexDendrogram(
-            graph,
-            merges,
-            vertex_clustering.optimal_count,
-            modularity_params=dict(weights=graph.es[EDGE_WEIGHT_ATTR])
-        )
-        return fixed_vertex_clustering.as_clustering().as_cover()
-
-    def fix_dendrogram(self, graph, cl):
-        """ Fix the dendrogramm to add singletons because igraph forget it...
-        """
-        #TODO: code proposé par yann dans  Commit 5fb4db847d394fc44b838a09fae6f77eaf849861 
-        #TODO: j'ai une erreur sur le doctest avec ce code... et je ne capte pas ce qu'il fait, desactivé pour le moment
-        from itertools import izip
-        already_merged = set()
-        for merge in cl.merges:
-            already_merged.update(merge)
+    def dendrogram(self, graph, l=4, weighted=True):
+        """ Walktrap dendrogram of the graph, from the cache if possible
 
-        num_dendrogram_nodes = graph.vcount() + len(cl.merges)
-        not_merged_yet = sorted(set(xrange(num_dendrogram_nodes)) - already_merged)
-        if len(not_merged_yet) < 2:
-            return
-
-        v1, v2 = not_merged_yet[:2]
-        cl._merges.append((v1, v2))
-        del not_merged_yet[:2]
+        :rtype: :class:`.Dendrogram`
+        """
+        weights = self.weights(graph, weighted)
+        compute = lambda: Dendrogram(graph, graph.community_walktrap(weights=weights, steps=l).merges,
+                                     weights=weights)
+        if self.cache is None:
+            return compute()
+        return self.cache.get(graph, ("walktrap", l, weighted), compute,
+                              weight=EDGE_WEIGHT_ATTR if weighted else None)
 
-        missing_nodes = xrange(num_dendrogram_nodes,
-                num_dendrogram_nodes + len(not_merged_yet))
-        cl._merges.extend(izip(not_merged_yet, missing_nodes))
-        cl._nmerges = graph.vcount()-1
+    def __call__(self, graph, l=4, weighted=True, n_clusters=0):
+        if self.graph_is_trivial(graph, weighted=weighted):
+            return ig.VertexCover(graph, [])
+        dendrogram = self.dendrogram(graph, l=l, weighted=weighted)
+        return dendrogram.as_clustering(graph, n_clusters).as_cover()
 
 
 class Infomap(Weighted):
@@ -138,3 +191,120 @@ class Infomap(Weighted):
         vertex_clustering = graph.community_infomap(edge_weights=weights)
         return vertex_clustering.as_cover()
 
+
+
+class Louvain(Seeded):
+    """ Louvain clustering method (multilevel modularity optimisation), fast
+    enough for large graphs
+
+    .. see_also: :func:`igraph.Graph.community_multilevel`
+
+    >>> clustering = Louvain()
+    >>> clustering.print_options()
+    weighted (Boolean, default=True): use weighted edge.
+    seed (Numeric, default=None): random seed (not seeded if None)
+    resolution (Numeric, default=1.0): resolution, higher values give smaller clusters
+
+    >>> g = ig.Graph.Formula("a:b--b:c:d, e--f")
+    >>> g.es[EDGE_WEIGHT_ATTR] = [1.]       # basic weights
+    >>> clustering(g).membership    # here, should be same as connected components
+    [[0], [0], [0], [0], [1], [1]]
+
+    >>> g.es[EDGE_WEIGHT_ATTR] = [0.]       # Graph as 'no' real edge
+    >>> clustering(g).membership
+    [[], [], [], [], [], []]
+
+    >>> g = ig.Graph(n=5)           # in case of graph with no edge
+    >>> clustering(g).membership
+    [[], [], [], [], []]
+    """
+    def __init__(self, name=None, **kwargs):
+        super(Louvain, self).__init__(name=name, **kwargs)
+        self.add_option("resolution", Numeric(vtype=float, default=kwargs.get("resolution", 1.), min=0.,
+            help="resolution, higher values give smaller clusters"))
+
+    def __call__(self, graph, weighted=True, seed=None, resolution=1.):
+        if self.graph_is_trivial(graph, weighted=weighted):
+            return ig.VertexCover(graph, [])
+        weights = self.weights(graph, weighted)
+        with seeded(seed):
+            try:
+                vertex_clustering = graph.community_multilevel(weights=weights, resolution=resolution)
+            except TypeError:   # igraph < 0.10 has no resolution
+                if resolution != 1.:
+                    self._logger.warning("resolution not available with this igraph version, ignored")
+                vertex_clustering = graph.community_multilevel(weights=weights)
+        return vertex_clustering.as_cover()
+
+
+class Leiden(Seeded):
+    """ Leiden clustering method (modularity optimisation), fast enough for
+    large graphs
+
+    .. see_also: :func:`igraph.Graph.community_leiden`
+
+    >>> clustering = Leiden()
+    >>> clustering.print_options()
+    weighted (Boolean, default=True): use weighted edge.
+    seed (Numeric, default=None): random seed (not seeded if None)
+    resolution (Numeric, default=1.0): resolution, higher values give smaller clusters
+    iterations (Numeric, default=2): number of iterations (until convergence if negative)
+
+    >>> g = ig.Graph.Formula("a:b--b:c:d, e--f")
+    >>> g.es[EDGE_WEIGHT_ATTR] = [1.]       # basic weights
+    >>> clustering(g, seed=0).membership    # here, should be same as connected components
+    [[0], [0], [0], [0], [1], [1]]
+
+    >>> g.es[EDGE_WEIGHT_ATTR] = [0.]       # Graph as 'no' real edge
+    >>> clustering(g).membership
+    [[], [], [], [], [], []]
+
+    Results are reproducible with a given seed:
+
+    >>> g = ig.Graph.Famous("Zachary")
+    >>> g.es[EDGE_WEIGHT_ATTR] = [1.]
+    >>> clustering(g, seed=42).membership == clustering(g, seed=42).membership
+    True
+    """
+    def __init__(self, name=None, **kwargs):
+        super(Leiden, self).__init__(name=name, **kwargs)
+        self.add_option("resolution", Numeric(vtype=float, default=kwargs.get("resolution", 1.), min=0.,
+            help="resolution, higher values give smaller clusters"))
+        self.add_option("iterations", Numeric(default=kwargs.get("iterations", 2),
+            help="number of iterations (until convergence if negative)"))
+
+    def __call__(self, graph, weighted=True, seed=None, resolution=1., iterations=2):
+        if self.graph_is_trivial(graph, weighted=weighted):
+            return ig.VertexCover(graph, [])
+        weights = self.weights(graph, weighted)
+        with seeded(seed):
+            vertex_clustering = graph.community_leiden(objective_function="modularity",
+                weights=weights, resolution_parameter=resolution, n_iterations=iterations)
+        return vertex_clustering.as_cover()
+
+
+class LabelPropagation(Seeded):
+    """ Label propagation clustering method, near linear time
+
+    .. see_also: :func:`igraph.Graph.community_label_propagation`
+
+    >>> clustering = LabelPropagation()
+    >>> g = ig.Graph.Formula("a:b--b:c:d, e--f")
+    >>> g.es[EDGE_WEIGHT_ATTR] = [1.]       # basic weights
+    >>> clustering(g, seed=0).membership    # here, should be same as connected components
+    [[0], [0], [0], [0], [1], [1]]
+
+    >>> g.es[EDGE_WEIGHT_ATTR] = [0.]       # Graph as 'no' real edge
+    >>> clustering(g).membership
+    [[], [], [], [], [], []]
+    """
+    def __init__(self, name=None, **kwargs):
+        super(LabelPropagation, self).__init__(name=name, **kwargs)
+
+    def __call__(self, graph, weighted=True, seed=None):
+        if self.graph_is_trivial(graph, weighted=weighted):
+            return ig.VertexCover(graph, [])
+        weights = self.weights(graph, weighted)
+        with seeded(seed):
+            vertex_clustering = graph.community_label_propagation(weights=weights)
+        return vertex_clustering.as_cover()
@@ -3,14 +3,20 @@
 ================================
 
 Define abstract clustering class (:class:`ClusteringMethod` and
-:class:`BigraphClusteringMethod`) and some trivial ones
+:class:`BigraphClusteringMethod`), the :class:`Dendrogram` of hierarchical
+methods and some trivial ones
 """
+import time
+import builtins
+
+import numpy as np
 import igraph as ig
 
 from reliure import Optionable
 from reliure.types import Numeric
 
 from cello.graphs import EDGE_WEIGHT_ATTR
+from cello.graphs.cache import GraphCache
 
 class ClusteringMethod(Optionable):
     """ Abstract clustering method, should work for unipartite or bipartite graphs
@@ -115,6 +121,198 @@ class BigraphClusteringMethod(ClusteringMethod):
         return res
 
 
+class Dendrogram(object):
+    """ Dendrogram of a hierarchical clustering, that can be cut at any number
+    of clusters without recomputing the clustering.
+
+    The merges are completed if the dendrogram is not (when the graph is not
+    connected). A cut is computed in near linear time with vectorised pointer
+    jumping, the modularity of every level is computed once (on first need).
+
+    >>> g = ig.Graph.Formula("a:b:c--a:b:c, c--d, d:e:f--d:e:f, x")
+    >>> dendrogram = Dendrogram(g, g.community_walktrap().merges)
+    >>> len(dendrogram.merges)      # 'x' is merged at the end
+    6
+    >>> dendrogram.membership(3)
+    [0, 0, 0, 1, 1, 1, 2]
+    >>> dendrogram.membership(1)
+    [0, 0, 0, 0, 0, 0, 0]
+    >>> dendrogram.optimal_count
+    3
+    >>> round(dendrogram.modularity(3), 4) == round(g.modularity([0, 0, 0, 1, 1, 1, 2]), 4)
+    True
+
+    The number of clusters can also be given by a modularity level, the
+    coarsest cut with at least this modularity is used:
+
+    >>> dendrogram.count_for_modularity(0.3)
+    3
+    >>> dendrogram.as_clustering(g, min_modularity=0.15).membership
+    [0, 0, 0, 1, 1, 1, 2]
+    >>> dendrogram.as_clustering(g).membership      # optimal count
+    [0, 0, 0, 1, 1, 1, 2]
+
+    The dendrogram only keeps the edges of the graph (not the graph itself),
+    so a cached dendrogram does not keep its graph alive:
+
+    >>> import weakref
+    >>> graph_ref = weakref.ref(g)
+    >>> del g
+    >>> graph_ref() is None
+    True
+    """
+    def __init__(self, graph, merges, weights=None):
+        """
+        :param graph: the clustered graph
+        :param merges: the merges (pairs of dendrogram nodes, as given by igraph)
+        :param weights: edges weights (list or attribute name) used to compute
+            the modularity
+        """
+        self.n = graph.vcount()
+        if weights is not None and not hasattr(weights, "__len__"):
+            weights = graph.es[weights]
+        self.weights = weights
+        self._edges = np.array(graph.get_edgelist(), dtype=np.int64).reshape(-1, 2)
+        self.merges = self._complete(self.n, [tuple(merge) for merge in merges])
+        # parent of each node of the dendrogram (roots are their own parents)
+        nb_nodes = self.n + len(self.merges)
+        self._parent = np.arange(nb_nodes)
+        if len(self.merges):
+            merges = np.array(self.merges, dtype=np.int64)
+            self._parent[merges[:, 0]] = self.n + np.arange(len(merges))
+            self._parent[merges[:, 1]] = self.n + np.arange(len(merges))
+        self._modularities = None
+
+    @staticmethod
+    def _complete(n, merges):
+        """ Merges the roots of an incomplete dendrogram
+
+        >>> Dendrogram._complete(4, [(0, 1)])
+        [(0, 1), (2, 3), (5, 4)]
+        """
+        merged = set(node for merge in merges for node in merge)
+        roots = [node for node in range(n + len(merges)) if node not in merged]
+        if len(roots) > 1:
+            merges = list(merges)
+            last = roots[0]
+            for root in roots[1:]:
+                merges.append((last, root))
+                last = n + len(merges) - 1
+        return merges
+
+    def membership(self, n_clusters):
+        """ Membership list of the cut of the dendrogram with `n_clusters`
+        clusters, clusters are numbered by first vertex.
+        """
+        if self.n == 0:
+            return []
+        n_clusters = min(max(1, int(n_clusters)), self.n)
+        # nodes created after the cut are not visible
+        limit = 2 * self.n - n_clusters
+        nodes = np.arange(len(self._parent))
+        top = np.where(self._parent < limit, self._parent, nodes)
+        while True:
+            higher = top[top]
+            if np.array_equal(higher, top):
+                break
+            top = higher
+        roots, first, inverse = np.unique(top[:self.n], return_index=True, return_inverse=True)
+        rank = np.empty(len(roots), dtype=np.int64)
+        rank[np.argsort(first)] = np.arange(len(roots))
+        return rank[inverse].tolist()
+
+    @property
+    def modularities(self):
+        """ Modularity of each cut, indexed by the number of merges done
+        (so `modularities[n - k]` is the modularity of the cut in `k` clusters)
+        """
+        if self._modularities is None:
+            self._modularities = self._compute_modularities()
+        return self._modularities
+
+    def _compute_modularities(self):
+        n, edges = self.n, self._edges
+        modularities = np.zeros(len(self.merges) + 1)
+        if len(edges) == 0:
+            return modularities
+        weights = np.ones(len(edges)) if self.weights is None else np.asarray(self.weights, dtype=np.float64)
+        total = weights.sum()
+        if total == 0:
+            return modularities
+        strength = np.bincount(edges.ravel(), weights=np.repeat(weights, 2), minlength=n)
+        loops = edges[:, 0] == edges[:, 1]
+        # symmetric adjacency (CSR) without loops
+        src = np.concatenate((edges[~loops, 0], edges[~loops, 1]))
+        dst = np.concatenate((edges[~loops, 1], edges[~loops, 0]))
+        wgt = np.concatenate((weights[~loops], weights[~loops]))
+        order = np.argsort(src, kind="stable")
+        dst, wgt = dst[order], wgt[order]
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(src, minlength=n))))
+
+        modularities[0] = weights[loops].sum() / total - (strength ** 2).sum() / (4 * total ** 2)
+        # vertices of each merged set, smaller sets are merged into bigger ones
+        vertex_set = np.arange(n)
+        node_set = list(range(n))
+        members = [[vtx] for vtx in range(n)]
+        node_strength = list(strength)
+        for step, (node_a, node_b) in enumerate(self.merges):
+            set_a, set_b = node_set[node_a], node_set[node_b]
+            if len(members[set_a]) > len(members[set_b]):
+                set_a, set_b = set_b, set_a
+            between = 0.
+            for vtx in members[set_a]:
+                nbrs = slice(indptr[vtx], indptr[vtx + 1])
+                between += wgt[nbrs][vertex_set[dst[nbrs]] == set_b].sum()
+            vertex_set[members[set_a]] = set_b
+            members[set_b].extend(members[set_a])
+            members[set_a] = None
+            node_set.append(set_b)
+            node_strength.append(node_strength[node_a] + node_strength[node_b])
+            modularities[step + 1] = modularities[step] + between / total \
+                - node_strength[node_a] * node_strength[node_b] / (2 * total ** 2)
+        return modularities
+
+    def modularity(self, n_clusters):
+        """ Modularity of the cut in `n_clusters` clusters """
+        return float(self.modularities[self.n - n_clusters])
+
+    @property
+    def optimal_count(self):
+        """ Number of clusters that maximises the modularity """
+        if self.n == 0:
+            return 0
+        return int(self.n - np.argmax(self.modularities))
+
+    def count_for_modularity(self, min_modularity):
+        """ Smallest number of clusters with a modularity at least
+        `min_modularity` (the optimal count if this modularity is never reached)
+        """
+        reached = np.flatnonzero(self.modularities >= min_modularity)
+        if len(reached) == 0:
+            return self.optimal_count
+        return int(self.n - reached[-1])
+
+    def as_clustering(self, graph, n_clusters=None, min_modularity=None):
+        """ Cut the dendrogram, in `n_clusters` clusters if given, else at the
+        given modularity level, else at the optimal count.
+
+        :param graph: the clustered graph
+
+        :rtype: :class:`igraph.VertexClustering`
+        """
+        if not n_clusters:
+            if min_modularity is not None:
+                n_clusters = self.count_for_modularity(min_modularity)
+            else:
+                n_clusters = self.optimal_count
+        return ig.VertexClustering(graph, self.membership(n_clusters),
+                                   modularity_params=dict(weights=self.weights))
+
+
+#: cache shared by default by hierarchical clustering methods
+dendrogram_cache = GraphCache()
+
+
 class OneCluster(ClusteringMethod):
     """ Group all vertices are in one cluster
     
@@ -147,6 +345,80 @@ class ConnectedComponents(ClusteringMethod):
         return vertex_clustering.as_cover()
 
 
+def iter_maximal_cliques(graph, min=0, max=0, deadline=None):
+    """ Iterates over the maximal cliques of a graph (Bron-Kerbosch with
+    pivoting), cliques are generated one by one so the enumeration can be
+    stopped at any time.
+
+    Vertices are sorted by core number (degeneracy ordering) so each clique is
+    generated from its first vertex with few candidates, the enumeration
+    starts from the vertices with the most candidates so large cliques come
+    first.
+
+    :param min: minimum size of the cliques (0 for no limit)
+    :param max: maximum size of the cliques (0 for no limit), larger cliques
+        are not generated (as :func:`igraph.Graph.maximal_cliques`)
+    :param deadline: if not None, the enumeration stops when `time.time()`
+        reaches it, the generator then returns True (the value of its
+        `StopIteration`)
+
+    >>> g = ig.Graph.Formula("a:b--b:c:d, e--f, x")
+    >>> [sorted(g.vs[clique]["name"]) for clique in iter_maximal_cliques(g)]
+    [['a', 'b', 'c'], ['a', 'b', 'd'], ['e', 'f'], ['x']]
+    >>> [sorted(g.vs[clique]["name"]) for clique in iter_maximal_cliques(g, min=2, max=2)]
+    [['e', 'f']]
+    """
+    adjacency = [set(graph.neighbors(vid)) for vid in range(graph.vcount())]
+    for vid, neighbors in enumerate(adjacency):
+        neighbors.discard(vid)
+    coreness = graph.coreness()
+    # degeneracy ordering, a clique is generated from its first vertex
+    order = sorted(range(graph.vcount()), key=lambda vid: (coreness[vid], len(adjacency[vid])))
+    rank = [0] * len(order)
+    for pos, vid in enumerate(order):
+        rank[vid] = pos
+
+    # set when the enumeration is stopped by the deadline
+    stopped = [False]
+
+    def expand(clique, candidates, excluded):
+        if deadline is not None and time.time() >= deadline:
+            stopped[0] = True
+            return
+        if not candidates and not excluded:
+            if len(clique) >= min:
+                yield list(clique)
+            return
+        if len(clique) + len(candidates) < min or (max and len(clique) >= max):
+            return
+        pivot = sorted(candidates | excluded, key=lambda vid: len(candidates & adjacency[vid]))[-1]
+        # most connected candidates first, they lead to the largest cliques
+        for vid in sorted(candidates - adjacency[pivot], key=lambda vid: -len(candidates & adjacency[vid])):
+            clique.append(vid)
+            for found in expand(clique, candidates & adjacency[vid], excluded & adjacency[vid]):
+                yield found
+            clique.pop()
+            candidates.discard(vid)
+            excluded.add(vid)
+
+    later = [set(nbr for nbr in adjacency[vid] if rank[nbr] > rank[vid]) for vid in range(len(order))]
+    # upper bound of the size of the cliques generated from each vertex
+    # (later[vid] has at most degeneracy vertices, so this is cheap)
+    bound = [2 + builtins.max(len(later[vid] & adjacency[nbr]) for nbr in later[vid]) if later[vid] else 1
+                for vid in range(len(order))]
+    for vid in sorted(order, key=lambda vid: -bound[vid]):
+        if deadline is not None and time.time() >= deadline:
+            return True
+        if bound[vid] < min:
+            break
+        excluded = adjacency[vid] - later[vid]
+        for found in expand([vid], set(later[vid]), excluded):
+            yield found
+        if stopped[0]:
+            return True
+    return False
+
+
 class MaximalCliques(ClusteringMethod):
     """ Maximal cliques
 
@@ -156,19 +428,52 @@ class MaximalCliques(ClusteringMethod):
     >>> clustering.print_options()
     min (Numeric, default=0): Minimum cliques size
     max (Numeric, default=10): Maximal cliques size
+    max_count (Numeric, default=0): Maximum number of cliques (0 for no limit)
+    timeout (Numeric, default=0.0): Maximum enumeration time in seconds (0 for no limit)
 
     here is an usage exemple:
 
     >>> g = ig.Graph.Formula("a:b--b:c:d, e--f")
     >>> sorted([sorted(g.vs[cluster]["name"]) for cluster in clustering(g)])
     [['a', 'b', 'c'], ['a', 'b', 'd'], ['e', 'f']]
+
+    By default the cliques are computed by :func:`igraph.Graph.maximal_cliques`
+    (fast but not interruptible). With a `max_count` or a `timeout` the
+    cliques are enumerated with :func:`iter_maximal_cliques`, the enumeration
+    stops when `max_count` cliques are found or after `timeout` seconds
+    (largest cliques are found first), a warning is then logged:
+
+    >>> len(clustering(ig.Graph.Full(12) + ig.Graph.Full(8), max=0, max_count=1))
+    1
+    >>> len(clustering(ig.Graph.Full(12) + ig.Graph.Full(8), max=0, max_count=0))
+    2
     """
     def __init__(self):
         ClusteringMethod.__init__(self, "maximal_cliques")
         self.add_option("min", Numeric(default=0, help=u"Minimum cliques size"))
         self.add_option("max", Numeric(default=10, help=u"Maximal cliques size"))
+        self.add_option("max_count", Numeric(default=0, min=0,
+            help=u"Maximum number of cliques (0 for no limit)"))
+        self.add_option("timeout", Numeric(vtype=float, default=0., min=0.,
+            help=u"Maximum enumeration time in seconds (0 for no limit)"))
 
     @ClusteringMethod.check
-    def __call__(self, graph, min=0, max=10):
-        return ig.VertexCover(graph, graph.maximal_cliques(min, max))
-
+    def __call__(self, graph, min=0, max=10, max_count=0, timeout=0.):
+        if not max_count and not timeout:
+            return ig.VertexCover(graph, graph.maximal_cliques(min, max))
+        deadline = time.time() + timeout if timeout else None
+        cliques = []
+        enumeration = iter_maximal_cliques(graph, min=min, max=max, deadline=deadline)
+        while True:
+            try:
+                clique = next(enumeration)
+            except StopIteration as stop:
+                if stop.value:
+                    self._logger.warning("Maximal cliques: stopped after %ss (%d cliques)"
+                                         % (timeout, len(cliques)))
+                break
+            cliques.append(clique)
+            if max_count and len(cliques) >= max_count:
+                self._logger.warning("Maximal cliques: stopped after %d cliques" % max_count)
+                break
+        return ig.VertexCover(graph, cliques)
@@ -0,0 +1,607 @@
+#-*- coding:utf-8 -*-
+""" :mod:`cello.clustering.fca.fca_bitset`
+=========================================
+
+Formal Concept Analysis (FCA) on bitsets: extents and intents are python
+integers (bit `i` set if object/attribute `i` is in the set), closures are
+computed with a few `&` and `|` on integers rather than object-attribute
+checks one pair at a time.
+
+The concepts are computed with the algorithm of Krajca, Outrata and Vychodil
+(the one of :mod:`cello.clustering.fca.fca_kov`):
+
+P. Krajca, J. Outrata, and V. Vychodil, “Computing Formal Concepts by Attribute
+Sorting,” Fundamenta Informaticae, vol. 115, no. 4, p. 395–417, 2012.
+
+>>> context = BitsetContext.from_relation(
+...     [[0,1,1,1,0,0], #a
+...      [1,1,0,0,0,1], #b
+...      [0,1,0,1,1,0], #c
+...      [1,0,1,0,1,0], #d
+...     ])
+>>> from pprint import pprint
+>>> pprint(sorted(context.krajca()))
+[((), (0, 1, 2, 3, 4, 5)),
+ ((0,), (1, 2, 3)),
+ ((0, 1, 2), (1,)),
+ ((0, 1, 2, 3), ()),
+ ((0, 2), (1, 3)),
+ ((0, 3), (2,)),
+ ((1,), (0, 1, 5)),
+ ((1, 3), (0,)),
+ ((2,), (1, 3, 4)),
+ ((2, 3), (4,)),
+ ((3,), (0, 2, 4))]
+
+Concepts can also be iterated as bitsets:
+
+>>> extent, intent = next(context.iter_krajca())
+>>> bin(extent), bin(intent)
+('0b1111', '0b0')
+"""
+from builtins import range
+
+import sys
+import heapq
+import logging
+
+import numpy as np
+
+_logger = logging.getLogger("cello.clustering.fca.fca_bitset")
+
+
+def popcount(bits):
+    """ Number of bits set
+
+    >>> popcount(0b1011)
+    3
+    """
+    return bin(bits).count("1")
+
+if hasattr(int, "bit_count"):   # python >= 3.10
+    popcount = int.bit_count
+
+
+def iter_bits(bits):
+    """ Indexes of the bits set, in increasing order
+
+    >>> list(iter_bits(0b1011))
+    [0, 1, 3]
+    """
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+def _to_bitsets(indptr, indices, width, block=1024):
+    """ Bitset of each row of a CSR boolean matrix (rows are packed by blocks
+    with numpy)
+    """
+    nb_rows = len(indptr) - 1
+    bitsets = []
+    for start in range(0, nb_rows, block):
+        stop = min(start + block, nb_rows)
+        dense = np.zeros((stop - start, max(width, 1)), dtype=np.bool_)
+        rows = np.repeat(np.arange(stop - start), np.diff(indptr[start:stop + 1]))
+        dense[rows, indices[indptr[start]:indptr[stop]]] = True
+        packed = np.packbits(dense, axis=1, bitorder="little")
+        bitsets.extend(int.from_bytes(row.tobytes(), "little") for row in packed)
+    return bitsets
+
+
+class BitsetContext(object):
+    """ Formal context (objects x attributes) stored as bitsets: the attributes
+    of each object (`rows`) and the objects of each attribute (`columns`).
+
+    `obj_ids` and `attr_ids` give the id used for each object and attribute in
+    the concepts returned by :meth:`krajca` (default to their index).
+    """
+    def __init__(self, pairs, nb_obj, nb_attr, obj_ids=None, attr_ids=None):
+        """
+        :param pairs: (object index, attribute index) incidences, as a (m, 2)
+            array or a list of pairs
+        """
+        pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+        pairs = np.unique(pairs, axis=0)
+        self.nb_obj = nb_obj
+        self.nb_attr = nb_attr
+        self.obj_ids = list(range(nb_obj)) if obj_ids is None else list(obj_ids)
+        self.attr_ids = list(range(nb_attr)) if attr_ids is None else list(attr_ids)
+        self.rows = self._pack(pairs[:, 0], pairs[:, 1], nb_obj, nb_attr)
+        self.columns = self._pack(pairs[:, 1], pairs[:, 0], nb_attr, nb_obj)
+        self.all_objs = (1 << nb_obj) - 1
+        self.all_attrs = (1 << nb_attr) - 1
+
+    @staticmethod
+    def _pack(rows, cols, nb_rows, width):
+        order = np.lexsort((cols, rows))
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=nb_rows))))
+        return _to_bitsets(indptr, cols[order], width)
+
+    @classmethod
+    def from_relation(cls, relation):
+        """ Context from a dense relation (list of objects rows, as for
+        :class:`.DenseContextKOV`)
+        """
+        relation = np.asarray(relation, dtype=np.bool_)
+        objs, attrs = np.nonzero(relation)
+        return cls(np.column_stack((objs, attrs)), relation.shape[0], relation.shape[1])
+
+    @classmethod
+    def from_bigraph(cls, bigraph, obj_type=True):
+        """ Context from a bipartite graph, objects are the vertices of type
+        `obj_type` and attributes the others. Concepts are given with vertex
+        indices (as :class:`.IGraphKOV`).
+
+        >>> import igraph as ig
+        >>> g = ig.Graph.Formula("A:B--a:b, B--c")
+        >>> g.vs["type"] = [vtx["name"].isupper() for vtx in g.vs]
+        >>> sorted(BitsetContext.from_bigraph(g).krajca())
+        [((0, 1), (2, 3)), ((1,), (2, 3, 4))]
+        """
+        types = np.array(bigraph.vs["type"], dtype=np.bool_) == bool(obj_type)
+        obj_ids = np.flatnonzero(types)
+        attr_ids = np.flatnonzero(~types)
+        position = np.zeros(bigraph.vcount(), dtype=np.int64)
+        position[obj_ids] = np.arange(len(obj_ids))
+        position[attr_ids] = np.arange(len(attr_ids))
+        edges = np.array(bigraph.get_edgelist(), dtype=np.int64).reshape(-1, 2)
+        # each edge as (object, attribute)
+        swap = ~types[edges[:, 0]]
+        edges[swap] = edges[swap][:, ::-1]
+        edges = edges[types[edges[:, 0]] & ~types[edges[:, 1]]]
+        return cls(position[edges], len(obj_ids), len(attr_ids),
+                   obj_ids=obj_ids.tolist(), attr_ids=attr_ids.tolist())
+
+    def extent(self, intent):
+        """ Objects having all the attributes of `intent` (bitsets) """
+        extent = self.all_objs
+        for attr in iter_bits(intent):
+            extent &= self.columns[attr]
+        return extent
+
+    def intent(self, extent):
+        """ Attributes shared by all the objects of `extent` (bitsets) """
+        intent = self.all_attrs
+        for obj in iter_bits(extent):
+            intent &= self.rows[obj]
+        return intent
+
+    def decode(self, extent, intent):
+        """ Concept as tuples of object and attribute ids """
+        return (tuple(self.obj_ids[obj] for obj in iter_bits(extent)),
+                tuple(self.attr_ids[attr] for attr in iter_bits(intent)))
+
+    ## Krajca-Outrata-Vychodil algorithm
+    @staticmethod
+    def _clarify(attrs):
+        """ Merge the attributes with the same extent and sort them by
+        support, attributes are `(blocked, attrs, extent)`
+        """
+        merged = {}
+        for blocked, ybits, ext in attrs:
+            if ext in merged:
+                merged[ext][0] = merged[ext][0] or blocked
+                merged[ext][1] |= ybits
+            else:
+                merged[ext] = [blocked, ybits, ext]
+        attrs = list(merged.values())
+        attrs.sort(key=lambda attr: popcount(attr[2]))
+        return _ReducedContext(attrs)
+
+    def _reduce(self, context, pos):
+        """ Closure of the attribute `context.attrs[pos]` in a reduced
+        context, returns the new extent, the added intent and the new reduced
+        context (None if the closure is not canonical)
+        """
+        attrs = context.attrs
+        new_extent = attrs[pos][2]
+        if new_extent == 0 or len(attrs) <= _SCAN_LIMIT:
+            positions = range(len(attrs))
+        else:
+            # only the attributes of the objects of new_extent are visited,
+            # all the others have an empty extent in the new context
+            where = context.where()
+            touched = 0
+            for obj in iter_bits(new_extent):
+                touched |= self.rows[obj]
+            positions = []
+            while touched:
+                low = touched & -touched
+                num = where.get(low.bit_length() - 1)
+                if num is None:
+                    touched ^= low
+                else:
+                    positions.append(num)
+                    touched &= ~attrs[num][1]
+            positions.sort()
+        added = 0
+        rest = []
+        touched_y, before, blocked_after = 0, 0, 0
+        for num in positions:
+            blocked, ybits, ext = attrs[num]
+            touched_y |= ybits
+            if num < pos:
+                before += 1
+            elif blocked:
+                blocked_after += 1
+            if num >= pos and new_extent & ~ext == 0:
+                if blocked:
+                    return None
+                added |= ybits
+            else:
+                rest.append((blocked or num < pos, ybits, ext & new_extent))
+        if len(positions) < len(attrs):
+            blocked = before < pos or context.blocked_after(pos) > blocked_after
+            rest.append((blocked, context.all_attrs() & ~touched_y, 0))
+        return new_extent, added, self._clarify(rest)
+
+    def iter_krajca(self):
+        """ Iterates over all the concepts `(extent, intent)` as bitsets.
+
+        The search tree is explored depth first with an explicit stack, so the
+        depth of the lattice is not limited by the python recursion limit.
+        """
+        context = self._clarify([(False, 1 << attr, column) for attr, column in enumerate(self.columns)])
+        intent = 0
+        # attributes connected to all objects are in the first intent
+        for blocked, ybits, ext in context.attrs:
+            if ext == self.all_objs:
+                intent |= ybits
+        context = _ReducedContext([attr for attr in context.attrs if attr[2] != self.all_objs])
+        yield self.all_objs, intent
+        stack = [(intent, context, 0)]
+        while stack:
+            intent, context, pos = stack.pop()
+            while pos < len(context.attrs):
+                if not context.attrs[pos][0]:
+                    reduced = self._reduce(context, pos)
+                    if reduced is not None:
+                        new_extent, added, new_context = reduced
+                        yield new_extent, intent | added
+                        stack.append((intent, context, pos + 1))
+                        stack.append((intent | added, new_context, 0))
+                        break
+                pos += 1
+
+    ## FCbO algorithm
+    def iter_fcbo(self, min_support=0):
+        """ Iterates over the concepts `(extent, intent)` (as bitsets) with at
+        least `min_support` objects, with the FCbO algorithm:
+
+        J. Outrata and V. Vychodil, “Fast algorithm for computing fixpoints of
+        Galois connections induced by object-attribute relational data,”
+        Information Sciences, vol. 185, no. 1, p. 114–127, 2012.
+
+        As the support decreases along the search tree, branches under the
+        support are pruned.
+
+        >>> context = BitsetContext.from_relation([[0,1,1], [1,1,1], [1,1,0]])
+        >>> sorted(context.decode(*concept) for concept in context.iter_fcbo())
+        [((0, 1), (1, 2)), ((0, 1, 2), (1,)), ((1,), (0, 1, 2)), ((1, 2), (0, 1))]
+        >>> sorted(context.decode(*concept) for concept in context.iter_fcbo(min_support=2))
+        [((0, 1), (1, 2)), ((0, 1, 2), (1,)), ((1, 2), (0, 1))]
+        """
+        for concept in self._fcbo_roots(min_support):
+            yield concept
+        stack = [self._fcbo_root()]
+        for concept in self._iter_fcbo_from(stack, max(min_support, 1)):
+            yield concept
+
+    def _fcbo_roots(self, min_support):
+        """ Concepts that are not reached from an attribute by FCbO: the one
+        with all the objects and the one without object
+        """
+        if popcount(self.all_objs) < min_support:
+            return
+        extent = self.all_objs
+        yield extent, self.intent(extent)
+        if min_support <= 0 and extent and self.extent(self.all_attrs) == 0:
+            yield 0, self.all_attrs
+
+    def _fcbo_root(self):
+        """ Root state of the FCbO search tree: `(extent, intent, first
+        attribute, failed intents by attribute)`
+        """
+        return (self.all_objs, self.intent(self.all_objs), 0, {})
+
+    def _fcbo_children(self, state, min_support):
+        """ States of the children of a FCbO search tree node """
+        rows, columns = self.rows, self.columns
+        extent, intent, start, failed = state
+        # only attributes of the objects can give a not empty extent
+        candidates = 0
+        for obj in iter_bits(extent):
+            candidates |= rows[obj]
+        candidates &= ~intent & ~((1 << start) - 1)
+        children = []
+        new_failed = failed
+        for attr in iter_bits(candidates):
+            before = (1 << attr) - 1
+            # canonicity already failed in an upper branch
+            if attr in failed and failed[attr] & before & ~intent:
+                continue
+            new_extent = extent & columns[attr]
+            if popcount(new_extent) < min_support:
+                continue
+            new_intent = self.all_attrs
+            for obj in iter_bits(new_extent):
+                new_intent &= rows[obj]
+            if (new_intent ^ intent) & before == 0:
+                children.append((new_extent, new_intent, attr + 1))
+            else:
+                if new_failed is failed:
+                    new_failed = dict(failed)
+                new_failed[attr] = new_intent
+        return [(new_extent, new_intent, new_start, new_failed)
+                    for new_extent, new_intent, new_start in children]
+
+    def _iter_fcbo_from(self, stack, min_support):
+        """ Concepts under the FCbO search tree nodes of `stack` (depth first) """
+        while stack:
+            children = self._fcbo_children(stack.pop(), min_support)
+            for new_extent, new_intent, _, _ in children:
+                yield new_extent, new_intent
+            stack.extend(reversed(children))
+
+    def fcbo(self, min_support=0):
+        """ Concepts with at least `min_support` objects, as a set of
+        `(objects, attributes)` tuples
+        """
+        return set(self.decode(extent, intent) for extent, intent in self.iter_fcbo(min_support))
+
+    def krajca(self):
+        """ All the concepts, as a set of `(objects, attributes)` tuples (same
+        result as :meth:`.DenseContextKOV.krajca`)
+        """
+        return set(self.decode(extent, intent) for extent, intent in self.iter_krajca())
+
+
+## Iceberg lattice
+#: under this number of objects, the stability is computed exactly
+_EXACT_STABILITY = 8
+
+def stability(context, extent, intent):
+    """ Approximate stability index of a concept, the proportion of the subsets
+    of the extent whose intent is the concept's intent.
+
+    It is computed exactly for small extents (see `_EXACT_STABILITY`),
+    else the lower bound `1 - sum(2 ** -(|A| - |D|))` is used, over the
+    extents `D` of the lower neighbours of the concept (Roth, Obiedkov and
+    Kourie 2008 ; Buzmakov, Kuznetsov and Napoli 2014).
+
+    >>> context = BitsetContext.from_relation([[1,1,0], [1,0,1], [1,0,0], [0,0,1]])
+    >>> stability(context, 0b0111, 0b001)    # 'a' extent: objects 0, 1, 2
+    0.625
+    >>> stability(context, 0b0001, 0b011)    # only the object 0 has 'a' and 'b'
+    0.5
+    """
+    objs = list(iter_bits(extent))
+    if len(objs) <= _EXACT_STABILITY:
+        # intents of all the subsets of the extent
+        intents = [context.all_attrs]
+        for obj in objs:
+            intents.extend([sub_intent & context.rows[obj] for sub_intent in intents])
+        return intents.count(intent) / float(len(intents))
+    if intent == context.all_attrs:
+        return 1.
+    # extents of the lower neighbours are the maximal ones among extent & m',
+    # only the attributes of the objects can give a not empty one
+    touched = 0
+    for obj in objs:
+        touched |= context.rows[obj]
+    below = set(extent & context.columns[attr] for attr in iter_bits(touched & ~intent))
+    below = sorted(below, key=popcount, reverse=True) or [0]
+    maximal = []
+    for sub in below:
+        if not any(sub & ~other == 0 for other in maximal):
+            maximal.append(sub)
+    return max(0., 1. - sum(2. ** (popcount(sub) - len(objs)) for sub in maximal))
+
+
+def top_concepts(context, top, rank="support", min_support=1, memory_budget=0):
+    """ The `top` best concepts of the iceberg lattice (concepts with at least
+    `min_support` objects), ranked by support or by approximate
+    :func:`stability`.
+
+    When ranking by support, the support threshold is raised to the support of
+    the worst kept concept, so the FCbO search tree is pruned more and more.
+
+    :param top: number of concepts kept
+    :param rank: 'support' or 'stability'
+    :param min_support: minimum number of objects of the concepts
+    :param memory_budget: maximum size (in bytes) of the kept concepts (0 for
+        no limit), the worst concepts are dropped if it is exceeded
+    :returns: list of `(extent, intent, score)` (bitsets) by decreasing score
+
+    >>> context = BitsetContext.from_relation(
+    ...     [[0,1,1,1,0,0],
+    ...      [1,1,0,0,0,1],
+    ...      [0,1,0,1,1,0],
+    ...      [1,0,1,0,1,0],
+    ...     ])
+    >>> [(context.decode(extent, intent), score) for extent, intent, score in top_concepts(context, 3)]
+    [(((0, 1, 2, 3), ()), 4), (((0, 1, 2), (1,)), 3), (((1, 3), (0,)), 2)]
+    >>> [score for _, _, score in top_concepts(context, 3, rank="stability", min_support=2)]
+    [0.375, 0.25, 0.25]
+    """
+    if rank not in ("support", "stability"):
+        raise ValueError("Unknown concept ranking: '%s'" % rank)
+    heap = []
+    size = [0]
+    threshold = [max(min_support, 1)]
+    capacity = [top]
+
+    def concept_size(extent, intent):
+        return sys.getsizeof(extent) + sys.getsizeof(intent) + 120
+
+    def offer(extent, intent):
+        if rank == "support":
+            score = popcount(extent)
+        else:
+            score = stability(context, extent, intent)
+        entry = (score, -len(size), extent, intent)
+        size.append(None)   # counter, older concepts first for equal scores
+        if len(heap) < capacity[0]:
+            heapq.heappush(heap, entry)
+            size[0] += concept_size(extent, intent)
+        elif heap and entry > heap[0]:
+            _, _, old_extent, old_intent = heapq.heapreplace(heap, entry)
+            size[0] += concept_size(extent, intent) - concept_size(old_extent, old_intent)
+        if memory_budget and size[0] > memory_budget:
+            while heap and size[0] > memory_budget:
+                _, _, old_extent, old_intent = heapq.heappop(heap)
+                size[0] -= concept_size(old_extent, old_intent)
+            # less concepts are kept from now on
+            capacity[0] = len(heap)
+            _logger.warning("Concepts memory budget exceeded, only %d concepts kept" % len(heap))
+        if rank == "support" and heap and len(heap) >= capacity[0]:
+            threshold[0] = max(threshold[0], heap[0][0] + 1)
+
+    if top <= 0:
+        return []
+    for extent, intent in context._fcbo_roots(min_support):
+        if popcount(extent) >= min_support:
+            offer(extent, intent)
+    if popcount(context.all_objs) >= threshold[0]:
+        stack = [context._fcbo_root()]
+        while stack:
+            children = context._fcbo_children(stack.pop(), threshold[0])
+            for new_extent, new_intent, _, _ in children:
+                offer(new_extent, new_intent)
+            # largest supports are explored first
+            children.sort(key=lambda state: popcount(state[0]))
+            stack.extend(children)
+    return [(extent, intent, score) for score, _, extent, intent in sorted(heap, reverse=True)]
+
+
+## Parallel enumeration
+_worker_context = None
+
+def _init_worker(context):
+    global _worker_context
+    _worker_context = context
+
+def _fcbo_branch(args):
+    """ All the concepts of a FCbO branch (computed in a worker process) """
+    state, min_support = args
+    return list(_worker_context._iter_fcbo_from([state], min_support))
+
+
+def iter_concepts(context, min_support=0, processes=1, split_depth=1, max_concepts=0):
+    """ Iterates over the concepts `(extent, intent)` (bitsets) of a context
+    with the FCbO algorithm (see :meth:`BitsetContext.iter_fcbo`).
+
+    The search tree is split at its first `split_depth` levels, and the
+    branches are distributed over a pool of `processes` processes (the
+    concepts of a branch are sent back when it is done). The order of the
+    concepts depends on the branches completion.
+
+    :param min_support: minimum number of objects of the concepts
+    :param processes: number of processes, 1 to compute all in the current
+        process, None for the number of CPUs
+    :param split_depth: depth of the search tree split
+    :param max_concepts: maximum number of concepts generated (0 for no limit),
+        the pool is stopped when reached
+
+    >>> context = BitsetContext.from_relation(
+    ...     [[0,1,1,1,0,0],
+    ...      [1,1,0,0,0,1],
+    ...      [0,1,0,1,1,0],
+    ...      [1,0,1,0,1,0],
+    ...     ])
+    >>> concepts = set(iter_concepts(context, processes=2))
+    >>> concepts == set(context.iter_krajca())
+    True
+    >>> len(list(iter_concepts(context, processes=2, max_concepts=4)))
+    4
+    """
+    from itertools import islice
+    concepts = _iter_concepts(context, min_support, processes, split_depth)
+    if max_concepts:
+        concepts = islice(concepts, max_concepts)
+    for concept in concepts:
+        yield concept
+
+def _iter_concepts(context, min_support, processes, split_depth):
+    for concept in context._fcbo_roots(min_support):
+        yield concept
+    if popcount(context.all_objs) < min_support:
+        return
+    min_support = max(min_support, 1)
+    if processes == 1:
+        for concept in context._iter_fcbo_from([context._fcbo_root()], min_support):
+            yield concept
+        return
+    # first levels computed here, breadth first
+    branches = [context._fcbo_root()]
+    for _ in range(split_depth):
+        children = []
+        for state in branches:
+            children.extend(context._fcbo_children(state, min_support))
+        for extent, intent, _, _ in children:
+            yield extent, intent
+        branches = children
+    if not branches:
+        return
+    from multiprocessing import Pool, cpu_count
+    processes = processes or cpu_count()
+    pool = Pool(processes, initializer=_init_worker, initargs=(context,))
+    try:
+        tasks = [(state, min_support) for state in branches]
+        # small chunks, branches sizes are very different
+        chunksize = max(1, len(tasks) // (processes * 16))
+        for concepts in pool.imap_unordered(_fcbo_branch, tasks, chunksize=chunksize):
+            for concept in concepts:
+                yield concept
+    finally:
+        # also stops the workers if the generator is not consumed to the end
+        pool.terminate()
+
+
+#: under this number of attributes, a reduced context is simply scanned
+_SCAN_LIMIT = 32
+
+
+class _ReducedContext(object):
+    """ Attributes `(blocked, attrs, extent)` of a reduced context, sorted by
+    support, with lazily built indexes
+    """
+    __slots__ = ("attrs", "_where", "_all_attrs", "_blocked_after")
+
+    def __init__(self, attrs):
+        self.attrs = attrs
+        self._where = None
+
+    def _index(self):
+        self._where = {}
+        self._all_attrs = 0
+        self._blocked_after = [0] * (len(self.attrs) + 1)
+        for num in range(len(self.attrs) - 1, -1, -1):
+            blocked, ybits, ext = self.attrs[num]
+            self._all_attrs |= ybits
+            self._blocked_after[num] = self._blocked_after[num + 1] + bool(blocked)
+            if ext:
+                for attr in iter_bits(ybits):
+                    self._where[attr] = num
+
+    def where(self):
+        """ Position of the attribute group of each attribute (with a not
+        empty extent)
+        """
+        if self._where is None:
+            self._index()
+        return self._where
+
+    def all_attrs(self):
+        """ Union of all the attributes """
+        if self._where is None:
+            self._index()
+        return self._all_attrs
+
+    def blocked_after(self, pos):
+        """ Number of blocked attribute groups from position `pos` """
+        if self._where is None:
+            self._index()
+        return self._blocked_after[pos]
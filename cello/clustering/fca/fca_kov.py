@@ -5,9 +5,13 @@
 P. Krajca, J. Outrata, and V. Vychodil, “Computing Formal Concepts by Attribute Sorting,” Fundamenta Informaticae, vol. 115, no. 4, p. 395–417, 2012.
 """
 
+from builtins import range
+
 import sys
 import igraph as ig
 
+from cello.clustering.fca.fca_bitset import BitsetContext, iter_concepts, top_concepts
+
 class RContext:
     """ R-Context object
     """
@@ -37,7 +41,7 @@ class RContext:
             new_attrs[sign].append(attr)
         
         new_attrs = [(sum(n for n, _ in elems), frozenset(attr for _, attrs in elems for attr in attrs))
-                        for elems in new_attrs.itervalues()]
+                        for elems in new_attrs.values()]
 
         self.attrs = new_attrs
 
@@ -195,7 +199,7 @@ class DenseContextKOV(AbstractKOV):
     def get_initial_rcontext(self):
         objs = range(self._nb_obj)
         attrs = [(0, frozenset([attr])) for attr in range(self._nb_attr)]
-        sort_fct = lambda val: len([1 for obj in xrange(self._nb_obj) if self.connected(obj, val[1])])
+        sort_fct = lambda val: len([1 for obj in range(self._nb_obj) if self.connected(obj, val[1])])
         attrs.sort(key=sort_fct)
         return RContext(self, objs, attrs)
 
@@ -254,40 +258,89 @@ class IGraphKOV(AbstractKOV):
 
 def compute_concepts_kov(bigraph):
     """ Compute the concepts of the given bigraph using the KOV algorithm
+
+    .. note:: concepts are computed on bitsets by
+        :class:`cello.clustering.fca.fca_bitset.BitsetContext`, it gives the
+        same concepts as :class:`IGraphKOV` much faster
     """
-    R = IGraphKOV(bigraph)
-    res = R.krajca()
-    return res
+    return BitsetContext.from_bigraph(bigraph).krajca()
 
 
 ################################################################################
 from cello.graphs.builder import GraphBuilder
 
 class ConceptsBigraph(GraphBuilder):
-    def __init__(self):
+    """ Bigraph between objects and concepts of a bigraph
+
+    The concepts are streamed from :func:`.fca_bitset.iter_concepts` and the
+    graph is built as they come.
+
+    >>> g = ig.Graph.Formula("A:B:C--a:b, A:B--c, C--d")
+    >>> g.vs["type"] = [vtx["name"].isupper() for vtx in g.vs]
+    >>> cgraph = build_concept_bigraph(g)
+    >>> cgraph["nb_concepts"]
+    3
+    >>> sorted(cgraph.vs.select(type=False)["concept"])
+    [((0, 1), (3, 4, 5)), ((0, 1, 2), (3, 4)), ((2,), (3, 4, 6))]
+
+    Only the `top` most frequent (or stable) concepts of the iceberg lattice
+    can be computed (see :func:`.fca_bitset.top_concepts`), their score is
+    then stored:
+
+    >>> cgraph = build_concept_bigraph(g, top=2, min_support=2)
+    >>> cgraph.vs.select(type=False)["concept"], cgraph.vs.select(type=False)["score"]
+    ([((0, 1, 2), (3, 4)), ((0, 1), (3, 4, 5))], [3, 2])
+    """
+    def __init__(self, min_support=0, processes=1, max_concepts=0, top=0, rank="support", memory_budget=0):
+        """
+        :param min_support: minimum number of objects of the concepts
+        :param processes: number of processes used to compute the concepts
+        :param max_concepts: maximum number of concepts computed (0 for no
+            limit)
+        :param top: if not 0, only the `top` best concepts are kept
+        :param rank: concepts ranking for `top`: 'support' or 'stability'
+        :param memory_budget: maximum size (in bytes) of the `top` concepts
+            (0 for no limit)
+        """
         GraphBuilder.__init__(self, False)
+        self.min_support = min_support
+        self.processes = processes
+        self.max_concepts = max_concepts
+        self.top = top
+        self.rank = rank
+        self.memory_budget = memory_budget
         self.declare_vattr("type") # True: object, False: concepts
         self.declare_vattr("concept")
+        self.declare_vattr("score")
         # edges attributes
         self.declare_eattr("nbp")
         self.declare_eattr("nbo")
         self.declare_eattr("dot")
 
     def _parse(self, bigraph):
-        concepts = compute_concepts_kov(bigraph)
+        context = BitsetContext.from_bigraph(bigraph)
+        if self.top:
+            concepts = top_concepts(context, self.top, rank=self.rank,
+                                    min_support=self.min_support, memory_budget=self.memory_budget)
+        else:
+            concepts = ((extent, intent, None) for extent, intent in
+                            iter_concepts(context, min_support=self.min_support,
+                                          processes=self.processes, max_concepts=self.max_concepts))
         # add the objects
         for vtx in bigraph.vs.select(type=True):
             gid_obj = self.add_get_vertex(vtx.index)
             assert gid_obj == vtx.index, "Object id (%d) different from old id (%d)" % (gid_obj, vtx.index)
             self.set_vattr(gid_obj, "type", True)
         nb_concepts = 0
-        for cid, concept in enumerate(concepts):
-            objs, props = concept
-            if len(objs) == 0 or len(props) == 0:
+        for cid, (extent, intent, score) in enumerate(concepts):
+            if not extent or not intent:
                 continue
+            concept = context.decode(extent, intent)
+            objs, props = concept
             gid_concept = self.add_get_vertex("c%d" % cid)
             self.set_vattr(gid_concept, "type", False)
             self.set_vattr(gid_concept, "concept", concept)
+            self.set_vattr(gid_concept, "score", score)
             for obj in objs:
                 gid_obj = self.add_get_vertex(obj)
                 eid = self.add_get_edge(gid_concept, gid_obj)
@@ -295,11 +348,14 @@ class ConceptsBigraph(GraphBuilder):
                 self.set_eattr(eid, "nbp", len(props))
                 self.set_eattr(eid, "dot", len(props)*len(objs))
             nb_concepts += 1
-        self.set_gattr("nb_concepts", nb_concepts)
+        self.set_gattrs(nb_concepts=nb_concepts)
 
 
-def build_concept_bigraph(bigraph):
-    gbuilder = ConceptsBigraph()
+def build_concept_bigraph(bigraph, **kwargs):
+    """ Build the bigraph between objects and concepts, see
+    :class:`ConceptsBigraph` for the options
+    """
+    gbuilder = ConceptsBigraph(**kwargs)
     return gbuilder.build_graph(bigraph)
 
 ################################################################################
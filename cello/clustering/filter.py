@@ -2,7 +2,27 @@
 """ :mod:`cello.clustering.filter`
 ==================================
 
+All the filters of this module work either on a :class:`igraph.VertexCover`
+or on a :class:`CompactCover`. In the second case clusters are only flagged
+and the new cover is built once at the end of the filter chain:
+
+>>> g = ig.Graph.Formula("a, b, c, d, a:b:c--A:B:C:D, d--D:E, c:d--F")
+>>> g.vs["type"] = [vtx["name"].islower() for vtx in g.vs]
+>>> cover = ig.VertexCover(g, [[0, 1, 2, 4, 5], [0, 1, 4], [3], [3, 4, 5], [6, 7]])
+>>> filters = DeferCoverRebuild() | TooSmall() | TooFewDoc() | OtherInMisc() | RebuildCover()
+>>> cover = filters(cover, min_vtx=3, min_doc=2)
+>>> list(cover)
+[[0, 1, 2, 4, 5], [0, 1, 4], [3, 4, 5, 6, 7, 8, 9]]
+>>> cover.misc_cluster
+2
+
+Other components (that are not filters) may also be called on a
+:class:`CompactCover`, the cover is then rebuilt before (see
+:meth:`CompactCover.__getattr__`).
 """
+from itertools import chain
+
+import numpy as np
 import igraph as ig
 
 from reliure.types import Numeric
@@ -10,6 +30,191 @@ from reliure import Optionable, Composable
 
 from functools import update_wrapper
 
+
+class CompactCover(object):
+    """ Compact view of a :class:`igraph.VertexCover`: the clusters are stored
+    in CSR form (`offsets` and a flat `members` array), clusters moved in misc
+    are only flagged.
+
+    >>> g = ig.Graph.Formula("0:1--1:2:3, 4--5")
+    >>> ccover = CompactCover(ig.VertexCover(g, [[0, 1, 2], [3], [1, 4]]))
+    >>> ccover.sizes()
+    array([3, 1, 2])
+    >>> len(ccover), ccover[2]
+    (3, [1, 4])
+    >>> ccover.membership_count()
+    array([1, 2, 1, 1, 1, 0])
+    >>> ccover.move_to_misc([False, True, True])
+    3
+    >>> ccover.membership_count()
+    array([1, 2, 1, 1, 1, 0])
+    >>> cover = ccover.to_cover()
+    >>> list(cover), cover.misc_cluster
+    ([[0, 1, 2], [1, 3, 4]], 1)
+
+    Any other attribute access rebuilds the cover:
+
+    >>> ccover.membership
+    [[0], [0, 1], [0], [1], [1], []]
+    """
+    def __init__(self, cover):
+        """
+        :param cover: the cover to view
+        :type cover: :class:`igraph.VertexCover`
+        """
+        self.cover = cover
+        self.graph = cover.graph
+        clusters = [list(cluster) for cluster in cover]
+        self.offsets = np.zeros(len(clusters) + 1, dtype=np.int64)
+        np.cumsum([len(cluster) for cluster in clusters], out=self.offsets[1:])
+        self.members = np.fromiter(chain.from_iterable(clusters), dtype=np.int64,
+                                    count=self.offsets[-1])
+        self.alive = np.ones(len(clusters), dtype=bool)
+        misc_cluster = getattr(cover, "misc_cluster", None)
+        self.misc_cluster = -1 if misc_cluster is None else misc_cluster
+        self._misc = None       # all misc vertices, once misc changed
+        self._misc_last = False # misc is moved at the end of the clusters
+        self._rebuilt = None
+
+    @staticmethod
+    def wrap(cover):
+        """ Returns `cover` if it is already a :class:`CompactCover`, else a
+        new :class:`CompactCover` over it.
+        """
+        if isinstance(cover, CompactCover):
+            return cover
+        return CompactCover(cover)
+
+    def __getattr__(self, name):
+        """ Any attribute not defined here is the one of the rebuilt cover
+        """
+        if name in ("cover", "graph", "offsets", "members", "alive", "misc_cluster",
+                    "_misc", "_misc_last", "_rebuilt"):
+            raise AttributeError(name)
+        return getattr(self.to_cover(), name)
+
+    def __len__(self):
+        return len(self.alive)
+
+    def cluster(self, cid):
+        """ Members of the (original) cluster `cid` """
+        return self.members[self.offsets[cid]:self.offsets[cid + 1]]
+
+    def __getitem__(self, cid):
+        """ Members (list) of the (original) cluster `cid` """
+        return self.cluster(cid).tolist()
+
+    def __iter__(self):
+        """ Iterates over the original clusters (moved or not) """
+        for cid in range(len(self)):
+            yield self.cluster(cid).tolist()
+
+    def sizes(self):
+        """ Size of each (original) cluster """
+        return np.diff(self.offsets)
+
+    def _member_cids(self):
+        return np.repeat(np.arange(len(self)), self.sizes())
+
+    def count_in(self, vmask):
+        """ Number of members of each (original) cluster for which `vmask` is
+        True
+        """
+        vmask = np.asarray(vmask, dtype=bool)
+        return np.bincount(self._member_cids(), weights=vmask[self.members],
+                           minlength=len(self)).astype(np.int64)
+
+    def misc(self):
+        """ Vertices in the misc cluster """
+        if self._misc is not None:
+            return self._misc
+        if 0 <= self.misc_cluster < len(self):
+            return self.cluster(self.misc_cluster)
+        return np.zeros(0, dtype=np.int64)
+
+    def membership_count(self):
+        """ Number of (not moved) clusters of each vertex, misc included """
+        alive = self.alive[self._member_cids()]
+        if self.misc_cluster >= 0:
+            alive &= self._member_cids() != self.misc_cluster
+        counts = np.bincount(self.members[alive], minlength=self.graph.vcount())
+        counts[self.misc()] += 1
+        return counts
+
+    def add_to_misc(self, vids):
+        """ Add vertices to the misc cluster (created if needed) """
+        vids = np.asarray(vids, dtype=np.int64)
+        if len(vids) == 0:
+            return
+        if self.misc_cluster < 0:
+            self.misc_cluster = len(self)
+            self._misc_last = True
+        self._misc = np.union1d(self.misc(), vids)
+        self._rebuilt = None
+
+    def move_to_misc(self, cmask):
+        """ Move the clusters flagged in `cmask` in the misc cluster.
+
+        :returns: the number of vertices of the moved clusters
+        """
+        cmask = np.asarray(cmask, dtype=bool) & self.alive
+        if 0 <= self.misc_cluster < len(self):
+            cmask[self.misc_cluster] = False
+        moved = self.members[cmask[self._member_cids()]]
+        if len(moved):
+            self.alive &= ~cmask
+            self._misc_last = True
+            self.add_to_misc(moved)
+        return len(np.unique(moved))
+
+    def to_cover(self):
+        """ Builds the cover (returns the original one if nothing changed)
+        """
+        if self._misc is None:
+            return self.cover
+        if self._rebuilt is not None:
+            return self._rebuilt
+        misc = self._misc.tolist()
+        clusters = [self.cluster(cid).tolist() for cid in np.flatnonzero(self.alive)
+                        if cid != self.misc_cluster]
+        if self._misc_last:
+            misc_id = len(clusters)
+            clusters.append(misc)
+        else:
+            # nothing removed, misc stays at its place
+            misc_id = self.misc_cluster
+            clusters[misc_id:misc_id] = [misc]
+        cover = ig.VertexCover(self.graph, clusters)
+        cover.misc_cluster = misc_id
+        self._rebuilt = cover
+        return cover
+
+
+class DeferCoverRebuild(Composable):
+    """ Wraps a cover in a :class:`CompactCover`, so that the following
+    filters do not rebuild it. Should be used with :class:`RebuildCover`.
+    """
+    def __call__(self, cover):
+        return CompactCover.wrap(cover)
+
+
+class RebuildCover(Composable):
+    """ Builds the cover of a :class:`CompactCover` (do nothing on an
+    :class:`igraph.VertexCover`).
+    """
+    def __call__(self, cover):
+        if isinstance(cover, CompactCover):
+            cover = cover.to_cover()
+        return cover
+
+
+def _filtered(cover, view):
+    """ Returns the filter result: the view if a view was given, else the
+    rebuilt cover.
+    """
+    return view if view is cover else view.to_cover()
+
+
 class OtherInMisc(Composable):
     """ Add all vertices that have no clusters in 'misc' cluster
     
@@ -37,20 +242,10 @@ class OtherInMisc(Composable):
         super(OtherInMisc, self).__init__()
 
     def __call__(self, cover):
+        view = CompactCover.wrap(cover)
         # recupere les sommets n'ayant pas de cluster dans le misc
-        new_misc = [idx for idx, member in enumerate(cover.membership) \
-                    if len(member) == 0]
-        
-        if len(new_misc):
-            # check misc
-            if not hasattr(cover, 'misc_cluster'):
-                misc_id = len(cover)
-                new_clusters = list(cover) + [new_misc]
-                cover = ig.VertexCover(cover.graph, new_clusters)
-                cover.misc_cluster = misc_id
-            else:
-                cover[cover.misc_cluster].extend(new_misc)
-        return cover
+        view.add_to_misc(np.flatnonzero(view.membership_count() == 0))
+        return _filtered(cover, view)
 
 
 class AbstractClusterFilter(Optionable):
@@ -80,6 +275,14 @@ class AbstractClusterFilter(Optionable):
     [[0, 1], [0, 2], [0], [2], [1, 2], [1]]
     >>> cover[cover.misc_cluster]
     [1, 3, 4]
+
+    The `cover` given to the filter function is a :class:`CompactCover`, its
+    clusters can be indexed as the ones of a :class:`igraph.VertexCover`:
+
+    >>> filter = lambda cover, num, cluster: len(cover[num]) < 2
+    >>> cover = AbstractClusterFilter(mv_in_misc=filter)(ig.VertexCover(g, [[0, 1, 2], [3]]))
+    >>> list(cover), cover.misc_cluster
+    ([[0, 1, 2], [3]], 1)
     """
     def __init__(self, name=None, mv_in_misc=None):
         """
@@ -99,31 +302,21 @@ class AbstractClusterFilter(Optionable):
         else:
             raise NotImplementedError
 
+    def mv_in_misc_mask(self, ccover, **kwargs):
+        """ Returns a mask of the clusters (of the :class:`CompactCover`) to
+        move in misc. By default :func:`mv_in_misc` is called on each cluster,
+        subclasses may override it with a vectorised version.
+        """
+        return np.array([self.mv_in_misc(ccover, num, cluster, **kwargs)
+                            for num, cluster in enumerate(ccover)], dtype=bool)
+
     @Optionable.check
     def __call__(self, cover, **kwargs):
         self._logger.debug("Filter cluster, kwargs: %s" % (kwargs))
-        misc_id = -1
-        if hasattr(cover, 'misc_cluster'):
-            misc_id = cover.misc_cluster
-        new_clusters = []
-        new_misc = set()
-        for num, cluster in enumerate(cover):
-            if num == misc_id: # already in misc
-                continue
-            # should we mv it ?
-            if self.mv_in_misc(cover, num, cluster, **kwargs):
-                new_misc.update(cluster)
-            else: # we keep it
-                new_clusters.append(cluster)
-        
-        self._logger.info("Cluster misc with %d new vertices" % len(new_misc))
-        if len(new_misc):
-            if misc_id >= 0: # already a misc
-                new_misc.update(cover[misc_id])
-            new_misc = list(new_misc)
-            cover = ig.VertexCover(cover.graph, new_clusters + [new_misc])
-            cover.misc_cluster = len(new_clusters)
-        return cover
+        view = CompactCover.wrap(cover)
+        moved = view.move_to_misc(self.mv_in_misc_mask(view, **kwargs))
+        self._logger.info("Cluster misc with %d new vertices" % moved)
+        return _filtered(cover, view)
 
 class TooSmall(AbstractClusterFilter):
     """ Merge clusters that are 'too' small in a misc cluster
@@ -163,6 +356,9 @@ class TooSmall(AbstractClusterFilter):
     def mv_in_misc(self, cover, num, cluster, min_vtx=None):
         return len(cluster) < min_vtx
 
+    def mv_in_misc_mask(self, ccover, min_vtx=None):
+        return ccover.sizes() < min_vtx
+
 
 class TooFewDoc(AbstractClusterFilter):
     """ Merge clusters that have 'too' few documents in a misc cluster.
@@ -197,7 +393,7 @@ class TooFewDoc(AbstractClusterFilter):
     2
     >>> cover = too_few_doc(cover)
     >>> list(cover)
-    [[0, 1, 2, 4, 5], [8, 9, 3, 6, 7]]
+    [[0, 1, 2, 4, 5], [3, 6, 7, 8, 9]]
     >>> cover.misc_cluster
     1
     """
@@ -210,4 +406,8 @@ class TooFewDoc(AbstractClusterFilter):
         graphvs = cover.graph.vs
         return len([1 for cid in cluster if graphvs[cid]["type"]]) < min_doc
 
+    def mv_in_misc_mask(self, ccover, min_doc=None):
+        is_doc = np.array(ccover.graph.vs["type"], dtype=bool)
+        return ccover.count_in(is_doc) < min_doc
+
 
@@ -9,6 +9,7 @@ SubModules
 
     cello.clustering.labelling.model
     cello.clustering.labelling.basic
+    cello.clustering.labelling.corpus
 
 """
 
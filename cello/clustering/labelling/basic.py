@@ -9,11 +9,14 @@ Classes
 #from __future__ import unicode_literals
 import six
 
+import heapq
 from itertools import chain
+import numpy as np
+import scipy.sparse as sp
 import igraph as ig
 
 from reliure import Optionable, Composable
-from reliure.types import Text
+from reliure.types import Text, Numeric
 
 from cello.clustering.labelling import Label, LabelledVertexCover
 
@@ -61,6 +64,16 @@ class VertexAsLabel(Optionable):
     [0] a, A, C (labels: one, two, one, three)
     [1] b, B (labels: b, Bé)
 
+    Only the `top_k` best scored labels of each cluster may be kept (ordered
+    by decreasing score), with a bounded heap:
+
+    >>> vtx_to_label = lambda graph, cluster, vtx: Label(vtx["name"], vtx.index)
+    >>> labeller = VertexAsLabel(vtx_to_label)
+    >>> g = ig.Graph.Formula("a--A:B:C, b--A:B, c--C:D")
+    >>> vcover = labeller(ig.VertexCover(g, [[0,1,2,3,4], [5,3,6]]), top_k=2)
+    >>> vcover.labels[1]
+    [Label('D', 6), Label('c', 5)]
+
     .. note:: this class may also be use by inheritance, see
         :class:`TypeFalseLabel` for an example.
 
@@ -88,6 +101,8 @@ class VertexAsLabel(Optionable):
         if vtx_to_label is not None and not callable(vtx_to_label):
             raise TypeError("argument 'vtx_to_label' should be None or sould be callable")
         self._vtx_to_label = vtx_to_label
+        self.add_option("top_k", Numeric(default=0, min=0,
+            help="Maximum number of labels per cluster (0 for all)"))
 
     def vtx_to_label(self, graph, cluster, vtx, **kwargs):
         """ Function used to transform a vertex to a label.
@@ -120,7 +135,7 @@ class VertexAsLabel(Optionable):
             raise NotImplementedError
 
     @Optionable.check
-    def __call__(self, vertex_cover, **kwargs):
+    def __call__(self, vertex_cover, top_k=0, **kwargs):
         # if not labelled vertex cover transform it
         if not isinstance(vertex_cover, LabelledVertexCover):
             vertex_cover = LabelledVertexCover.FromVertexCover(vertex_cover)
@@ -132,7 +147,9 @@ class VertexAsLabel(Optionable):
         astuple = lambda x: (x, ) if type(x) == Label else x
         for cid, cluster in enumerate(vertex_cover):
             alllabels = (astuple(self.vtx_to_label(graph, cluster, vs[vtx], **kwargs)) for vtx in cluster)
-            labels = [label for labels in alllabels if labels is not None for label in labels if label is not None]
+            labels = (label for labels in alllabels if labels is not None for label in labels if label is not None)
+            if top_k > 0:
+                labels = heapq.nlargest(top_k, labels, key=lambda label: label.score)
             vertex_cover.add_labels(cid, labels)
         return vertex_cover
 
@@ -175,6 +192,7 @@ class TypeFalseLabel(VertexAsLabel):
     One can chouse the scoring method with an option:
 
     >>> labeller.print_options()
+    top_k (Numeric, default=0): Maximum number of labels per cluster (0 for all)
     score (Text, default=recall, in: {recall, precision}): Label scoring method
 
     the scoring are this:
@@ -194,6 +212,18 @@ class TypeFalseLabel(VertexAsLabel):
     >>> vcover.labels[1]
     [Label('C', 0.5, role='terms'), Label('D', 1.0, role='terms')]
 
+    With `top_k` only the best labels of each cluster are kept, by decreasing
+    score:
+
+    >>> vcover = labeller(ig.VertexCover(g, [[0,1,2,3,4], [5,3,6]]), score=u"recall", top_k=1)
+    >>> vcover.labels
+    [[Label('A', 1.0, role='terms')], [Label('C', 1.0, role='terms')]]
+
+    Scores of all the clusters are computed at once: the overlaps
+    :math:`|\Gamma(v)\,\cap\,C|` are given by the product of the adjacency
+    matrix of the `type=False` vertices with the cluster membership matrix (see
+    :func:`cluster_overlaps`). Labels are stored compactly in the cover (see
+    :meth:`.LabelledVertexCover.add_compact_labels`).
     """
     def __init__(self, vtx_attr, role=None, name=None):
         """ Build the labelling component
@@ -232,6 +262,37 @@ class TypeFalseLabel(VertexAsLabel):
         commun = vois.intersection(cluster)
         return len(commun) / (1.*len(cluster_doc))
 
+    @Optionable.check
+    def __call__(self, vertex_cover, top_k=0, score=u"recall"):
+        if not isinstance(vertex_cover, LabelledVertexCover):
+            vertex_cover = LabelledVertexCover.FromVertexCover(vertex_cover)
+        graph = vertex_cover.graph
+        if not 'type' in graph.vs.attributes():
+            raise ValueError("The graph should be bipartite, and have a 'type' attribute on each vertex")
+        vids, cids, overlaps, degree, nb_top = cluster_overlaps(vertex_cover)
+        # only type=False vertices are labels
+        is_label = ~np.array(graph.vs["type"], dtype=np.bool_)[vids]
+        vids, cids, overlaps = vids[is_label], cids[is_label], overlaps[is_label]
+        if score == u"precision":
+            total = degree[vids]
+        else:
+            total = nb_top[cids]
+        scores = np.divide(overlaps, total, out=np.zeros(len(vids)), where=total > 0)
+        if top_k > 0:
+            # rank of each label in its cluster, by decreasing score
+            order = np.lexsort((-scores, cids))
+            offsets = np.searchsorted(cids[order], np.arange(len(vertex_cover) + 1))
+            keep = order[np.arange(len(order)) - offsets[cids[order]] < top_k]
+            vids, cids, scores = vids[keep], cids[keep], scores[keep]
+        names = graph.vs[self.vtx_attr]
+        offsets = np.searchsorted(cids, np.arange(len(vertex_cover) + 1))
+        for cid in range(len(vertex_cover)):
+            cvids = vids[offsets[cid]:offsets[cid + 1]].tolist()
+            vertex_cover.add_compact_labels(cid, [names[vid] for vid in cvids],
+                                            scores[offsets[cid]:offsets[cid + 1]],
+                                            role=self.role, vtxs=cvids)
+        return vertex_cover
+
     def vtx_to_label(self, graph, cluster, vtx, score=None):
         label = None
         if not 'type' in graph.vs.attributes():
@@ -246,11 +307,60 @@ class TypeFalseLabel(VertexAsLabel):
         return label
 
 
+def cluster_overlaps(vertex_cover):
+    """ Overlaps between the neighbourhood of the vertices and the clusters
+    they belong to, for all the clusters at once.
+
+    :returns: `(vids, cids, overlaps, degree, nb_top)`: `vids` and `cids`
+        give the (vertex, cluster) memberships (ordered by cluster, then as
+        in the cluster), `overlaps` the number of neighbours of the vertex in
+        the cluster, `degree` the number of neighbours of each vertex and
+        `nb_top` the number of `type=True` vertices of each cluster.
+
+    >>> g = ig.Graph.Formula("a--A:B:C, b--A:B, c--C:D")
+    >>> g.vs["type"] = [vtx["name"].islower() for vtx in g.vs]
+    >>> vcover = ig.VertexCover(g, [[0,1,2,3,4], [5,3,6]])
+    >>> vids, cids, overlaps, degree, nb_top = cluster_overlaps(vcover)
+    >>> vids.tolist(), cids.tolist(), overlaps.tolist()
+    ([0, 1, 2, 3, 4, 5, 3, 6], [0, 0, 0, 0, 0, 1, 1, 1], [3, 2, 2, 1, 2, 2, 1, 1])
+    >>> degree.tolist(), nb_top.tolist()
+    ([3, 2, 2, 2, 2, 2, 1], [2, 1])
+    """
+    graph = vertex_cover.graph
+    n, nb_clusters = graph.vcount(), len(vertex_cover)
+    sizes = [len(cluster) for cluster in vertex_cover]
+    vids = np.fromiter(chain.from_iterable(vertex_cover), dtype=np.int64, count=sum(sizes))
+    cids = np.repeat(np.arange(nb_clusters), sizes)
+    membership = sp.csr_matrix((np.ones(len(vids)), (vids, cids)), shape=(n, nb_clusters))
+    # adjacency without multiple edges
+    edges = np.array(graph.get_edgelist(), dtype=np.int64).reshape(-1, 2)
+    adjacency = sp.csr_matrix((np.ones(2 * len(edges)),
+                              (np.concatenate((edges[:, 0], edges[:, 1])),
+                               np.concatenate((edges[:, 1], edges[:, 0])))), shape=(n, n))
+    adjacency.data[:] = 1.
+    degree = np.diff(adjacency.indptr)
+    overlaps = np.asarray((adjacency * membership)[vids, cids]).ravel().astype(np.int64)
+    if "type" in graph.vs.attributes():
+        nb_top = np.bincount(cids, weights=np.array(graph.vs["type"], dtype=np.bool_)[vids],
+                             minlength=nb_clusters).astype(np.int64)
+    else:
+        nb_top = np.zeros(nb_clusters, dtype=np.int64)
+    return vids, cids, overlaps, degree, nb_top
+
+
 @Composable
 def normalize_score_max(vertex_cover, **kwargs):
-    for cid, vertices in enumerate(vertex_cover):
-        labels = vertex_cover.labels[cid]
-        _max = max([ l.score for l in labels ])
-        for label in labels:
-            label.score = label.score / _max
+    """ Divides the scores of the labels of each cluster by the cluster's
+    maximum score
+
+    >>> labeller = VertexAsLabel(lambda graph, cluster, vtx: Label(vtx["name"], vtx.degree()))
+    >>> g = ig.Graph.Formula("a--A:B:C, b--A:B, c--C:D")
+    >>> vcover = labeller(ig.VertexCover(g, [[0,1,2,3,4], [5,3,6]]))
+    >>> normalize_score_max(vcover).labels[1]
+    [Label('c', 1.0), Label('C', 1.0), Label('D', 0.5)]
+    """
+    for cid in range(len(vertex_cover)):
+        scores = vertex_cover.label_scores(cid)
+        if len(scores) and scores.max() != 0:
+            vertex_cover.set_label_scores(cid, scores / scores.max())
     return vertex_cover
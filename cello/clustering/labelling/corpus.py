@@ -0,0 +1,292 @@
+#-*- coding:utf-8 -*-
+""" :mod:`cello.clustering.labelling.corpus`
+===========================================
+
+Corpus-aware labelling: terms of a cluster are scored against global
+statistics of the corpus (document frequencies), precomputed once by scanning
+the index (see :meth:`TermStats.from_index`).
+
+Classes
+-------
+"""
+from array import array
+from builtins import range
+
+import numpy as np
+import igraph as ig
+
+from reliure import Optionable
+from reliure.types import Text
+
+from cello.clustering.labelling.model import LabelledVertexCover
+from cello.clustering.labelling.basic import VertexAsLabel, cluster_overlaps
+
+
+class TermStats(object):
+    """ Global statistics of the terms of a corpus: the document frequency of
+    each term is stored in a numpy array indexed by term id.
+
+    >>> docs = [{"terms": ["cat", "dog"]}, {"terms": ["cat", "cat"]}, {"terms": ["bird"]}]
+    >>> stats = TermStats.from_documents(docs, "terms")
+    >>> stats.nb_docs, stats.terms, stats.df.tolist()
+    (3, ['cat', 'dog', 'bird'], [2, 1, 1])
+    >>> stats.lookup(["bird", "fish", "cat"]).tolist()
+    [2, -1, 0]
+    """
+    # number of term ids accumulated before counting
+    _FLUSH_SIZE = 1 << 20
+
+    def __init__(self, terms, df, nb_docs):
+        """
+        :param terms: the terms, ordered by term id
+        :param df: document frequency of each term
+        :param nb_docs: number of documents of the corpus
+        """
+        self.terms = list(terms)
+        self.term_ids = {term: tid for tid, term in enumerate(self.terms)}
+        self.df = np.asarray(df, dtype=np.int64)
+        self.nb_docs = int(nb_docs)
+
+    def __len__(self):
+        return len(self.terms)
+
+    @staticmethod
+    def from_documents(docs, field, tokenize=None):
+        """ Compute the statistics in one pass over documents (dict-like).
+
+        :param docs: iterable over the documents
+        :param field: the document field that contains the terms
+        :param tokenize: function that splits the field value into terms, the
+            field value should be a list of terms if None
+        """
+        term_ids = {}
+        terms = []
+        df = np.zeros(0, dtype=np.int64)
+        buff = array('l')
+        nb_docs = 0
+        for doc in docs:
+            nb_docs += 1
+            value = doc.get(field) or []
+            if tokenize is not None:
+                value = tokenize(value)
+            for term in dict.fromkeys(value):
+                tid = term_ids.get(term)
+                if tid is None:
+                    tid = term_ids[term] = len(terms)
+                    terms.append(term)
+                buff.append(tid)
+            if len(buff) >= TermStats._FLUSH_SIZE:
+                df = TermStats._count(df, buff, len(terms))
+                buff = array('l')
+        df = TermStats._count(df, buff, len(terms))
+        return TermStats(terms, df, nb_docs)
+
+    @staticmethod
+    def _count(df, buff, nb_terms):
+        counts = np.bincount(np.frombuffer(buff, dtype=np.dtype('l')), minlength=nb_terms)
+        counts[:len(df)] += df
+        return counts.astype(np.int64)
+
+    @staticmethod
+    def from_index(index, field, tokenize=None):
+        """ Compute the statistics by scanning all the documents of an index
+        (see :class:`cello.index.Index`).
+        """
+        return TermStats.from_documents((doc for _, doc in index), field, tokenize=tokenize)
+
+    def save(self, path):
+        """ Save the statistics in a numpy `.npz` file
+        """
+        np.savez_compressed(path, terms=np.array(self.terms, dtype=np.str_),
+                            df=self.df, nb_docs=self.nb_docs)
+
+    @staticmethod
+    def load(path):
+        """ Load statistics saved with :meth:`save`
+        """
+        data = np.load(path)
+        return TermStats(data["terms"].tolist(), data["df"], data["nb_docs"])
+
+    def lookup(self, terms):
+        """ Term ids of terms (-1 for unknown terms)
+        """
+        term_ids = self.term_ids
+        return np.fromiter((term_ids.get(term, -1) for term in terms), dtype=np.int64,
+                           count=len(terms))
+
+
+def contingency(overlaps, cluster_size, df, nb_docs):
+    """ Document contingency tables of the terms against the clusters:
+    `(k11, k12, k21, k22)` documents of the cluster with and without the
+    term, and documents out of the cluster with and without the term.
+    """
+    overlaps = np.asarray(overlaps, dtype=np.float64)
+    df = np.maximum(df, overlaps)
+    nb_docs = np.maximum(nb_docs, cluster_size + df - overlaps)
+    k11 = overlaps
+    k12 = cluster_size - overlaps
+    k21 = df - overlaps
+    k22 = nb_docs - cluster_size - k21
+    return k11, k12, k21, k22
+
+
+def _xlogx(values):
+    return np.where(values > 0, values * np.log(np.maximum(values, 1e-300)), 0.)
+
+
+def score_tfidf(overlaps, cluster_size, df, nb_docs):
+    """ Proportion of the cluster documents that contain the term times the
+    term inverse document frequency `log(N / df)`
+
+    >>> score_tfidf([2, 2], np.array([2, 4]), np.array([10, 100]), 1000).round(3).tolist()
+    [4.605, 1.151]
+    """
+    k11, k12, k21, k22 = contingency(overlaps, cluster_size, df, nb_docs)
+    nb_docs, df = k11 + k12 + k21 + k22, k11 + k21
+    size = k11 + k12
+    tf = np.divide(k11, size, out=np.zeros(len(k11)), where=size > 0)
+    return tf * np.log(nb_docs / np.maximum(df, 1.))
+
+
+def score_llr(overlaps, cluster_size, df, nb_docs):
+    """ Log-likelihood ratio (Dunning's G2) of the term-cluster contingency
+    table, signed: negative when the term is under-represented in the cluster
+
+    >>> score_llr([2, 1], np.array([2, 2]), np.array([2, 80]), 100).round(3).tolist()
+    [19.608, -0.916]
+    """
+    k11, k12, k21, k22 = contingency(overlaps, cluster_size, df, nb_docs)
+    nb_docs = k11 + k12 + k21 + k22
+    g2 = 2 * (_xlogx(k11) + _xlogx(k12) + _xlogx(k21) + _xlogx(k22)
+              - _xlogx(k11 + k12) - _xlogx(k21 + k22) - _xlogx(k11 + k21) - _xlogx(k12 + k22)
+              + _xlogx(nb_docs))
+    sign = np.sign(k11 * k22 - k12 * k21)
+    return sign * np.maximum(g2, 0.)
+
+
+def score_chi2(overlaps, cluster_size, df, nb_docs):
+    """ Chi-square statistic of the term-cluster contingency table, signed:
+    negative when the term is under-represented in the cluster
+
+    >>> score_chi2([2, 1], np.array([2, 2]), np.array([2, 80]), 100).round(3).tolist()
+    [100.0, -1.148]
+    """
+    k11, k12, k21, k22 = contingency(overlaps, cluster_size, df, nb_docs)
+    nb_docs = k11 + k12 + k21 + k22
+    cross = k11 * k22 - k12 * k21
+    denom = (k11 + k12) * (k21 + k22) * (k11 + k21) * (k12 + k22)
+    chi2 = np.divide(nb_docs * cross ** 2, denom, out=np.zeros(len(k11)), where=denom > 0)
+    return np.sign(cross) * chi2
+
+
+class CorpusLabel(VertexAsLabel):
+    """ Transform `type=False` vertices (terms) of the cluster to labels,
+    scored against global term statistics of the corpus.
+
+    For exemple on the following bipartite graph of documents (upper) and terms
+    (lower) from a corpus of 100 documents:
+
+    >>> g = ig.Graph.Formula("A--a:b:c, B--a:b, C--b:d, D--d")
+    >>> g.vs["type"] = [vtx["name"].isupper() for vtx in g.vs]
+    >>> stats = TermStats(["a", "b", "c", "d"], [2, 80, 10, 30], 100)
+
+    one can build a labeller this way:
+
+    >>> labeller = CorpusLabel(stats, vtx_attr='name', role='terms')
+    >>> labeller.print_options()
+    top_k (Numeric, default=0): Maximum number of labels per cluster (0 for all)
+    score (Text, default=llr, in: {tfidf, llr, chi2}): Label scoring method
+
+    and use it this way:
+
+    >>> vcover = ig.VertexCover(g, [[0,1,2,3,4], [5,6,7,2]])
+    >>> vcover = labeller(vcover, top_k=2)
+    >>> print(vcover)
+    Cover with 2 clusters
+    [0] A, a, b, c, B (labels: a, c)
+    [1] C, d, D, b (labels: d)
+    >>> [(label.label, round(label.score, 3)) for label in vcover.labels[0]]
+    [('a', 19.608), ('c', 2.118)]
+
+    Only terms over-represented in the cluster are kept (positive scores).
+    Available scores are:
+
+    * **tfidf**: proportion of the cluster documents containing the term times
+      :math:`\\log(N / df)`,
+    * **llr**: log-likelihood ratio of the (cluster, term) contingency table,
+    * **chi2**: chi-square statistic of the (cluster, term) contingency table.
+
+    >>> vcover = labeller(ig.VertexCover(g, [[0,1,2,3,4], [5,6,7,2]]), score=u"tfidf", top_k=0)
+    >>> [(label.label, round(label.score, 3)) for label in vcover.labels[1]]
+    [('d', 1.204), ('b', 0.112)]
+
+    Terms unknown from the statistics get their document frequency from the
+    graph:
+
+    >>> labeller = CorpusLabel(TermStats([], [], 100), vtx_attr='name')
+    >>> vcover = labeller(ig.VertexCover(g, [[0,1,2,3,4], [5,6,7,2]]), score=u"llr", top_k=1)
+    >>> [label.label for label in vcover.labels[0]]
+    ['a']
+
+    All the clusters are scored at once from the overlaps given by
+    :func:`.cluster_overlaps`, and labels are stored compactly in the cover.
+    """
+    SCORES = {
+        u"tfidf": score_tfidf,
+        u"llr": score_llr,
+        u"chi2": score_chi2,
+    }
+
+    def __init__(self, term_stats, vtx_attr, role=None, name=None):
+        """ Build the labelling component
+
+        :attr term_stats: global statistics of the terms
+        :type term_stats: :class:`TermStats`
+        :attr vtx_attr: the vertex attribute to use as label string (and to
+            look for the term in `term_stats`)
+        :type vtx_attr: str
+        :attr role: the role of the created labels
+        :type role: str
+        :attr name: the name of the component
+        :type name: str
+        """
+        super(CorpusLabel, self).__init__(name=name)
+        self.term_stats = term_stats
+        self.vtx_attr = vtx_attr
+        self.role = role
+        self.add_option("score", Text(
+            default=u"llr", choices=[u"tfidf", u"llr", u"chi2"],
+            help="Label scoring method"
+        ))
+
+    @Optionable.check
+    def __call__(self, vertex_cover, top_k=0, score=u"llr"):
+        if not isinstance(vertex_cover, LabelledVertexCover):
+            vertex_cover = LabelledVertexCover.FromVertexCover(vertex_cover)
+        graph = vertex_cover.graph
+        if not 'type' in graph.vs.attributes():
+            raise ValueError("The graph should be bipartite, and have a 'type' attribute on each vertex")
+        vids, cids, overlaps, degree, nb_top = cluster_overlaps(vertex_cover)
+        is_label = ~np.array(graph.vs["type"], dtype=np.bool_)[vids]
+        vids, cids, overlaps = vids[is_label], cids[is_label], overlaps[is_label]
+        names = graph.vs[self.vtx_attr]
+        # document frequency of the terms of the graph (from the graph for unknown terms)
+        term_ids = self.term_stats.lookup(names)
+        known = term_ids >= 0
+        df = np.asarray(degree).copy()
+        df[known] = self.term_stats.df[term_ids[known]]
+        scores = self.SCORES[score](overlaps, nb_top[cids], df[vids], self.term_stats.nb_docs)
+        # rank of each label in its cluster, by decreasing score
+        order = np.lexsort((-scores, cids))
+        order = order[scores[order] > 0]
+        if top_k > 0:
+            offsets = np.searchsorted(cids[order], np.arange(len(vertex_cover) + 1))
+            order = order[np.arange(len(order)) - offsets[cids[order]] < top_k]
+        vids, cids, scores = vids[order], cids[order], scores[order]
+        offsets = np.searchsorted(cids, np.arange(len(vertex_cover) + 1))
+        for cid in range(len(vertex_cover)):
+            cvids = vids[offsets[cid]:offsets[cid + 1]].tolist()
+            vertex_cover.add_compact_labels(cid, [names[vid] for vid in cvids],
+                                            scores[offsets[cid]:offsets[cid + 1]],
+                                            role=self.role, vtxs=cvids)
+        return vertex_cover
@@ -6,8 +6,10 @@ Labelling data models
 ---------------------
 """
 import six
+from array import array
 from builtins import range
 
+import numpy as np
 import igraph as ig
 
 class Label(object):
@@ -49,6 +51,17 @@ class Label(object):
         self._id = Label.labelid
         Label.labelid += 1
 
+    @classmethod
+    def _restore(cls, lid, label, score, role):
+        """ Build a label with a given (already reserved) id
+        """
+        obj = cls.__new__(cls)
+        obj.label = label
+        obj.score = score
+        obj.role = role
+        obj._id = lid
+        return obj
+
     @property
     def id(self):
         return self._id
@@ -115,12 +128,27 @@ class LabelledVertexCover(ig.VertexCover):
     [1] c, C, D (labels: cluster two)
     >>> vcover.labels[0]
     [Label(u'cluster one', 1, role='demo'), Label(u'other label', 0.5, role='demo')]
+
+    Labels may also be stored without building :class:`.Label` objects (see
+    :meth:`add_compact_labels`): their text, score, role and vertex are kept
+    in parallel arrays, and the :class:`.Label` objects are only built when
+    they are accessed.
     """
     def __init__(self, graph, clusters=None, labels=None, misc_cluster=None):
         super(LabelledVertexCover, self).__init__(graph, clusters=clusters)
         self.misc_cluster = misc_cluster
         self._labels = [[] for _ in range(len(clusters))]
+        # label id -> Label object, or row of the compact label arrays
         self._label_set = {}
+        # compact labels
+        self._texts = []
+        self._text_ids = {}
+        self._roles = []
+        self._role_ids = {}
+        self._ltext = array('l')
+        self._lscore = array('d')
+        self._lrole = array('l')
+        self._lvtx = array('l')
         #note: on peut ajouter/enlevé des labels sur chaque clusters, mais si
         #on veux modifier le clustering il faut faire une nouvel VertexCover
 
@@ -146,17 +174,99 @@ class LabelledVertexCover(ig.VertexCover):
             misc_cluster = cover.misc_cluster
         return LabelledVertexCover(cover.graph, cover, misc_cluster=misc_cluster)
 
+    def _intern(self, values, ids, value):
+        vid = ids.get(value)
+        if vid is None:
+            vid = ids[value] = len(values)
+            values.append(value)
+        return vid
+
+    def _label(self, lid):
+        """ Returns the :class:`.Label` object of a label id, built on first
+        access for compact labels.
+        """
+        label = self._label_set[lid]
+        if isinstance(label, Label):
+            return label
+        row = label
+        role = self._lrole[row]
+        label = Label._restore(lid, self._texts[self._ltext[row]], self._lscore[row],
+                               self._roles[role] if role >= 0 else None)
+        if self._lvtx[row] >= 0:
+            label.vtx = self._lvtx[row]
+        self._label_set[lid] = label
+        return label
+
+    def _label_text(self, lid):
+        label = self._label_set[lid]
+        if isinstance(label, Label):
+            return str(label)
+        return self._texts[self._ltext[label]]
+
+    def _label_dict(self, lid):
+        label = self._label_set[lid]
+        if isinstance(label, Label):
+            return label.as_dict(full=True)
+        row = label
+        role = self._lrole[row]
+        ldict = {"label": self._texts[self._ltext[row]], "score": self._lscore[row],
+                 "role": self._roles[role] if role >= 0 else None, "id": lid}
+        if self._lvtx[row] >= 0:
+            ldict["vtx"] = self._lvtx[row]
+        return ldict
+
     @property
     def labels(self):
         """ List of list of labels (on list of labels for each cluster)
         """
-        lall = self._label_set
-        return [[lall[lid] for lid in labellist] for labellist in self._labels]
+        return [[self._label(lid) for lid in labellist] for labellist in self._labels]
 
     def all_labels(self):
         """ Retunrs all the labels (present at least in one cluster)
         """
-        return self._label_set.values()
+        return [self._label(lid) for lid in list(self._label_set)]
+
+    def label_ids(self, cid):
+        """ Ids of the labels of one cluster (no :class:`.Label` object is built)
+        """
+        return list(self._labels[cid])
+
+    def labels_as_dicts(self):
+        """ Serialisable copy (see :meth:`.Label.as_dict`) of all the labels,
+        without building the :class:`.Label` objects of compact labels.
+        """
+        return [self._label_dict(lid) for lid in self._label_set]
+
+    def label_scores(self, cid):
+        """ Scores of the labels of one cluster (numpy array)
+
+        >>> g = ig.Graph.Formula("a--A:B:C, b--A:B, c--C:D")
+        >>> vcover = LabelledVertexCover(g, [[0,1,2,3,4], [5,3,6]])
+        >>> vcover.add_compact_labels(0, ["A", "B"], [2., 1.], role="terms")
+        >>> vcover.add_label(0, Label("C", score=0.5))
+        >>> vcover.label_scores(0).tolist()
+        [2.0, 1.0, 0.5]
+        """
+        return np.array([self._lscore[label] if not isinstance(label, Label) else label.score
+                         for label in (self._label_set[lid] for lid in self._labels[cid])],
+                        dtype=np.float64)
+
+    def set_label_scores(self, cid, scores):
+        """ Changes the scores of the labels of one cluster
+
+        >>> g = ig.Graph.Formula("a--A:B:C, b--A:B, c--C:D")
+        >>> vcover = LabelledVertexCover(g, [[0,1,2,3,4], [5,3,6]])
+        >>> vcover.add_compact_labels(0, ["A", "B"], [2., 1.], role="terms")
+        >>> vcover.set_label_scores(0, [1., 0.5])
+        >>> vcover.labels[0]
+        [Label('A', 1.0, role='terms'), Label('B', 0.5, role='terms')]
+        """
+        for lid, score in zip(self._labels[cid], np.asarray(scores, dtype=np.float64).tolist()):
+            label = self._label_set[lid]
+            if isinstance(label, Label):
+                label.score = score
+            else:
+                self._lscore[label] = score
 
     def add_labels(self, cid, labels):
         """ Add a list of labels to one cluster
@@ -197,6 +307,42 @@ class LabelledVertexCover(ig.VertexCover):
             self._label_set[label.id] = label
         self._labels[cid].append(label.id)
 
+    def add_compact_labels(self, cid, texts, scores, role=None, vtxs=None):
+        """ Add labels to one cluster without building :class:`.Label` objects,
+        ids are reserved as for :class:`.Label` objects.
+
+        >>> g = ig.Graph.Formula("a--A:B:C, b--A:B, c--C:D")
+        >>> vcover = LabelledVertexCover(g, [[0,1,2,3,4], [5,3,6]])
+        >>> vcover.add_compact_labels(1, ["C", "D"], [0.5, 1.], role="terms", vtxs=[3, 6])
+        >>> print(vcover)
+        Cover with 2 clusters
+        [0] a, A, B, C, b (labels: )
+        [1] c, C, D (labels: C, D)
+        >>> vcover.labels[1]
+        [Label('C', 0.5, role='terms'), Label('D', 1.0, role='terms')]
+        >>> vcover.labels[1][1].vtx
+        6
+
+        :param cid: cluster id
+        :param texts: the labels texts
+        :type texts: list of unicode
+        :param scores: the labels scores
+        :param role: the role of all the labels
+        :param vtxs: optional vertex ids of the labels
+        """
+        nb_labels = len(texts)
+        first_id = Label.labelid
+        Label.labelid += nb_labels
+        role_id = -1 if role is None else self._intern(self._roles, self._role_ids, role)
+        row = len(self._ltext)
+        self._ltext.extend(self._intern(self._texts, self._text_ids, text) for text in texts)
+        self._lscore.extend(float(score) for score in scores)
+        self._lrole.extend([role_id] * nb_labels)
+        self._lvtx.extend([-1] * nb_labels if vtxs is None else (int(vtx) for vtx in vtxs))
+        lids = range(first_id, first_id + nb_labels)
+        self._label_set.update(zip(lids, range(row, row + nb_labels)))
+        self._labels[cid].extend(lids)
+
     def _formatted_cluster_iterator(self):
         """Iterates over the clusters and formats them into a string to be
         presented in the summary.
@@ -208,7 +354,6 @@ class LabelledVertexCover(ig.VertexCover):
         for cid, cluster in enumerate(self):
             misc = "{Misc}" if cid == self.misc_cluster else ""
             vertices = ", ".join(str(names[member]) for member in cluster)
-            labels_str = ", ".join(str(label) for label in self.labels[cid])
+            labels_str = ", ".join(self._label_text(lid) for lid in self._labels[cid])
             labels = "(labels: %s)" % (labels_str)
             yield "%s%s %s" % (misc, vertices, labels)
-
@@ -0,0 +1,147 @@
+#-*- coding:utf-8 -*-
+""" :mod:`cello.clustering.proxclustering`
+=========================================
+
+Clustering of the vertices from their prox vectors, the same vectors than
+:class:`cello.layout.proxlayout.ProxLayout`. Both components share a
+:class:`cello.graphs.cache.GraphCache`, so the layout and the clustering of
+a graph compute the random walks only once:
+
+>>> from cello.graphs.cache import GraphCache
+>>> from cello.layout.proxlayout import ProxLayout
+>>> cache = GraphCache()
+>>> g = ig.Graph.Formula("a:b:c--a:b:c, c--d, d:e:f--d:e:f")
+>>> layout = ProxLayout(cache=cache)(g)
+>>> cover = ProxClustering(cache=cache)(g, n_clusters=2, seed=0)
+>>> cache.hits, cache.misses
+(1, 1)
+>>> sorted(sorted(g.vs[cluster]["name"]) for cluster in cover)
+[['a', 'b', 'c'], ['d', 'e', 'f']]
+"""
+import numpy as np
+import igraph as ig
+
+from reliure.types import Numeric, Boolean, Text
+
+from cello.graphs import prox
+from cello.graphs import EDGE_WEIGHT_ATTR
+from cello.graphs.cache import prox_cache
+from cello.clustering.core import ClusteringMethod
+
+
+def top_k_rows(matrix, k):
+    """ Keeps only the `k` largest values of each row of a sparse matrix
+
+    >>> import scipy.sparse as sp
+    >>> top_k_rows(sp.csr_matrix([[1., 3., 2.], [0., 1., 0.]]), 2).toarray()
+    array([[0., 3., 2.],
+           [0., 1., 0.]])
+    """
+    import scipy.sparse as sp
+    matrix = sp.csr_matrix(matrix)
+    rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+    order = np.lexsort((-matrix.data, rows))
+    rank = np.arange(len(order)) - matrix.indptr[rows[order]]
+    keep = order[rank < k]
+    return sp.csr_matrix((matrix.data[keep], (rows[keep], matrix.indices[keep])),
+                         shape=matrix.shape)
+
+
+class ProxClustering(ClusteringMethod):
+    """ Clustering on prox vectors (random walks of length `length` from each
+    vertex), only the `k` highest values of each vector are kept.
+
+    Two algorithms are available:
+
+    * `kmeans`: mini-batch k-means on the (sparse) prox vectors ;
+    * `confluence`: agglomerative merging (see
+      :func:`igraph.Graph.community_fastgreedy`) of the graph of each vertex
+      to its `k` most confluent vertices.
+
+    >>> clustering = ProxClustering()
+    >>> clustering.print_options()
+    length (Numeric, default=3): Random walks length
+    add_loops (Boolean, default=True): Wether to add self loop on all vertices
+    k (Numeric, default=10): Number of values kept in each prox vector
+    algorithm (Text, default=confluence, in: {kmeans, confluence}): Clustering algorithm, 'kmeans' or 'confluence'
+    n_clusters (Numeric, default=0): Number of clusters (0 for automatic)
+    seed (Numeric, default=None): random seed (not seeded if None)
+
+    >>> g = ig.Graph.Formula("a:b--b:c:d, e--f")
+    >>> clustering(g).membership
+    [[0], [0], [0], [0], [1], [1]]
+    >>> clustering(g, algorithm="kmeans", n_clusters=2, seed=0).membership
+    [[0], [0], [0], [0], [1], [1]]
+
+    >>> g = ig.Graph(n=5)           # in case of graph with no edge
+    >>> clustering(g).membership
+    [[], [], [], [], []]
+    """
+    def __init__(self, name=None, weighted=False, cache=prox_cache):
+        """
+        :param weighted: whether to use the weight of the graph, is True the edge
+            attribute `cello.graphs.EDGE_WEIGHT_ATTR` is used.
+        :param cache: cache of prox matrices (:class:`cello.graphs.cache.GraphCache`),
+            None to disable it
+        """
+        super(ProxClustering, self).__init__(name=name)
+        self.add_option("length", Numeric(default=3, min=1, max=50, help="Random walks length"))
+        self.add_option("add_loops", Boolean(default=True, help="Wether to add self loop on all vertices"))
+        self.add_option("k", Numeric(default=10, min=1, help="Number of values kept in each prox vector"))
+        self.add_option("algorithm", Text(default=u"confluence", choices=[u"kmeans", u"confluence"],
+            help=u"Clustering algorithm, 'kmeans' or 'confluence'"))
+        self.add_option("n_clusters", Numeric(default=0, min=0, help="Number of clusters (0 for automatic)"))
+        self.add_option("seed", Numeric(vtype=int, default=None, min=0,
+            help="random seed (not seeded if None)"))
+        self.weighted = weighted
+        self.cache = cache
+
+    def __call__(self, graph, length=3, add_loops=True, k=10, algorithm="confluence",
+                    n_clusters=0, seed=None):
+        if self.graph_is_trivial(graph, weighted=self.weighted):
+            return ig.VertexCover(graph, [])
+        weight = EDGE_WEIGHT_ATTR if self.weighted else None
+        vects = prox.prox_markov_matrix(graph, length, mode=prox.ALL, add_loops=add_loops,
+                                        weight=weight, cache=self.cache)
+        vects = top_k_rows(vects, k)
+        if algorithm == "kmeans":
+            membership = self.kmeans(graph, vects, n_clusters, seed)
+        else:
+            membership = self.confluence(graph, vects, n_clusters, weight)
+        return ig.VertexClustering(graph, membership).as_cover()
+
+    def kmeans(self, graph, vects, n_clusters, seed):
+        """ Mini-batch k-means on the prox vectors, the number of clusters is
+        `sqrt(n/2)` if not given.
+        """
+        from sklearn.cluster import MiniBatchKMeans
+        n = graph.vcount()
+        if n_clusters <= 0:
+            n_clusters = max(1, int(np.sqrt(n / 2.)))
+        kmeans = MiniBatchKMeans(n_clusters=min(n_clusters, n), random_state=seed,
+                                 batch_size=1024, n_init=3)
+        return kmeans.fit_predict(vects).tolist()
+
+    def confluence(self, graph, vects, n_clusters, weight):
+        """ Agglomerative merging on the graph of the most confluent vertices,
+        the number of clusters maximises the modularity if not given.
+        """
+        import scipy.sparse as sp
+        # confluence with the stationary distribution (degree / 2m)
+        degree = np.asarray(graph.strength(weights=weight, loops=True), dtype=np.float64)
+        station = degree / degree.sum()
+        vects = vects.tocoo()
+        conf = vects.data / (vects.data + station[vects.col])
+        offdiag = vects.row != vects.col
+        conf = sp.csr_matrix((conf[offdiag], (vects.row[offdiag], vects.col[offdiag])), shape=vects.shape)
+        conf = conf.maximum(conf.T).tocoo()  # symmetric
+        upper = conf.row < conf.col
+        cgraph = ig.Graph(n=graph.vcount(),
+                          edges=np.column_stack((conf.row[upper], conf.col[upper])),
+                          edge_attrs={"weight": conf.data[upper].tolist()})
+        dendrogram = cgraph.community_fastgreedy(weights="weight")
+        if n_clusters > 0:
+            # the dendrogram of a not connected graph is not complete
+            n_clusters = max(n_clusters, graph.vcount() - len(dendrogram.merges))
+            return dendrogram.as_clustering(min(n_clusters, graph.vcount())).membership
+        return dendrogram.as_clustering().membership
@@ -12,6 +12,7 @@ SubModules
     cello.graphs.transform
     cello.graphs.prox
     cello.graphs.extraction
+    cello.graphs.cache
 
 Helpers
 -------
@@ -143,66 +144,156 @@ def export_graph(graph, exclude_gattrs=[], exclude_vattrs=[], exclude_eattrs=[],
     import igraph
     # some check
     assert isinstance(graph, igraph.Graph)
-    if 'id' in graph.vs.attributes():
-        raise ValueError("The graph already have a vetrex attribute 'id'")
+    attributes = _export_attributes(graph)
+    vs_columns = _export_vs_columns(graph, id_attribute)
+    es_columns = _export_es_columns(graph, vs_columns[id_attribute] if id_attribute else None)
     # create the graph dict
     graph_dict = {}
-    graph_dict['vs'] = []
-    graph_dict['es'] = []
+    graph_dict['attributes'] = attributes
+    graph_dict['vs'] = _rows(vs_columns, graph.vcount())
+    graph_dict['es'] = _rows(es_columns, graph.ecount())
+    return graph_dict
+
+
+def _export_attributes(graph):
+    """ Graph level part of :func:`export_graph` """
+    if 'id' in graph.vs.attributes():
+        raise ValueError("The graph already have a vetrex attribute 'id'")
     # attributs of the graph
-    graph_dict['attributes'] = { attr:graph[attr] for attr in graph.attributes()}
-    graph_dict['attributes']['directed'] = graph.is_directed()
+    attributes = { attr:graph[attr] for attr in graph.attributes()}
+    attributes['directed'] = graph.is_directed()
     # FIXME: bipartite... => le passer en simple attr de graphe, 
     #                        setté par le graph builder
-    graph_dict['attributes']['bipartite'] = 'type' in graph.vs and graph.is_bipartite()
-    graph_dict['attributes']['e_attrs'] = graph.es.attribute_names()
-    graph_dict['attributes']['v_attrs'] = [attr for attr in graph.vs.attribute_names() \
+    attributes['bipartite'] = 'type' in graph.vs and graph.is_bipartite()
+    attributes['e_attrs'] = graph.es.attribute_names()
+    attributes['v_attrs'] = [attr for attr in graph.vs.attribute_names() \
                                             if not attr.startswith('_')]
     # add a docnum if there are `Doc` in an _doc attribute
     if '_doc' in graph.vs.attribute_names():
-        graph_dict['attributes']['v_attrs'].append('docnum')
-
-    graph_dict['attributes']['e_attrs'] = sorted(graph_dict['attributes']['e_attrs'])
-    graph_dict['attributes']['v_attrs'] = sorted(graph_dict['attributes']['v_attrs'])
-
-    # vertices
-    v_idx = { }
-    for vid, vtx in enumerate(graph.vs):
-        vertex = vtx.attributes()
-        if id_attribute is not None:
-            v_idx[vid] = vertex[id_attribute]
-        else:
-            v_idx[vid] = vid
-            vertex["id"] = vid
-        # _id : structural vertex attr
-        if "_doc" in vertex:
-            if vertex["_doc"] is not None:
-                assert "docnum" in vertex["_doc"]
-                docnum = vertex["_doc"]["docnum"]
-                vertex["docnum"] = docnum
+        attributes['v_attrs'].append('docnum')
+
+    attributes['e_attrs'] = sorted(attributes['e_attrs'])
+    attributes['v_attrs'] = sorted(attributes['v_attrs'])
+    return attributes
+
+def _export_vs_columns(graph, id_attribute=None):
+    """ Vertices of :func:`export_graph`, one list per attribute """
+    columns = { attr: graph.vs[attr] for attr in graph.vs.attribute_names()}
+    # _id : structural vertex attr
+    if '_doc' in columns:
+        docnums = []
+        for doc in columns.pop('_doc'):
+            if doc is not None:
+                assert "docnum" in doc
+                docnums.append(doc["docnum"])
             else:
-                vertex["docnum"] = None
-        if "_doc" in vertex:
-            del vertex["_doc"]
-        graph_dict['vs'].append(vertex)
-
-    # edges
-    _getvid = lambda vtxid : v_idx[vtxid] if id_attribute else vtxid 
-
-    for edg in graph.es:
-        edge = edg.attributes() # recopie tous les attributs
-        # add source et target
-        edge["s"] = v_idx[edg.source] # match with 'id' vertex attributs
-        edge["t"] = v_idx[edg.target]
-        #TODO check il n'y a pas de 's' 't' dans attr
-        graph_dict['es'].append(edge)
+                docnums.append(None)
+        columns['docnum'] = docnums
+    if id_attribute is None:
+        columns['id'] = list(range(graph.vcount()))
+    return columns
+
+def _export_es_columns(graph, v_idx=None):
+    """ Edges of :func:`export_graph`, one list per attribute, `s` and `t`
+    match with the 'id' of vertices (`v_idx`, vertex index by default)
+    """
+    columns = { attr: graph.es[attr] for attr in graph.es.attribute_names()}
+    edges = graph.get_edgelist()
+    #TODO check il n'y a pas de 's' 't' dans attr
+    if v_idx is None:
+        columns['s'] = [source for source, _ in edges]
+        columns['t'] = [target for _, target in edges]
+    else:
+        columns['s'] = [v_idx[source] for source, _ in edges]
+        columns['t'] = [v_idx[target] for _, target in edges]
+    return columns
+
+def _rows(columns, count, start=0, stop=None):
+    """ Rows (dicts) of a columnar dict, from `start` to `stop` """
+    stop = count if stop is None else min(stop, count)
+    names = list(columns.keys())
+    return [dict(zip(names, values))
+                for values in zip(*[columns[name][start:stop] for name in names])] \
+            if names else [{} for _ in range(start, stop)]
+
+def export_graph_columns(graph, id_attribute=None):
+    """ Columnar variant of :func:`export_graph`: vertices and edges are
+    given as a list of values per attribute (plus `s` and `t` lists for
+    edges). It is a lot lighter to build and to serialise for large graphs,
+    and :func:`read_json` reads it back in bulk.
 
-    return graph_dict
+    >>> from cello.providers.igraphGraph import  IgraphGraph
+    >>> g = IgraphGraph.Formula("a--b, a--c, a--d, a--f, d--f")
+    >>> g.es["weight"] = [4, 4, 5, 5, 1]
+    >>> from pprint import pprint
+    >>> pprint(export_graph_columns(g))
+    {'attributes': {'bipartite': False,
+                    'directed': False,
+                    'e_attrs': ['weight'],
+                    'v_attrs': ['name']},
+     'es': {'s': [0, 0, 0, 0, 3], 't': [1, 2, 3, 4, 4], 'weight': [4, 4, 5, 5, 1]},
+     'vs': {'id': [0, 1, 2, 3, 4], 'name': ['a', 'b', 'c', 'd', 'f']}}
+    >>> read_json(export_graph_columns(g)).get_edgelist() == g.get_edgelist()
+    True
+    """
+    attributes = _export_attributes(graph)
+    vs_columns = _export_vs_columns(graph, id_attribute)
+    es_columns = _export_es_columns(graph, vs_columns[id_attribute] if id_attribute else None)
+    return {'attributes': attributes, 'vs': vs_columns, 'es': es_columns}
+
+def iter_export_graph(graph, id_attribute=None, chunk_size=1000):
+    """ Streaming version of :func:`export_graph`, generates the JSON
+    serialisation of the graph (same schema) by chunks of `chunk_size`
+    vertices or edges.
+
+    >>> import json
+    >>> from cello.providers.igraphGraph import  IgraphGraph
+    >>> g = IgraphGraph.Formula("a--b, a--c, a--d, a--f, d--f")
+    >>> chunks = list(iter_export_graph(g, chunk_size=2))
+    >>> len(chunks)
+    9
+    >>> json.loads("".join(chunks)) == export_graph(g)
+    True
+    """
+    import json
+    attributes = _export_attributes(graph)
+    vs_columns = _export_vs_columns(graph, id_attribute)
+    yield '{"attributes": %s, "vs": [' % json.dumps(attributes)
+    for start in range(0, graph.vcount(), chunk_size):
+        rows = _rows(vs_columns, graph.vcount(), start, start + chunk_size)
+        yield (", " if start else "") + json.dumps(rows)[1:-1]
+    v_idx = vs_columns[id_attribute] if id_attribute else None
+    del vs_columns
+    es_columns = _export_es_columns(graph, v_idx)
+    yield '], "es": ['
+    for start in range(0, graph.ecount(), chunk_size):
+        rows = _rows(es_columns, graph.ecount(), start, start + chunk_size)
+        yield (", " if start else "") + json.dumps(rows)[1:-1]
+    yield ']}'
+
+def write_json(graph, out, id_attribute=None, chunk_size=1000):
+    """ Write the JSON serialisation of :func:`export_graph` to the
+    file-like object `out`, without building the whole graph dict.
+
+    >>> from six import StringIO
+    >>> from cello.providers.igraphGraph import  IgraphGraph
+    >>> g = IgraphGraph.Formula("a--b, a--c")
+    >>> out = StringIO()
+    >>> write_json(g, out)
+    >>> print(out.getvalue())
+    {"attributes": {"directed": false, "bipartite": false, "e_attrs": [], "v_attrs": ["name"]}, "vs": [{"name": "a", "id": 0}, {"name": "b", "id": 1}, {"name": "c", "id": 2}], "es": [{"s": 0, "t": 1}, {"s": 0, "t": 2}]}
+    """
+    for chunk in iter_export_graph(graph, id_attribute=id_attribute, chunk_size=chunk_size):
+        out.write(chunk)
 
 
 def read_json(data):
     """ read, parse and return a :class:`igraph.Graph` from a dict
 
+    The graph is built in bulk, `vs` and `es` may either be lists of dicts
+    (see :func:`export_graph`) or dicts of columns (see
+    :func:`export_graph_columns`).
+
     :param data: deserialized json data
     :param filename: path to a file
 
@@ -264,6 +355,7 @@ def read_json(data):
     {'docnum': 'd_0', 'name': 'a'}
 
     """
+    import igraph
     g_attrs = {}
     g_attrs.update(data['attributes'])
     v_attrs = g_attrs.pop('v_attrs')
@@ -271,24 +363,33 @@ def read_json(data):
     
     directed = g_attrs.get('directed', False)
 
-    builder = GraphBuilder(directed=directed)
-    
-    builder.declare_vattr(v_attrs)
-    builder.declare_eattr(e_attrs)
-    
-    builder.reset()
-    builder.set_gattrs(**g_attrs)
-
-    for v in data['vs']:
-        vid = builder.add_get_vertex(v['id'])
-        for attr in v_attrs:
-            builder.set_vattr(vid, attr, v[attr])
-
-    for e in data['es']:
-        eid = builder.add_get_edge(e['s'],e['t'])
-        for attr in v_attrs:
-            builder.set_vattr(vid, attr, v[attr])
-    
-    return builder.create_graph()
+    vs, es = data['vs'], data['es']
+    # columnar data (see :func:`export_graph_columns`) or list of dicts
+    if isinstance(vs, dict):
+        ids = vs['id']
+        vertex_attrs = {attr: list(vs.get(attr, [None] * len(ids))) for attr in v_attrs}
+    else:
+        ids = [v['id'] for v in vs]
+        vertex_attrs = {attr: [v.get(attr) for v in vs] for attr in v_attrs}
+    if isinstance(es, dict):
+        sources, targets = es['s'], es['t']
+        edge_attrs = {attr: list(es.get(attr, [None] * len(sources))) for attr in e_attrs}
+    else:
+        sources = [e['s'] for e in es]
+        targets = [e['t'] for e in es]
+        edge_attrs = {attr: [e.get(attr) for e in es] for attr in e_attrs}
+
+    # 's' and 't' refer to vertices 'id'
+    if list(ids) != list(range(len(ids))):
+        v_idx = {vid: idx for idx, vid in enumerate(ids)}
+        sources = [v_idx[vid] for vid in sources]
+        targets = [v_idx[vid] for vid in targets]
+
+    return igraph.Graph(n=len(ids),
+                        edges=list(zip(sources, targets)),
+                        directed=directed,
+                        graph_attrs=g_attrs,
+                        vertex_attrs=vertex_attrs,
+                        edge_attrs=edge_attrs)
 
 
@@ -0,0 +1,176 @@
+#-*- coding:utf-8 -*-
+""" :mod:`cello.graphs.cache`
+============================
+
+.. currentmodule:: cello.graphs.cache
+
+Cache of values computed on a graph (prox matrices, dendrograms...), so that
+several components working on the same local graph compute them once.
+
+Entries are keyed by the graph identity and a fingerprint of its structure
+and weights, so a modified graph is never served a stale value:
+
+>>> import igraph as ig
+>>> cache = GraphCache(maxsize=2)
+>>> graph = ig.Graph.Formula("a--b--c")
+>>> graph.es["weight"] = [1., 2.]
+>>> compute = lambda: graph.ecount()
+>>> cache.get(graph, "ecount", compute, weight="weight")
+2
+>>> cache.hits, cache.misses
+(0, 1)
+>>> cache.get(graph, "ecount", compute, weight="weight")
+2
+>>> cache.hits, cache.misses
+(1, 1)
+
+When edges or weights change, the value is computed again:
+
+>>> graph.es["weight"] = [1., 3.]
+>>> cache.get(graph, "ecount", compute, weight="weight")
+2
+>>> cache.hits, cache.misses
+(1, 2)
+"""
+import weakref
+from collections import OrderedDict
+
+import six
+import numpy as np
+
+
+def graph_fingerprint(graph, weight=None):
+    """ Fingerprint of the structure (and the weights if `weight` is given) of
+    a graph, computed in O(m).
+
+    :param weight: an edge attribute name, a list of weights or None
+    """
+    edges = np.array(graph.get_edgelist(), dtype=np.int64)
+    fingerprint = (graph.vcount(), graph.ecount(), graph.is_directed(),
+                   hash(edges.tobytes()))
+    if weight is not None:
+        if isinstance(weight, six.string_types) or not hasattr(weight, "__len__"):
+            weight = graph.es[weight] if weight in graph.es.attributes() else None
+        if weight is not None:
+            fingerprint += (hash(np.asarray(weight, dtype=np.float64).tobytes()),)
+    return fingerprint
+
+
+class GraphCache(object):
+    """ Least recently used cache of values computed on graphs.
+
+    Graphs are only weakly referenced by the cache, cached values should not
+    reference them either (as :class:`cello.clustering.core.Dendrogram`), or
+    graphs stay alive until their values are evicted.
+    """
+    def __init__(self, maxsize=8):
+        """
+        :param maxsize: maximum number of cached values
+        """
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, graph, key, compute, weight=None):
+        """ Returns the value `key` for the graph, computed by `compute()` if
+        not in cache.
+
+        :param graph: the graph
+        :param key: hashable identifier of the value (method and parameters)
+        :param compute: function without argument that computes the value
+        :param weight: weights the value depends on (edge attribute name or
+            list of weights)
+        """
+        fkey = (id(graph), graph_fingerprint(graph, weight), key)
+        entry = self._entries.get(fkey)
+        # ids may be reused by new graphs, check it is the same object
+        if entry is not None and entry[0]() is graph:
+            self._entries[fkey] = self._entries.pop(fkey)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        value = compute()
+        self._entries.pop(fkey, None)
+        self._entries[fkey] = (weakref.ref(graph), value)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return value
+
+
+#: cache shared by default by prox components (layout and clustering)
+prox_cache = GraphCache()
+
+
+class RowCache(object):
+    """ Least recently used cache of rows (a vector per key, typically the
+    prox vector of a vertex of a global graph), shared across requests.
+
+    >>> import numpy as np
+    >>> cache = RowCache(maxsize=2)
+    >>> compute = lambda keys: [np.array([key, key]) for key in keys]
+    >>> [row.tolist() for row in cache.get_rows([1, 2], compute)]
+    [[1, 1], [2, 2]]
+    >>> [row.tolist() for row in cache.get_rows([2, 3], compute)]
+    [[2, 2], [3, 3]]
+    >>> cache.hits, cache.misses, len(cache)
+    (1, 3, 2)
+
+    Rows may belong to an `owner` (the global graph), only weakly referenced:
+    rows of an other object that reuses the same key are computed again.
+
+    >>> class Owner(object): pass
+    >>> owner = Owner()
+    >>> [row.tolist() for row in cache.get_rows([3], compute, owner=owner)]
+    [[3, 3]]
+    >>> [row.tolist() for row in cache.get_rows([3], compute, owner=Owner())]
+    [[3, 3]]
+    >>> cache.hits, cache.misses
+    (1, 5)
+    """
+    def __init__(self, maxsize=10000):
+        """
+        :param maxsize: maximum number of cached rows
+        """
+        self.maxsize = maxsize
+        self._rows = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self._rows.clear()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def get_rows(self, keys, compute, owner=None):
+        """ Returns the rows of the keys, the missing ones are computed in one
+        call to `compute(missing_keys)` (that should return a list of rows).
+
+        :param owner: the object the rows are computed from, a cached row is
+            only returned for the same owner (ids may be reused)
+        """
+        ref = weakref.ref(owner) if owner is not None else None
+        rows = {}
+        for key in keys:
+            entry = self._rows.pop(key, None)
+            if entry is not None and (entry[0] is None if ref is None else entry[0] is not None
+                                      and entry[0]() is owner):
+                self._rows[key] = entry
+                rows[key] = entry[1]
+        missing = [key for key in keys if key not in rows]
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            for key, row in zip(missing, compute(missing)):
+                rows[key] = row
+                self._rows[key] = (ref, row)
+            while len(self._rows) > self.maxsize:
+                self._rows.popitem(last=False)
+        return [rows[key] for key in keys]
@@ -4,9 +4,14 @@
 
 import igraph
 import math
+import random
+import time
+import warnings
+
 import numpy as np
+import scipy.sparse as sp
 from six import StringIO
-import time
+
 from cello.graphs import prox
 
 
@@ -26,6 +31,7 @@ opt_default = { "n":True,
                 "ncc":True,         # nomber of connected components
 
                 "MeanConfluence":True,           # clustering mean confluence
+                "MeanConfluence_ci":True,        # half width of the 95% confidence interval (sampled estimate)
                 "C":True,           # Global clustering coef
                 "rho":True,         # degree correlation
 
@@ -44,14 +50,24 @@ opt_default = { "n":True,
                 "C_lcc":False,
                 "rho_lcc":False,    # degree correlation
                 "L_lcc":True,
+                "L_lcc_ci":True,    # half width of the 95% confidence interval (sampled estimate)
     
                 "dd_plot_lcc":False,
                 "a_lcc":False,
                 "r2_lcc":False,
                 # global plot flag
                 "no_plot":True,
+
+                # computation parameters (not metrics)
+                "exact":False,      # exact (expensive) MeanConfluence and L_lcc instead of sampled estimates
+                "samples":100,      # number of source vertices used for sampled estimates
+                "seed":None,        # random seed used to pick the sources
             }
 
+
+# normal quantile for 95% confidence intervals
+_Z95 = 1.96
+
 strf4 = lambda val: "%1.4f"%val
 strf3 = lambda val: "%1.3f"%val
 strf2 = lambda val: "%1.2f"%val
@@ -75,6 +91,7 @@ opt_ordre_cast_cmt = [
                 ("ncc", str, int,       "number of connected components"),
 
                 ("MeanConfluence", strf4, float,     "clustering mean confluence."),
+                ("MeanConfluence_ci", strf4, float,  "half width of the 95% confidence interval of MeanConfluence (0 if exact)"),
                 ("C", strf4, float,     "Global clustering coef."),
                 ("rho", strf4, float,   "degree correlation"),
 
@@ -92,63 +109,248 @@ opt_ordre_cast_cmt = [
                 ("C_lcc", strf4, float,  ""),
                 ("rho_lcc", strf4, float,   "degree correlation on lcc"),
                 ("L_lcc", strf4, float,  ""),
+                ("L_lcc_ci", strf4, float,  "half width of the 95% confidence interval of L_lcc (0 if exact)"),
     
                 ("dd_plot_lcc", str, str, ""),
                 ("a_lcc", strf4, float, ""),
                 ("r2_lcc", strf4, float,""),
             ]
 
+def _transition_matrix(g):
+    """ Random walk transition matrix of `g` (OUT links, no weight) as a CSR
+    matrix, ie. the sparse counterpart of :func:`prox.spreading`.
+
+    :returns: (P, degree) where `degree` is the (out) degree array
+    """
+    n = g.vcount()
+    edges = np.array(g.get_edgelist(), dtype=np.int64).reshape(-1, 2)
+    src, tgt = edges[:, 0], edges[:, 1]
+    if not g.is_directed():
+        src, tgt = np.concatenate((src, tgt)), np.concatenate((tgt, src))
+    degree = np.bincount(src, minlength=n).astype(np.float64)
+    inv = np.zeros(n)
+    inv[degree > 0] = 1. / degree[degree > 0]
+    P = sp.csr_matrix((inv[src], (src, tgt)), shape=(n, n))
+    return P, degree
+
+def _ci(values, population):
+    """ Half width of the 95% confidence interval of the mean of `values`,
+    sampled without replacement from a population of the given size.
+    """
+    k = len(values)
+    if k < 2 or k >= population:
+        return 0.
+    fpc = math.sqrt((population - k) / (population - 1.))
+    return _Z95 * np.std(values, ddof=1) / math.sqrt(k) * fpc
+
+def mean_confluence(g, length=3):
+    """ Exact mean confluence, same value than
+    :func:`prox.mean_confluence_simple` with `p0=[]` but computed with sparse
+    matrix products.
+
+    >>> g = igraph.Graph.Famous("Zachary")
+    >>> round(mean_confluence(g), 10) == round(prox.mean_confluence_simple(g, []), 10)
+    True
+    """
+    if g.vcount() == 0 or g.ecount() == 0:
+        return None
+    P, degree = _transition_matrix(g)
+    pm = np.full(g.vcount(), 1. / g.vcount())
+    for _ in range(length):
+        pm = P.T.dot(pm)
+    reached = pm > 0
+    pm = pm[reached]
+    conf = pm / (pm + degree[reached] / (2. * g.ecount()))
+    return conf.mean()
+
+def mean_confluence_sampled(g, samples, length=3, rng=None):
+    """ Estimate of the mean confluence from `samples` vertices.
+
+    On undirected graphs the prox from all vertices, evaluated on a vertex k,
+    is obtained (by reversibility of the walk) from a walk starting on k only,
+    so the mean is estimated on a sample of vertices.
+    Directed graphs fallback on the exact computation.
+
+    :returns: (estimate, half width of the 95% confidence interval)
+
+    >>> g = igraph.Graph.Famous("Zachary")
+    >>> conf, ci = mean_confluence_sampled(g, 10, rng=random.Random(0))
+    >>> abs(conf - mean_confluence(g)) < 2 * ci
+    True
+    >>> conf, ci = mean_confluence_sampled(g, 34)
+    >>> round(conf, 10) == round(mean_confluence(g), 10), ci
+    (True, 0.0)
+    """
+    if g.is_directed() or g.ecount() == 0:
+        return mean_confluence(g, length), 0.
+    rng = rng or random.Random()
+    P, degree = _transition_matrix(g)
+    population = np.flatnonzero(degree)
+    if samples < len(population):
+        sources = np.array(sorted(rng.sample(range(len(population)), samples)))
+        population_size = len(population)
+        population = population[sources]
+    else:
+        population_size = len(population)
+    k = len(population)
+    walk = sp.csr_matrix((np.ones(k), (np.arange(k), population)), shape=(k, g.vcount()))
+    for _ in range(length):
+        walk = walk.dot(P)
+    inv = np.zeros(g.vcount())
+    inv[degree > 0] = 1. / degree[degree > 0]
+    x = walk.dot(inv) / g.vcount()
+    conf = x / (x + 1. / (2. * g.ecount()))
+    return conf.mean(), _ci(conf, population_size)
+
+def path_length_sampled(g, samples, rng=None):
+    """ Estimate of the average shortest path length (see
+    :meth:`igraph.Graph.average_path_length`) from BFS rooted on `samples`
+    vertices.
+
+    :returns: (estimate, half width of the 95% confidence interval)
+
+    >>> g = igraph.Graph.Famous("Zachary")
+    >>> L, ci = path_length_sampled(g, 10, rng=random.Random(0))
+    >>> abs(L - g.average_path_length()) < 2 * ci
+    True
+    >>> L, ci = path_length_sampled(g, 34)
+    >>> round(L, 10) == round(g.average_path_length(), 10), ci
+    (True, 0.0)
+
+    The mean is weighted by the number of vertices reached from each source,
+    so it is exact with all the vertices as sources even if some sources do
+    not reach all the others:
+
+    >>> g = igraph.Graph.Formula("a-->b-->c-->d, e-->a")
+    >>> L, ci = path_length_sampled(g, 5)
+    >>> round(L, 10) == round(g.average_path_length(), 10)
+    True
+    """
+    n = g.vcount()
+    if n < 2:
+        return float("nan"), 0.
+    rng = rng or random.Random()
+    sources = sorted(rng.sample(range(n), samples)) if samples < n else range(n)
+    # Graph.shortest_paths is deprecated (and renamed distances) in igraph 0.10
+    distances = getattr(g, "distances", None) or g.shortest_paths
+    # ratio estimator: sum of the distances over the number of reached pairs,
+    # sources reaching more vertices weight more (directed graphs, or not
+    # connected ones)
+    sums, counts = [], []
+    for source in sources:
+        dist = np.array(distances(source=[source])[0], dtype=np.float64)
+        dist = dist[np.isfinite(dist) & (dist > 0)]
+        sums.append(dist.sum())
+        counts.append(len(dist))
+    sums, counts = np.array(sums), np.array(counts, dtype=np.float64)
+    if counts.sum() == 0:
+        return float("nan"), 0.
+    estimate = sums.sum() / counts.sum()
+    # linearised variance of the ratio estimator
+    return estimate, _ci(sums - estimate * counts, n) / counts.mean()
+
+
 def compute(g, opt={}):
     """ Calcul le pedigree du graph g.
 
     @param g: le graph (object igraph.Graph)
     @param opt: dictionaire indiquant les valeurs a calculer, le dictionaire fournis met a jour les valeurs par defaut indiqué dans opt_default.
 
-    @return: le pedigree cad un dictionaire
+    @return: le pedigree cad une liste de (clé, valeur, commentaire)
+
+    Metrics come in three tiers:
+
+    * exact and cheap (counts, degrees, C, rho, components...), always exact ;
+    * MeanConfluence and L_lcc, estimated by default from `opt["samples"]`
+      source vertices, with the half width of their 95% confidence interval
+      (`MeanConfluence_ci`, `L_lcc_ci`) ;
+    * expensive, opt-in: `multiples`, and exact MeanConfluence and L_lcc with
+      `opt["exact"] = True` (the confidence intervals are then 0).
+
+    The computation time of each metric is given by the `times` entry.
+
+    >>> g = igraph.Graph.Famous("Zachary")
+    >>> p = dict((key, val) for key, val, _ in compute(g, {"samples": 40}))
+    >>> p["n"], p["m"], p["single"], p["loops"], p["ncc"]
+    (34, 78, 0, 0, 1)
+    >>> p["L_lcc"] == g.average_path_length(), p["L_lcc_ci"]
+    (True, 0.0)
+    >>> sorted(p["times"])[:4]
+    ['<k>', 'C', 'L_lcc', 'MeanConfluence']
     """
     # Update des options par defaut par celles fournies
     _opt = opt
     opt = opt_default.copy()
     opt.update(_opt)
+    rng = random.Random(opt["seed"])
 
     start = time.time()
     p = {}
-    
-    def pset(key, value):
+    times = {}
+
+    def pset(key, value, since=None):
         if not key in opt:
-            warnings.warn("The key '%s' doesn't exist !")
+            warnings.warn("The key '%s' doesn't exist !" % key)
         if key in opt and opt[key]:
             p[key] = "nan" if (type( value) == float and math.isnan(value)) else value
-            
-    pset("n", g.vcount())
-    pset("m", g.ecount())
-    pset("<k>", np.mean(g.degree(mode=igraph.OUT)) if g.vcount() else 0 )
-    
+            if since is not None:
+                times[key] = time.time() - since
+
+    tic = time.time()
+    pset("n", g.vcount(), tic)
+    pset("m", g.ecount(), tic)
+    tic = time.time()
+    degree = np.array(g.degree(mode=igraph.OUT))
+    pset("<k>", degree.mean() if g.vcount() else 0, tic)
+
     pset("directed", g.is_directed())
-    pset("mutuals", len([1 for e in g.is_mutual() if e]))
+    if opt["mutuals"]:
+        tic = time.time()
+        pset("mutuals", np.count_nonzero(g.is_mutual()), tic)
 
     if opt["loops"] or opt["reflexif"]:
-        nloops = len([1 for l in g.is_loop() if l])
-    pset("loops", nloops)
-    pset("reflexif", nloops == g.vcount())
+        tic = time.time()
+        nloops = np.count_nonzero(g.is_loop())
+        pset("loops", nloops, tic)
+        pset("reflexif", nloops == g.vcount(), tic)
+
+    if opt["single"]:
+        tic = time.time()
+        alldegree = degree if not g.is_directed() else np.array(g.degree())
+        pset("single", np.count_nonzero(alldegree == 0), tic)
+
+    if opt["multiples"]:
+        tic = time.time()
+        pset("multiples", np.count_nonzero(g.is_multiple()), tic)
+    if opt["simple"]:
+        tic = time.time()
+        pset("simple", g.is_simple(), tic)
 
-    pset("single", len(g.vs.select(lambda v: g.degree(v.index) == 0)))
-    
-    pset("multiples", len([1 for e in g.is_multiple() if e]))
-    pset("simple", g.is_simple())
-    
     # C Global
-    pset("C", g.transitivity_undirected() if g.vcount() else "null")
-    pset("MeanConfluence", prox.mean_confluence_simple(g, [])  if g.vcount() > 0 else None)
-    
+    if opt["C"]:
+        tic = time.time()
+        pset("C", g.transitivity_undirected() if g.vcount() else "null", tic)
+    if opt["MeanConfluence"]:
+        tic = time.time()
+        if g.vcount() == 0:
+            conf, conf_ci = None, 0.
+        elif opt["exact"]:
+            conf, conf_ci = mean_confluence(g), 0.
+        else:
+            conf, conf_ci = mean_confluence_sampled(g, opt["samples"], rng=rng)
+        pset("MeanConfluence", conf, tic)
+        pset("MeanConfluence_ci", conf_ci)
+
     # Correlation des degrées
-    rho = g.assortativity_degree()
-    pset("rho",  rho  )
-    
+    if opt["rho"]:
+        tic = time.time()
+        pset("rho", g.assortativity_degree(), tic)
+
     cc = []
     if opt["ncc"] or opt["LCC"]:
+        tic = time.time()
         cc = g.clusters(mode=igraph.WEAK)
-    pset("ncc", len(cc))
+        pset("ncc", len(cc), tic)
 
 
     if  opt["no_plot"] == False:
@@ -166,18 +368,29 @@ def compute(g, opt={}):
                 pset("r2_in", r2)
                 pset("dd_plot_in", plot_fname)
 
-    if opt["LCC"] and cc.n > 0 :
+    if opt["LCC"] and len(cc) > 0 :
         lcc = cc.giant()
 
         pset("n_lcc", lcc.vcount() )
         pset("m_lcc", lcc.ecount())
         #pset("<k>", np.mean(lcc.degree(mode=igraph.OUT)))
-        
-        pset("C_lcc", lcc.transitivity_undirected())
-        # Correlation des degrées
-        pset("rho_lcc", lcc.assortativity_degree())
 
-        pset("L_lcc", lcc.average_path_length())
+        if opt["C_lcc"]:
+            tic = time.time()
+            pset("C_lcc", lcc.transitivity_undirected(), tic)
+        # Correlation des degrées
+        if opt["rho_lcc"]:
+            tic = time.time()
+            pset("rho_lcc", lcc.assortativity_degree(), tic)
+
+        if opt["L_lcc"]:
+            tic = time.time()
+            if opt["exact"]:
+                L, L_ci = lcc.average_path_length(), 0.
+            else:
+                L, L_ci = path_length_sampled(lcc, opt["samples"], rng=rng)
+            pset("L_lcc", L, tic)
+            pset("L_lcc_ci", L_ci)
 
         if  opt["no_plot"] == False:
             if opt["dd_plot_lcc"] or opt["a_lcc"] or opt["r2_lcc"]:
@@ -191,7 +404,8 @@ def compute(g, opt={}):
     for key, cast, _, cmt in opt_ordre_cast_cmt :
         if key in p:
             d.append( (key, p[key], cmt) )
-            
+
+    d.append( ("times", times, "computation time of each metric") )
     d.append( ("time", time.time() - start, "pedigree computation time") )
     return d
 
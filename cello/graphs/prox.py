@@ -469,6 +469,139 @@ def prox_markov_list(graph, p0, length, mode=OUT, add_loops=False, loops_weight=
     return [vect.get(vidx, 0.) for vidx in range(graph.vcount())]
 
 
+def transition_matrix(graph, mode=OUT, add_loops=False, weight=None, loops_weight=None):
+    """ Transition matrix of the random walk used by :func:`prox_markov_dict`
+    (same `mode`, `add_loops`, `weight` and `loops_weight` parameters), as a
+    :class:`scipy.sparse.csr_matrix`.
+
+    >>> import igraph as ig
+    >>> graph = ig.Graph.Formula("a--b--c")
+    >>> transition_matrix(graph).toarray()
+    array([[0. , 1. , 0. ],
+           [0.5, 0. , 0.5],
+           [0. , 1. , 0. ]])
+    >>> graph.es["wgt"] = [3, 1]
+    >>> transition_matrix(graph, add_loops=True, weight="wgt").toarray()
+    array([[0.5       , 0.5       , 0.        ],
+           [0.5       , 0.33333333, 0.16666667],
+           [0.        , 0.5       , 0.5       ]])
+    """
+    import scipy.sparse as sp
+    n = graph.vcount()
+    edges = np.array(graph.get_edgelist(), dtype=np.int64).reshape(-1, 2)
+    # edge weights
+    if weight is None:
+        wgt = np.ones(len(edges))
+    elif isinstance(weight, basestring):
+        wgt = np.array(graph.es[weight], dtype=np.float64)
+    elif callable(weight):
+        wgt = np.array([weight(graph, edge) for edge in graph.es], dtype=np.float64)
+    else:
+        wgt = np.array(weight, dtype=np.float64)
+    # edges directions
+    src, tgt = edges[:, 0], edges[:, 1]
+    if not graph.is_directed() or mode == ALL:
+        src, tgt, wgt = np.concatenate((src, tgt)), np.concatenate((tgt, src)), np.concatenate((wgt, wgt))
+    elif mode == IN:
+        src, tgt = tgt, src
+    # loops
+    if add_loops:
+        if weight is None:
+            lwgt = np.ones(n)
+        elif loops_weight is None or callable(loops_weight):
+            # average weight of incident edges (1. if none or null)
+            count = np.bincount(src, minlength=n)
+            total = np.bincount(src, weights=wgt, minlength=n)
+            lwgt = np.ones(n)
+            lwgt[count > 0] = total[count > 0] / count[count > 0]
+            lwgt[lwgt == 0] = 1.
+            if callable(loops_weight):
+                incident = [wgt[np.flatnonzero(src == vid)].tolist() for vid in range(n)]
+                lwgt = np.array([loops_weight(graph, vid, mode, incident[vid]) for vid in range(n)],
+                                dtype=np.float64)
+        elif isinstance(loops_weight, basestring):
+            lwgt = np.array(graph.vs[loops_weight], dtype=np.float64)
+        else:
+            lwgt = np.array(loops_weight, dtype=np.float64)
+        src = np.concatenate((src, np.arange(n)))
+        tgt = np.concatenate((tgt, np.arange(n)))
+        wgt = np.concatenate((wgt, lwgt))
+    total = np.bincount(src, weights=wgt, minlength=n)
+    inv = np.zeros(n)
+    inv[total > 0] = 1. / total[total > 0]
+    return sp.csr_matrix((wgt * inv[src], (src, tgt)), shape=(n, n))
+
+
+def prox_markov_matrix(graph, length, mode=OUT, add_loops=False, weight=None, loops_weight=None,
+                        sources=None, targets=None, cache=None):
+    """ Prox vectors of the walks starting on each vertex of `sources` (all
+    vertices by default), computed in batch with sparse matrix products.
+
+    Row `i` of the returned :class:`scipy.sparse.csr_matrix` is
+    `prox_markov_list(graph, [sources[i]], length, ...)`.
+
+    If `targets` is given only the columns of these vertices are computed
+    (walks are then computed backward from the targets, the cost depends on
+    the number of targets and not on the number of sources):
+
+    >>> import igraph as ig
+    >>> graph = ig.Graph.Formula("a--b--c--d")
+    >>> np.allclose(prox_markov_matrix(graph, 3, add_loops=True, targets=[3, 0]).toarray(),
+    ...             prox_markov_matrix(graph, 3, add_loops=True).toarray()[:, [3, 0]])
+    True
+
+    :param cache: a :class:`cello.graphs.cache.GraphCache`, if given the
+        matrix (of all vertices, with `weight` None or an edge attribute and
+        default loops weight) is computed once per graph and parameters.
+
+    >>> import igraph as ig
+    >>> graph = ig.Graph.Formula("a--b--c")
+    >>> prox_markov_matrix(graph, 3, add_loops=True).toarray()[0]
+    array([0.34722222, 0.43055556, 0.22222222])
+    >>> np.allclose(prox_markov_matrix(graph, 3, add_loops=True, sources=[2]).toarray(),
+    ...             prox_markov_list(graph, [2], 3, add_loops=True))
+    True
+    """
+    import scipy.sparse as sp
+    if cache is not None and sources is None and targets is None and loops_weight is None \
+            and (weight is None or isinstance(weight, basestring)):
+        # all modes are the same on undirected graphs
+        key = ("prox_markov_matrix", length, mode if graph.is_directed() else ALL, add_loops, weight)
+        return cache.get(graph, key, weight=weight,
+            compute=lambda: prox_markov_matrix(graph, length, mode=mode, add_loops=add_loops, weight=weight))
+    trans = transition_matrix(graph, mode=mode, add_loops=add_loops, weight=weight,
+                              loops_weight=loops_weight)
+    n = graph.vcount()
+    if targets is not None:
+        targets = np.asarray(targets, dtype=np.int64)
+        vects = sp.csr_matrix((np.ones(len(targets)), (targets, np.arange(len(targets)))),
+                              shape=(n, len(targets)))
+        for _ in range(length):
+            vects = trans.dot(vects)
+        vects = vects.tocsr()
+        return vects if sources is None else vects[np.asarray(sources, dtype=np.int64)]
+    sources = np.arange(n) if sources is None else sources
+    return prox_markov_rows(trans, sources, length)
+
+
+def prox_markov_rows(trans, sources, length):
+    """ Prox vectors of the walks starting on each vertex of `sources`, from
+    a transition matrix (see :func:`transition_matrix`).
+
+    >>> import igraph as ig
+    >>> graph = ig.Graph.Formula("a--b--c")
+    >>> prox_markov_rows(transition_matrix(graph, add_loops=True), [0], 3).toarray()
+    array([[0.34722222, 0.43055556, 0.22222222]])
+    """
+    import scipy.sparse as sp
+    sources = np.asarray(sources, dtype=np.int64)
+    vects = sp.csr_matrix((np.ones(len(sources)), (np.arange(len(sources)), sources)),
+                          shape=(len(sources), trans.shape[0]))
+    for _ in range(length):
+        vects = vects.dot(trans)
+    return vects.tocsr()
+
+
 def prox_markov_mtcl(graph, p0, length, throws, mode=OUT, add_loops=False, loops_weight=None,
                         weight=None, neighbors=None):
     """ Prox 'classic' by an approximate method montecarlo with nb_throw throws
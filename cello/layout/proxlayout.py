@@ -5,14 +5,59 @@
 Set of 'prox' graphs layout, moslty based on igraph layouts
 """
 
+import numpy as np
 import igraph as ig
 
 from reliure import Optionable, Composable
-from reliure.types import Numeric, Boolean
+from reliure.types import Numeric, Boolean, Text
 
 from cello.graphs import prox
 from cello.graphs import EDGE_WEIGHT_ATTR
+from cello.graphs.cache import prox_cache, graph_fingerprint, GraphCache, RowCache
 from cello.layout.transform import ReducePCA, ReduceRandProj, ReduceMDS, ReduceTSNE, normalise
+from cello.layout.transform import check_dense_size
+
+
+def select_landmarks(graph, count, method=u"degree", length=3, add_loops=True, weight=None, seed=0):
+    """ Selects `count` landmark vertices of a graph:
+
+    * `degree`: the vertices of highest degree,
+    * `kmeans++`: the vertex of highest degree, then vertices drawn with a
+      probability that grows as they are less reached by the random walks
+      to the landmarks already selected (as k-means++ seeding).
+
+    >>> g = ig.Graph.Formula("a--b:c:d, b--c, d--e--f--g--h, g--i")
+    >>> g.vs[select_landmarks(g, 2)]["name"]
+    ['a', 'g']
+    >>> g.vs[select_landmarks(g, 2, method=u"kmeans++")]["name"]
+    ['a', 'h']
+    >>> g.add_vertices(1)
+    >>> len(set(select_landmarks(g, 10, method=u"kmeans++", add_loops=False)))
+    10
+    """
+    count = min(count, graph.vcount())
+    degree = np.asarray(graph.strength(weights=weight), dtype=np.float64)
+    if method == u"degree":
+        return np.argsort(-degree, kind="stable")[:count].tolist()
+    trans = prox.transition_matrix(graph, mode=prox.ALL, add_loops=add_loops, weight=weight)
+    rng = np.random.RandomState(seed)
+    landmarks = [int(np.argmax(degree))]
+    coverage = np.zeros(graph.vcount())
+    while len(landmarks) < count:
+        # walks to the last landmark
+        vect = np.zeros(graph.vcount())
+        vect[landmarks[-1]] = 1.
+        for _ in range(length):
+            vect = trans.dot(vect)
+        if vect.max() > 0:  # an isolated landmark (without loops) reaches nothing
+            coverage = np.maximum(coverage, vect / vect.max())
+        probas = (1. - coverage) ** 2
+        probas[landmarks] = 0.
+        if probas.sum() <= 0:
+            probas = np.ones(graph.vcount())
+            probas[landmarks] = 0.
+        landmarks.append(int(rng.choice(graph.vcount(), p=probas / probas.sum())))
+    return landmarks
 
 
 class ProxLayout(Optionable):
@@ -31,28 +76,75 @@ class ProxLayout(Optionable):
     >>> layout_wgt = ProxLayout(weighted=True)
     >>> layout_wgt(g)
     <Layout with 5 vertices and 5 dimensions>
+
+    The prox vectors are computed in batch (see
+    :func:`cello.graphs.prox.prox_markov_matrix`) and kept in a cache shared
+    with :class:`cello.clustering.proxclustering.ProxClustering`, so the
+    clustering of the same graph do not compute the walks again.
+
+    On large graphs the n*n layout does not fit in memory, with `sparse=True`
+    the prox vectors are returned as a float32 sparse matrix, that
+    :class:`cello.layout.transform.ReducePCA` and
+    :class:`cello.layout.transform.ReduceRandProj` reduce without densifying it
+    (the dense layout, and the reducers that need it, are refused above
+    :data:`cello.layout.transform.DENSE_MAX_VERTICES` vertices):
+
+    >>> coords = ProxLayout(sparse=True)(g)
+    >>> coords.shape, coords.dtype
+    ((5, 5), dtype('float32'))
+
+    For large graphs the prox vectors can be restricted to `landmarks`
+    vertices (see :func:`select_landmarks`), only the walks to these vertices
+    are computed, the result is then a n*L layout (or sparse matrix):
+
+    >>> ProxLayout(sparse=True)(g, landmarks=2).shape
+    (5, 2)
+    >>> ProxLayout()(g, landmarks=2)
+    <Layout with 5 vertices and 2 dimensions>
     """
-    def __init__(self, name="prox_layout", weighted=False):
+    def __init__(self, name="prox_layout", weighted=False, cache=prox_cache, sparse=False):
         """
         :param weighted: whether to use the weight of the graph, is True the edge
             attribute `cello.graphs.EDGE_WEIGHT_ATTR` is used.
         :type weighted: boolean
+        :param cache: cache of prox matrices (:class:`cello.graphs.cache.GraphCache`),
+            None to disable it
+        :param sparse: whether to return a sparse matrix instead of a
+            :class:`igraph.Layout`
         """
         super(ProxLayout, self).__init__(name=name)
         self.add_option("length", Numeric(default=3, min=1, max=50, help="Random walks length"))
         self.add_option("add_loops", Boolean(default=True, help="Wether to add self loop on all vertices"))
+        self.add_option("landmarks", Numeric(default=0, min=0,
+            help="Number of landmark vertices (0 to use all vertices)"))
+        self.add_option("landmark_selection", Text(default=u"degree", choices=[u"degree", u"kmeans++"],
+            help=u"Landmarks selection method, 'degree' or 'kmeans++'"))
         self.weighted = weighted
+        self.cache = cache
+        self.sparse = sparse
 
     @Optionable.check
-    def __call__(self, graph, length=None, add_loops=None):
+    def __call__(self, graph, length=None, add_loops=None, landmarks=0, landmark_selection=u"degree"):
         weight = None
         if self.weighted:
             weight = EDGE_WEIGHT_ATTR
         #TODO: manage loops weight !
         graph.to_undirected()
-        coords = [prox.prox_markov_list(graph, [vtx.index], weight=weight, length=length, add_loops=add_loops) \
-                        for vtx in graph.vs]
-        return ig.Layout(coords, dim=len(coords))
+        if 0 < landmarks < graph.vcount():
+            targets = select_landmarks(graph, landmarks, method=landmark_selection, length=length,
+                                       add_loops=add_loops, weight=weight)
+            coords = prox.prox_markov_matrix(graph, length, add_loops=add_loops, weight=weight,
+                                             targets=targets)
+            if self.sparse:
+                return coords.astype(np.float32)
+            return ig.Layout(coords.toarray().tolist(), dim=len(targets))
+        if not self.sparse:
+            check_dense_size(graph.vcount(), "ProxLayout with sparse=False")
+        coords = prox.prox_markov_matrix(graph, length, add_loops=add_loops, weight=weight,
+                                         cache=self.cache)
+        if self.sparse:
+            return coords.astype(np.float32)
+        return ig.Layout(coords.toarray().tolist(), dim=graph.vcount())
 
 
 def ProxLayoutPCA(name="ProxLayoutPCA", dim=3, weighted=False):
@@ -69,8 +161,33 @@ def ProxLayoutPCA(name="ProxLayoutPCA", dim=3, weighted=False):
     'ProxLayoutPCA'
     >>> layout(g)
     <Layout with 5 vertices and 2 dimensions>
+
+    The prox vectors are kept sparse (see :class:`ProxLayout`) and reduced by
+    a randomized PCA, so it scales to graphs of some ten thousand vertices.
+    """
+    layout_cpt = ProxLayout(name=name, weighted=weighted, sparse=True) | ReducePCA(dim=dim) | normalise
+    layout_cpt.name = name
+    return layout_cpt
+
+
+def ProxLayoutLandmarks(name="ProxLayoutLandmarks", dim=3, landmarks=100, weighted=False):
+    """ Prox layout computed from the walks to `landmarks` vertices only (see
+    :class:`ProxLayout`), reduced by a PCA. The cost is L walks instead of n.
+
+    :param name: name of the component
+    :param dim: number of dimentions of the output layouts
+    :param landmarks: number of landmark vertices
+    :param weighted: whether to use the weight of the graph, is True the edge
+        attribute `cello.graphs.EDGE_WEIGHT_ATTR` is used.
+
+    >>> g = ig.Graph.Formula("a--b, a--c, a--d, a--f, f--g--h")
+    >>> layout = ProxLayoutLandmarks(dim=2, landmarks=4)
+    >>> layout(g)
+    <Layout with 7 vertices and 2 dimensions>
     """
-    layout_cpt = ProxLayout(name=name, weighted=weighted) | ReducePCA(dim=dim) | normalise
+    prox_layout = ProxLayout(name=name, weighted=weighted, sparse=True)
+    prox_layout.change_option_default("landmarks", landmarks)
+    layout_cpt = prox_layout | ReducePCA(dim=dim) | normalise
     layout_cpt.name = name
     return layout_cpt
 
@@ -89,7 +206,7 @@ def ProxLayoutRandomProj(name="ProxLayoutRandomProj", dim=3):
     >>> layout(g)
     <Layout with 5 vertices and 3 dimensions>
     """
-    layout_cpt = ProxLayout() | ReduceRandProj(dim=dim) | normalise
+    layout_cpt = ProxLayout(sparse=True) | ReduceRandProj(dim=dim) | normalise
     layout_cpt.name = name
     return layout_cpt
 
@@ -102,6 +219,9 @@ def ProxLayoutMDS(name="ProxLayoutMDS", dim=3, weighted=False):
     :param dim: number of dimentions of the output layouts
     :param weighted: whether to use the weight of the graph, is True the edge
         attribute `cello.graphs.EDGE_WEIGHT_ATTR` is used.
+
+    .. Warning:: the prox vectors are dense, graphs of more than
+        :data:`cello.layout.transform.DENSE_MAX_VERTICES` vertices are refused.
     """
     layout_cpt = ProxLayout(name=name, weighted=weighted) | ReduceMDS(dim=dim) | normalise
     layout_cpt.name = name
@@ -115,6 +235,9 @@ def ProxLayoutTSNE(name="ProxLayoutTSNE", dim=3, weighted=False):
     :param dim: number of dimentions of the output layouts
     :param weighted: whether to use the weight of the graph, is True the edge
         attribute `cello.graphs.EDGE_WEIGHT_ATTR` is used.
+
+    .. Warning:: the prox vectors are dense, graphs of more than
+        :data:`cello.layout.transform.DENSE_MAX_VERTICES` vertices are refused.
     """
     layout_cpt = ProxLayout(name=name, weighted=weighted) | ReduceTSNE(dim=dim) | normalise
     layout_cpt.name = name
@@ -227,32 +350,117 @@ def ProxBigraphLayoutRandomProj(name="ProxLayoutBigraphPCA", dim=3):
     return layout_cpt
 
 
-class ProxGlobalLayout(ProxLayout):
-    """ Prox Layout on the 'global' graph
-    
-    .. Warning:: THIS SHOULD BE UPDATED !
+class ProxGlobalLayout(Optionable):
+    """ Prox Layout on the 'global' graph: the prox vectors of the vertices of
+    a local graph (built by :class:`cello.graphs.builder.Subgraph`) are
+    computed with random walks on the global graph, and restricted to the
+    vertices of the local graph. So the layout of a vertex does not depend on
+    the other vertices extracted with it, and layouts stay stable across
+    queries.
+
+    .. Note:: as :class:`ProxLayout` the result is a n*n layout (or sparse
+        matrix) that should be reduced.
+
+    >>> from cello.graphs.builder import Subgraph
+    >>> global_graph = ig.Graph.Formula("a--b--c--d, b--d, b--e, e--f")
+    >>> subgraph_builder = Subgraph(global_graph)
+    >>> layout = ProxGlobalLayout(global_graph)
+    >>> layout(subgraph_builder([0, 1, 3]))
+    <Layout with 3 vertices and 3 dimensions>
+
+    Global prox vectors are kept in a bounded cache (see
+    :class:`cello.graphs.cache.RowCache`), overlapping local graphs only
+    compute the vectors of their new vertices:
+
+    >>> layout(subgraph_builder([0, 1, 4]))
+    <Layout with 3 vertices and 3 dimensions>
+    >>> layout.row_cache.hits, layout.row_cache.misses
+    (2, 4)
+
+    The cache may be shared, rows of an other global graph or weighting are
+    not mixed up:
+
+    >>> global_graph.es["weight"] = [1., 2., 1., 1., 3.]
+    >>> wlayout = ProxGlobalLayout(global_graph, weighted=True, row_cache=layout.row_cache)
+    >>> wlayout(subgraph_builder([0, 1, 4]))
+    <Layout with 3 vertices and 3 dimensions>
+    >>> layout.row_cache.hits, layout.row_cache.misses
+    (2, 7)
+
+    Changing the weights of the global graph in place invalidates its rows:
+
+    >>> global_graph.es["weight"] = [1., 1., 1., 1., 3.]
+    >>> wlayout(subgraph_builder([0, 1, 4]))
+    <Layout with 3 vertices and 3 dimensions>
+    >>> layout.row_cache.hits, layout.row_cache.misses
+    (2, 10)
+
+    Vertices of the local graph should have a `gid` attribute:
+
+    >>> layout(ig.Graph.Formula("a--b"))
+    Traceback (most recent call last):
+    ...
+    ValueError: There is no global vertex id ('gid' attribute) on subgraph vertices
     """
-    def __init__(self, global_graph, name='ProxGlobalLayout'):
-        raise NotImplementedError("this should be updated...")
+    def __init__(self, global_graph, name='ProxGlobalLayout', weighted=False, sparse=False,
+                 row_cache=None, cache_size=10000):
+        """
+        :param global_graph: the global graph, vertex `gid` of a local graph is
+            the vertex `gid` of this graph
+        :param weighted: whether to use the weight of the graph, is True the edge
+            attribute `cello.graphs.EDGE_WEIGHT_ATTR` is used.
+        :param sparse: whether to return a sparse matrix instead of a
+            :class:`igraph.Layout`
+        :param row_cache: a :class:`cello.graphs.cache.RowCache` of the global
+            prox vectors, to share it between components (rows are cached by
+            global graph, fingerprint of its edges and weights, and walk
+            parameters)
+        :param cache_size: maximum number of cached prox vectors (if
+            `row_cache` is not given)
+        """
         super(ProxGlobalLayout, self).__init__(name=name)
+        self.add_option("length", Numeric(default=3, min=1, max=50, help="Random walks length"))
+        self.add_option("add_loops", Boolean(default=True, help="Wether to add self loop on all vertices"))
         self.global_graph = global_graph
+        self.weighted = weighted
+        self.sparse = sparse
+        self.row_cache = row_cache if row_cache is not None else RowCache(maxsize=cache_size)
+        # transition matrices of the global graph (recomputed if it changes)
+        self._transitions = GraphCache(maxsize=2)
 
-    def __call__(self, subgraph, **kwargs):
-        """Compute a n-dimension layout for the given subgraph according to the
-        result of random walks in the given graph.
-        """
-        raise NotImplementedError("this should be updated...")
-        neighbors_fct = lambda g, vid: ( [vid] if True else [] ) + g.neighbors(vid)
-        coords = []
-
-        assert "kgraph_id" in subgraph.vertex_attributes(), "There is no global vertex id on subgraph vertices."
-        # sur le "kgraph" seulement ie le global
-        pzlist = subgraph.vs["kgraph_id"]
-        graph = self.global_graph
-
-        for gid in pzlist:
-            pline = self.prox_func(graph, [gid], neighbors_fct, **kwargs )
-            coords.append([pline.get(to_gid, .0) for to_gid in pzlist])
+    def _weight(self):
+        return EDGE_WEIGHT_ATTR if self.weighted else None
 
-        return coords
+    def transition(self, add_loops):
+        """ Transition matrix of the global graph (computed once for the
+        current edges and weights)
+        """
+        weight = self._weight()
+        compute = lambda: prox.transition_matrix(self.global_graph, mode=prox.ALL,
+                                                 add_loops=add_loops, weight=weight)
+        return self._transitions.get(self.global_graph, ("transition", add_loops), compute,
+                                     weight=weight)
 
+    @Optionable.check
+    def __call__(self, subgraph, length=None, add_loops=None):
+        """Compute a n-dimension layout for the given subgraph according to the
+        result of random walks in the global graph.
+        """
+        import scipy.sparse as sp
+        if "gid" not in subgraph.vertex_attributes():
+            raise ValueError("There is no global vertex id ('gid' attribute) on subgraph vertices")
+        gids = subgraph.vs["gid"]
+        trans = self.transition(add_loops)
+        compute = lambda keys: list(prox.prox_markov_rows(trans, [key[0] for key in keys], length))
+        # the cache may be shared (and outlive the graph): rows are keyed by
+        # the fingerprint of the graph and checked to belong to it
+        fingerprint = graph_fingerprint(self.global_graph, self._weight())
+        keys = [(gid, length, add_loops, id(self.global_graph), fingerprint) for gid in gids]
+        rows = self.row_cache.get_rows(keys, compute, owner=self.global_graph)
+        if rows:
+            coords = sp.vstack(rows).tocsc()[:, gids].tocsr()
+        else:
+            coords = sp.csr_matrix((0, 0))
+        if self.sparse:
+            return coords.astype(np.float32)
+        return ig.Layout(coords.toarray().tolist(), dim=len(gids))
@@ -5,12 +5,44 @@
 Set of basic graphs layout, moslty based on igraph layouts
 """
 
+import numpy as np
 import igraph as ig
 
 from reliure import Optionable, Composable
 from reliure.types import Numeric, Boolean
 
-from cello.layout.transform import normalise
+from cello.layout.transform import normalise, seed_layout, INCREMENTAL_MIN_RATIO
+
+
+def _incremental_seed(graph, previous, dim, key_attr, edge_length=1.):
+    """ Seed coordinates from a previous layout (see
+    :func:`cello.layout.transform.seed_layout`) and the ratio of the
+    iterations to do (the proportion of new vertices), `(None, 1.)` if there
+    is no previous layout.
+    """
+    if not previous:
+        return None, 1.
+    coords, known = seed_layout(graph, previous, dim, key_attr=key_attr, edge_length=edge_length)
+    if coords is None:
+        return None, 1.
+    return coords.tolist(), max(1. - known.mean(), INCREMENTAL_MIN_RATIO)
+
+
+def approx_diameter(graph):
+    """ Lower bound of the diameter of a graph by a double sweep: a BFS from
+    the vertex of highest degree, then a BFS from the farthest vertex found
+    (two BFS instead of the all pairs BFS of :meth:`igraph.Graph.diameter`).
+
+    >>> approx_diameter(ig.Graph.Formula("a--b--c--d--e, c--f"))
+    4
+    """
+    if graph.vcount() == 0:
+        return 0
+    start = int(np.argmax(graph.degree()))
+    for _ in range(2):
+        vids, layers, _ = graph.bfs(start, mode=ig.ALL)
+        start = vids[-1]
+    return len(layers) - 2
 
 
 class  DrlLayout(Composable):
@@ -20,7 +52,16 @@ class  DrlLayout(Composable):
     >>> layout = DrlLayout(dim=2)
     >>> layout(g)
     <Layout with 4 vertices and 2 dimensions>
+
+    It may be seeded from the layout of a previous version of the graph, a dict
+    vertex stable id -> coordinates (see :func:`cello.layout.transform.keyed_layout`),
+    the refine schedule of DrL is then used:
+
+    >>> layout(g, previous={"a": [0., 0.], "b": [1., 0.]})
+    <Layout with 4 vertices and 2 dimensions>
     """
+    incremental = True
+
     def __init__(self, name="DrL", dim=3, weighted=False):
         """ Build the layout component
         
@@ -32,15 +73,18 @@ class  DrlLayout(Composable):
         self.dimensions = dim
         self.weighted = weighted
         
-    def __call__(self, graph):
+    def __call__(self, graph, previous=None, key_attr=None):
         """
-        :param seed:  a (list of lists) initial matrix 
+        :param previous: previous layout, a dict vertex stable id -> coordinates
+        :param key_attr: vertex attribute used as stable id
         :see: http://igraph.org/python/doc/igraph.Graph-class.html#layout_drl
         """
         weights = None
         if self.weighted:
             weights = graph.es['weight']
-        return normalise(graph.layout_drl( weights=weights,  fixed=None, seed=None, options=None, dim=self.dimensions))
+        seed, _ = _incremental_seed(graph, previous, self.dimensions, key_attr)
+        options = None if seed is None else "refine"
+        return normalise(graph.layout_drl( weights=weights,  fixed=None, seed=seed, options=options, dim=self.dimensions))
 
 class KamadaKawaiLayout(Composable):
     """ Kamada Kawai layout
@@ -49,7 +93,16 @@ class KamadaKawaiLayout(Composable):
     >>> layout = KamadaKawaiLayout(dim=2)
     >>> layout(g)
     <Layout with 4 vertices and 2 dimensions>
+
+    It may be seeded from the layout of a previous version of the graph (see
+    :class:`DrlLayout`), the number of iterations is then proportional to the
+    number of new vertices:
+
+    >>> layout(g, previous={"a": [0., 0.], "b": [1., 0.], "c": [0., 1.]})
+    <Layout with 4 vertices and 2 dimensions>
     """
+    incremental = True
+
     def __init__(self, name="kamada_kawai", dim=3):
         """ Build the layout component
         
@@ -60,12 +113,21 @@ class KamadaKawaiLayout(Composable):
         assert dim == 2 or dim == 3
         self.dimensions = dim
         
-    def __call__(self, graph, seed=None):
+    def __call__(self, graph, seed=None, previous=None, key_attr=None):
         """
         :param seed:  a (list of lists) initial matrix 
+        :param previous: previous layout, a dict vertex stable id -> coordinates
+        :param key_attr: vertex attribute used as stable id
         :see: http://igraph.org/python/doc/igraph.Graph-class.html#layout_kamada_kawai
         """
-        return normalise(graph.layout_kamada_kawai(dim=self.dimensions, seed=seed))
+        maxiter = 50 * graph.vcount()
+        if seed is None and previous:
+            # Kamada Kawai edges length is sqrt(n) / diameter
+            edge_length = np.sqrt(graph.vcount()) / max(approx_diameter(graph), 1)
+            seed, ratio = _incremental_seed(graph, previous, self.dimensions, key_attr,
+                                            edge_length=edge_length)
+            maxiter = max(int(maxiter * ratio), 1)
+        return normalise(graph.layout_kamada_kawai(dim=self.dimensions, seed=seed, maxiter=maxiter))
 
 class FruchtermanReingoldLayout(Composable):
     """ Fruchterman Reingold layout
@@ -74,7 +136,16 @@ class FruchtermanReingoldLayout(Composable):
     >>> layout = FruchtermanReingoldLayout(dim=3)
     >>> layout(g)
     <Layout with 4 vertices and 3 dimensions>
+
+    It may be seeded from the layout of a previous version of the graph (see
+    :class:`DrlLayout`), the number of iterations and the start temperature
+    are then proportional to the number of new vertices:
+
+    >>> layout(g, previous={"a": [0., 0., 0.], "b": [1., 0., 0.]})
+    <Layout with 4 vertices and 3 dimensions>
     """
+    incremental = True
+
     def __init__(self, name="fruchterman_reingold", dim=3, weighted=False):
         """ Build the layout component
         
@@ -86,9 +157,18 @@ class FruchtermanReingoldLayout(Composable):
         self.dimensions = dim
         self.weighted = weighted
 
-    def __call__(self, graph):
+    def __call__(self, graph, previous=None, key_attr=None):
+        """
+        :param previous: previous layout, a dict vertex stable id -> coordinates
+        :param key_attr: vertex attribute used as stable id
+        """
         weights = graph.es['weight'] if self.weighted else None
-        return normalise(graph.layout_fruchterman_reingold(dim=self.dimensions, weights=weights))
+        kwargs = {}
+        seed, ratio = _incremental_seed(graph, previous, self.dimensions, key_attr)
+        if seed is not None:
+            kwargs = dict(seed=seed, niter=max(int(500 * ratio), 1),
+                          start_temp=np.sqrt(graph.vcount()) / 10. * ratio)
+        return normalise(graph.layout_fruchterman_reingold(dim=self.dimensions, weights=weights, **kwargs))
 
 
 class RandomLayout(Composable):
@@ -5,17 +5,93 @@
 Set of component to transform a layout (reduce dimention, normalize, shake, ...)
 """
 import warnings
+from itertools import chain
 
 from builtins import range
 
 import numpy as np
 import scipy as sc
+import scipy.sparse as sp
 
 
 import igraph as ig
 
 from reliure import Composable, Optionable
 
+#: minimal proportion of the iterations done when a layout is seeded from a
+#: previous layout
+INCREMENTAL_MIN_RATIO = 0.1
+
+#: maximum number of vertices of a dense n*n layout (prox vectors or distance
+#: matrix), larger graphs should use sparse prox vectors or landmarks
+DENSE_MAX_VERTICES = 5000
+
+
+def check_dense_size(nb_vertices, what):
+    """ Raises a :class:`ValueError` if a dense n*n matrix would be built for
+    more than :data:`DENSE_MAX_VERTICES` vertices
+
+    >>> check_dense_size(10, "MDS")
+    >>> check_dense_size(10**5, "MDS")
+    Traceback (most recent call last):
+    ...
+    ValueError: MDS needs a dense 100000*100000 matrix (more than 5000 vertices), use sparse prox vectors (ReducePCA, ReduceRandProj) or landmarks
+    """
+    if nb_vertices > DENSE_MAX_VERTICES:
+        raise ValueError("%s needs a dense %d*%d matrix (more than %d vertices), use sparse prox "
+                         "vectors (ReducePCA, ReduceRandProj) or landmarks"
+                         % (what, nb_vertices, nb_vertices, DENSE_MAX_VERTICES))
+
+
+def _inverse(values):
+    inv = np.zeros(len(values))
+    inv[values > 0] = 1. / values[values > 0]
+    return inv
+
+
+def randomized_pca(mat, dim, n_iter=4, oversample=10, seed=0):
+    """ PCA with a cosine kernel (as :meth:`ReducePCA.robust_pca`) of a sparse
+    matrix, computed by a randomized truncated SVD.
+
+    Rows are normalised, centred, and normalised again (cosine kernel) then
+    centred by the kernel PCA. All these steps are applied implicitly in the
+    matrix products, so the matrix is never densified: memory is
+    O(nnz + n * dim).
+
+    >>> mat = sp.csr_matrix([[1., 1., 0., 0.], [0., 1., 0., 0.], [1., 0., 0., 0.], [0., 0., 2., 1.]])
+    >>> result = randomized_pca(mat, 2)
+    >>> expected = ReducePCA(2).robust_pca(mat.toarray())
+    >>> np.allclose(np.abs(result), np.abs(expected))
+    True
+    """
+    mat = sp.csr_matrix(mat, dtype=np.float64)
+    nb_rows, nb_cols = mat.shape
+    # rows normalisation
+    mat = sp.diags(_inverse(np.sqrt(np.asarray(mat.multiply(mat).sum(1)).ravel()))).dot(mat).tocsr()
+    mean = np.asarray(mat.mean(0)).ravel()
+    # norms of the centred rows, for the cosine kernel
+    sqnorms = np.asarray(mat.multiply(mat).sum(1)).ravel() - 2 * mat.dot(mean) + mean.dot(mean)
+    dinv = _inverse(np.sqrt(np.maximum(sqnorms, 0.)))
+    # mean of the normalised centred rows (kernel centring)
+    kmean = (mat.T.dot(dinv) - mean * dinv.sum()) / nb_rows
+    # Z = D^-1 (X - 1 mean^T) - 1 kmean^T, products by Z and Z^T
+    dot = lambda vects: dinv[:, None] * (mat.dot(vects) - mean.dot(vects)[None, :]) \
+                        - kmean.dot(vects)[None, :]
+    tdot = lambda vects: mat.T.dot(dinv[:, None] * vects) - np.outer(mean, dinv.dot(vects)) \
+                         - np.outer(kmean, vects.sum(0))
+    # randomized range finder with power iterations
+    rng = np.random.RandomState(seed)
+    nb_comp = min(dim + oversample, nb_rows, nb_cols)
+    basis = np.linalg.qr(dot(rng.normal(size=(nb_cols, nb_comp))))[0]
+    for _ in range(n_iter):
+        basis = np.linalg.qr(tdot(basis))[0]
+        basis = np.linalg.qr(dot(basis))[0]
+    usmall, svals, _ = np.linalg.svd(tdot(basis).T, full_matrices=False)
+    result = basis.dot(usmall[:, :dim]) * svals[:dim]
+    if result.shape[1] < dim:
+        result = np.hstack((result, np.zeros((nb_rows, dim - result.shape[1]))))
+    return result
+
 
 class ReducePCA(Composable):
     """ Reduce a layout dimention by a PCA
@@ -40,6 +116,18 @@ class ReducePCA(Composable):
     >>> pca(ig.Layout([[1, 1], [0, 1]])).coords
     [[1.0, 1.0, 0.0], [0.0, 1.0, 0.0]]
 
+    The input may also be a sparse matrix (see
+    :class:`cello.layout.proxlayout.ProxLayout`), it is then reduced by
+    :func:`randomized_pca` without building the dense matrix:
+
+    >>> pca = ReducePCA(2)
+    >>> pca(sp.identity(5, format="csr") + sp.csr_matrix(np.ones((5, 5))))
+    <Layout with 5 vertices and 2 dimensions>
+
+    It is also the case of not square layouts (prox vectors to landmarks):
+
+    >>> pca(ig.Layout([[1, 0, 0], [1, 1, 0], [0, 1, 0], [0, 1, 1], [0, 0, 1]]))
+    <Layout with 5 vertices and 2 dimensions>
     """
     def __init__(self, dim=3):
         super(ReducePCA, self).__init__()
@@ -92,8 +180,12 @@ class ReducePCA(Composable):
     def __call__(self, layout):
         """ Process a PCA
         """
+        if sp.issparse(layout):
+            return self.sparse_pca(layout)
         if len(layout) > 0 and len(layout) != layout.dim:
-            raise ValueError('The layout should have same number of vertices and dimensions')
+            # n*L prox vectors to landmarks
+            return self.sparse_pca(sp.csr_matrix(np.array(layout.coords, dtype=np.float64)))
+        check_dense_size(len(layout), "PCA of a dense layout")
         mat = np.array(layout.coords)
         if len(layout) == 0:
             result = []
@@ -105,6 +197,19 @@ class ReducePCA(Composable):
 
         return ig.Layout(result, dim=self.out_dim)
 
+    def sparse_pca(self, mat):
+        """ Process a PCA on a sparse matrix (n*n prox vectors, or n*L prox
+        vectors to landmarks)
+        """
+        nb_rows, nb_cols = mat.shape
+        if nb_rows == 0:
+            result = []
+        elif nb_cols <= self.out_dim:
+            result = np.hstack((mat.toarray(), np.zeros((nb_rows, self.out_dim - nb_cols)))).tolist()
+        else:
+            result = randomized_pca(mat, self.out_dim).tolist()
+        return ig.Layout(result, dim=self.out_dim)
+
 
 class ReducePCAMatplotlib(ReducePCA):
     @staticmethod
@@ -127,8 +232,13 @@ class ReduceRandProj(Composable):
     <Layout with 5 vertices and 3 dimensions>
     >>> rproj(ig.Layout([]))
     <Layout with no vertices and 2 dimensions>
+
+    Sparse matrices are reduced by a sparse random projection (see
+    :class:`sklearn.random_projection.SparseRandomProjection`):
+
+    >>> rproj(sp.identity(6, format="csr"))
+    <Layout with 6 vertices and 3 dimensions>
     """
-    #TODO use http://scikit-learn.org/stable/modules/random_projection.html
     def __init__(self, dim=3):
         super(ReduceRandProj, self).__init__()
         self.out_dim = dim
@@ -136,6 +246,12 @@ class ReduceRandProj(Composable):
     def __call__(self, layout):
         """ Process the random projection
         """
+        if sp.issparse(layout):
+            from sklearn.random_projection import SparseRandomProjection
+            if layout.shape[0] == 0:
+                return ig.Layout([])
+            rproj = SparseRandomProjection(n_components=self.out_dim, dense_output=True)
+            return ig.Layout(rproj.fit_transform(layout).tolist())
         if len(layout) == 0:
             return layout
         mat = np.array(layout.coords)
@@ -159,6 +275,7 @@ class ReduceMDS(Composable):
         import scipy.spatial.distance as d
         if len(layout) > 0 and len(layout) != layout.dim:
             raise ValueError('The layout should have same number of vertices and dimensions')
+        check_dense_size(len(layout), "MDS")
         mat = np.array(layout.coords)
         mat = d.cdist(mat, mat, metric="cosine")
         if len(layout) == 0:
@@ -187,6 +304,7 @@ class ReduceTSNE(Composable):
         from sklearn import manifold
         if len(layout) > 0 and len(layout) != layout.dim:
             raise ValueError('The layout should have same number of vertices and dimensions')
+        check_dense_size(len(layout), "t-SNE")
         mat = np.array(layout.coords)
         if len(layout) == 0:
             result = []
@@ -215,9 +333,191 @@ def normalise(layout):
     """
     if len(layout) == 0:
         return layout
-    layout.fit_into([1.] * layout.dim)
-    layout.center()
-    return layout
+    return ig.Layout(normalise_array(np.array(layout.coords, dtype=np.float64)).tolist())
+
+
+def normalise_array(mat):
+    """ Same as :func:`normalise` on a numpy array of coordinates (one row per
+    vertex): the bounding box is fitted into a box of width 1, keeping the
+    aspect ratio, and the centroid is moved to the origin.
+
+    >>> normalise_array(np.array([[0., 0.], [4., 2.], [2., 1.]])).tolist()
+    [[-0.5, -0.25], [0.5, 0.25], [0.0, 0.0]]
+    """
+    sizes = mat.max(0) - mat.min(0)
+    sizes[sizes == 0] = 2
+    mat = mat * (1. / sizes.max())
+    return mat - mat.mean(0)
+
+
+def vertex_keys(graph, key_attr=None):
+    """ Stable ids of the vertices of a graph: the `key_attr` vertex attribute,
+    by default `gid` (see :class:`cello.graphs.builder.Subgraph`) or `name`,
+    or the vertex index if the graph has none of them.
+
+    >>> import igraph as ig
+    >>> vertex_keys(ig.Graph.Formula("a--b--c"))
+    ['a', 'b', 'c']
+    """
+    if key_attr is None:
+        attrs = graph.vs.attributes()
+        key_attr = "gid" if "gid" in attrs else "name" if "name" in attrs else None
+    if key_attr is None:
+        return list(range(graph.vcount()))
+    return graph.vs[key_attr]
+
+
+def keyed_layout(graph, layout, key_attr=None):
+    """ Layout of a graph as a dict: vertex stable id (see :func:`vertex_keys`)
+    -> coordinates, to seed the next layout of an updated graph
+
+    >>> import igraph as ig
+    >>> keyed_layout(ig.Graph.Formula("a--b"), ig.Layout([[0., 1.], [1., 0.]]))
+    {'a': [0.0, 1.0], 'b': [1.0, 0.0]}
+    """
+    return dict(zip(vertex_keys(graph, key_attr), [list(coord) for coord in layout]))
+
+
+def seed_layout(graph, previous, dim, key_attr=None, edge_length=1., seed=0):
+    """ Initial coordinates of a graph from the layout of a previous version of
+    the graph (see :func:`keyed_layout`).
+
+    Vertices already in the previous layout keep their position, new vertices
+    are placed at the barycenter of their placed neighbours (vertices with no
+    placed vertex in their connected component are placed randomly).
+    Coordinates are scaled so that edges between known vertices have a mean
+    length of `edge_length` (the natural edge length of the layout algorithm).
+
+    :returns: `(coords, known)`: coordinates (numpy array) and mask of
+        the vertices of the previous layout, or `(None, known)` if no
+        vertex is known
+
+    >>> import igraph as ig
+    >>> graph = ig.Graph.Formula("a--b--c, b--d")
+    >>> coords, known = seed_layout(graph, {"a": [0., 0.], "b": [0., 2.], "d": [2., 2.]}, 2)
+    >>> known.tolist()
+    [True, True, False, True]
+    >>> coords[known].tolist()
+    [[0.0, 0.0], [0.0, 1.0], [1.0, 1.0]]
+    >>> bool(np.linalg.norm(coords[2] - coords[1]) < 0.5)   # 'c' is placed near 'b'
+    True
+    """
+    n = graph.vcount()
+    keys = vertex_keys(graph, key_attr)
+    known = np.array([key in previous for key in keys], dtype=np.bool_)
+    if not known.any():
+        return None, known
+    coords = np.zeros((n, dim))
+    for vid in np.flatnonzero(known):
+        coord = list(previous[keys[vid]])[:dim]
+        coords[vid, :len(coord)] = coord
+    edges = np.array(graph.get_edgelist(), dtype=np.int64).reshape(-1, 2)
+    # scale: mean length of edges between known vertices
+    kedges = edges[known[edges[:, 0]] & known[edges[:, 1]]]
+    lengths = np.linalg.norm(coords[kedges[:, 0]] - coords[kedges[:, 1]], axis=1)
+    lengths = lengths[lengths > 0]
+    unit = lengths.mean() if len(lengths) else max(coords[known].std(), 1.) / np.sqrt(n)
+    coords *= edge_length / unit
+    # new vertices at the barycenter of their placed neighbours
+    rng = np.random.RandomState(seed)
+    adjacency = sp.csr_matrix((np.ones(2 * len(edges)), (np.concatenate((edges[:, 0], edges[:, 1])),
+                              np.concatenate((edges[:, 1], edges[:, 0])))), shape=(n, n))
+    placed = known.copy()
+    while not placed.all():
+        count = adjacency.dot(placed.astype(np.float64))
+        frontier = ~placed & (count > 0)
+        if not frontier.any():
+            break
+        sums = adjacency.dot(coords * placed[:, None])
+        coords[frontier] = sums[frontier] / count[frontier, None] \
+                           + rng.normal(scale=0.1 * edge_length, size=(frontier.sum(), dim))
+        placed |= frontier
+    others = ~placed
+    coords[others] = coords[known].mean(0) + rng.normal(scale=edge_length, size=(others.sum(), dim))
+    return coords, known
+
+
+def align_layout(graph, layout, previous, key_attr=None):
+    """ Rotates, scales and moves a layout to best fit the previous layout (see
+    :func:`keyed_layout`) on their common vertices (orthogonal Procrustes),
+    so that a new layout of an updated graph looks like the previous one.
+
+    >>> import igraph as ig
+    >>> graph = ig.Graph.Formula("a--b--c")
+    >>> layout = ig.Layout([[0., 0.], [0., 1.], [0., 2.]])
+    >>> aligned = align_layout(graph, layout, {"a": [1., 0.], "b": [0., 0.], "c": [-1., 0.]})
+    >>> np.array(aligned.coords).round(6).tolist()
+    [[1.0, 0.0], [0.0, 0.0], [-1.0, 0.0]]
+    """
+    keys = vertex_keys(graph, key_attr)
+    common = [vid for vid, key in enumerate(keys) if key in previous]
+    if len(layout) == 0 or len(common) < 2:
+        return layout
+    mat = np.array(layout.coords, dtype=np.float64)
+    target = np.array([list(previous[keys[vid]])[:layout.dim] for vid in common], dtype=np.float64)
+    if target.shape[1] != layout.dim:
+        return layout
+    source = mat[common]
+    smean, tmean = source.mean(0), target.mean(0)
+    source, target = source - smean, target - tmean
+    umat, svals, vtmat = np.linalg.svd(source.T.dot(target))
+    rotation = umat.dot(vtmat)
+    norm = (source ** 2).sum()
+    scale = svals.sum() / norm if norm > 0 else 1.
+    return ig.Layout(((mat - smean).dot(rotation) * scale + tmean).tolist())
+
+
+class IncrementalLayout(Optionable):
+    """ Computes a layout seeded from the previous layout of the graph, and
+    aligns it on the previous layout so a small change of the graph gives a
+    small change of the picture.
+
+    The previous layout is given as a dict: vertex stable id -> coordinates
+    (see :func:`keyed_layout`). If the wrapped layout is `incremental` (as
+    :class:`cello.layout.simple.FruchtermanReingoldLayout`) it is seeded from
+    it, and its number of iterations is cut according to the proportion of new
+    vertices.
+
+    >>> from cello.layout.simple import FruchtermanReingoldLayout
+    >>> graph = ig.Graph.Formula("a--b--c--d--a, d--e")
+    >>> layout_cpt = IncrementalLayout(FruchtermanReingoldLayout(dim=2))
+    >>> layout = layout_cpt(graph)
+    >>> previous = keyed_layout(graph, layout)
+    >>> graph = ig.Graph.Formula("a--b--c--d--a, d--e--f")
+    >>> layout = layout_cpt(graph, previous=previous)
+    >>> layout
+    <Layout with 6 vertices and 2 dimensions>
+
+    The result is expressed in the frame of the previous layout (it is not
+    normalised again), so known vertices stay close to their previous
+    position:
+
+    >>> moves = [np.linalg.norm(np.subtract(coord, previous[key])) for key, coord
+    ...          in zip(graph.vs["name"], layout) if key in previous]
+    >>> bool(np.mean(moves) < 0.2)
+    True
+
+    Layouts that can not be seeded (as the prox layouts) are only aligned.
+    """
+    def __init__(self, layout, key_attr=None, name=None):
+        """
+        :param layout: the layout component
+        :param key_attr: the vertex attribute used as stable vertex id (see
+            :func:`vertex_keys`)
+        """
+        super(IncrementalLayout, self).__init__(name=name)
+        self._layout_mth = layout
+        self.key_attr = key_attr
+
+    def __call__(self, graph, previous=None, **kwargs):
+        if not previous:
+            return self._layout_mth(graph, **kwargs)
+        if getattr(self._layout_mth, "incremental", False):
+            layout = self._layout_mth(graph, previous=previous, key_attr=self.key_attr, **kwargs)
+        else:
+            layout = self._layout_mth(graph, **kwargs)
+        # not normalised again: it would undo the alignment
+        return align_layout(graph, layout, previous, key_attr=self.key_attr)
 
 
 class Shaker(Composable):
@@ -231,70 +531,114 @@ class Shaker(Composable):
     >>> shaker = Shaker(0.2)
     >>> layout = shaker(layout)
     >>> layout.coords
-    [[0.0, -0.19083333333315153], [0.0, 0.33166666666666667], [0.0, -0.14083333333351528]]
+    [[0.0, -0.19060658517333334], [0.0, 0.33166666666666667], [0.0, -0.14106008149333332]]
+
+    Close vertices are found with a kd-tree (see
+    :meth:`scipy.spatial.cKDTree.query_pairs`), and only these vertices are moved, so
+    large layouts are shaken in O(n log n). The size of the vertices shrinks
+    as their number grows so that they can be separated:
+
+    >>> layout = shaker(ig.Layout(np.random.RandomState(0).rand(5000, 3).round(1).tolist()))
+    >>> len(layout)
+    5000
 
     If the layout is empty:
     >>> shaker(ig.Layout())
     <Layout with no vertices and 2 dimensions>
     """
-    def __init__(self, kelastic=0.3):
+    def __init__(self, kelastic=0.3, tolerance=0.01):
         """
         :param kelastic: coeficient d'elasticité: `force = kelastic * dlen`
+        :param tolerance: relative tolerance on the minimal distance between
+            vertices
         """
         super(Shaker, self).__init__(name='shake')
         self.kelastic = kelastic
+        self.tolerance = tolerance
+
+    @staticmethod
+    def _near_pairs(tree, points, ids, radius, keep=None):
+        """ Pairs `(ids[i], j)` of the `points` and the points `j` of the tree
+        closer than `radius` (and with `keep[j]` if given)
+        """
+        near = tree.query_ball_point(points, radius, return_sorted=False)
+        counts = np.fromiter((len(lst) for lst in near), dtype=np.int64, count=len(near))
+        pairs = np.empty((counts.sum(), 2), dtype=np.int64)
+        pairs[:, 0] = np.repeat(ids, counts)
+        pairs[:, 1] = np.fromiter(chain.from_iterable(near), dtype=np.int64, count=counts.sum())
+        if keep is not None:
+            pairs = pairs[keep[pairs[:, 1]]]
+        return pairs
 
     def shake(self, layout):
-        from scipy.spatial.distance import pdist, squareform
+        from scipy.spatial import cKDTree
         iter_max = 50  # try to keep low
-
         layout_mat = np.array(layout.coords, dtype=float)
         nbs, nbdim = layout_mat.shape       # nb objets, nb dimension de l'espace
-        deplacements = np.zeros((nbs, nbdim))  # matrice des déplacement élémentaires
         # on calcul la taille des spheres,
         # l'heuristique c'est que l'on puisse mettre 10 spheres sur la largeur du layout
         # le layout fait 1 de large
-        size_elem = 1./10.
+        # (au plus la moitié de l'espacement moyen de n spheres, sinon elles
+        # ne peuvent pas être séparées)
+        size_elem = min(1./10., 0.5 * nbs ** (-1. / nbdim))
         sizes = size_elem * np.ones((nbs)) # a pseudo sphere size
 
-        # calcul la matrice des distances minimales entre sommets
-        dists_min = (sizes[:, None] + sizes[None, :]) / 2
-        dists_min -= np.diag(dists_min.diagonal()) # diagonal = 0
-
-        chevauchement = True # est-ce qu'il y a chevauchement entre les spheres ?
-        nb_iter = 0
-        while nb_iter < iter_max and chevauchement:
-            nb_iter += 1
-            # calcul des distances entre les spheres
-            dists = pdist(layout_mat, 'euclidean')
-            dists = squareform(dists, force='tomatrix')
-            # si tout les distances sont sup a distance min
-            chevauchement = (dists < dists_min).any()
-            if not chevauchement:
+        radius = sizes.max()
+        # kd-tree des positions, les sommets déplacés depuis sa construction
+        # sont "stale" (cherchés dans un petit kd-tree a part)
+        tree = cKDTree(layout_mat)
+        stale = np.zeros(nbs, dtype=np.bool_)
+        moved = None
+        for nb_iter in range(iter_max):
+            # paires de spheres proches, seuls les sommets déplacés peuvent
+            # avoir de nouveaux chevauchements
+            if moved is not None and (len(moved) > nbs / 8 or stale.sum() > nbs / 4):
+                tree = cKDTree(layout_mat)
+                stale[:] = False
+                moved = None if len(moved) > nbs / 8 else moved
+            if moved is None:
+                pairs = tree.query_pairs(radius, output_type='ndarray')
+            else:
+                pairs = [self._near_pairs(tree, layout_mat[moved], moved, radius, ~stale)]
+                stale_ids = np.flatnonzero(stale)
+                if len(stale_ids):
+                    near = self._near_pairs(cKDTree(layout_mat[stale_ids]), layout_mat[moved],
+                                            moved, radius)
+                    pairs.append(np.column_stack((near[:, 0], stale_ids[near[:, 1]])))
+                pairs = np.concatenate(pairs)
+                pairs = np.sort(pairs[pairs[:, 0] != pairs[:, 1]], axis=1)
+                _, uniq = np.unique(pairs[:, 0] * nbs + pairs[:, 1], return_index=True)
+                pairs = pairs[uniq]
+            pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+            source, dest = pairs[:, 0], pairs[:, 1]
+            # vecteurs de deplacement de source vers dest
+            vect_depl = layout_mat[dest] - layout_mat[source]
+            dists = np.sqrt((vect_depl ** 2).sum(1))
+            dists_min = (sizes[source] + sizes[dest]) / 2
+            # les forces n'amènent les spheres qu'asymptotiquement a leur
+            # distance minimale, on s'arrete a une tolérance près
+            overlap = dists < (1. - self.tolerance) * dists_min
+            if not overlap.any():
                 break
-            # calcul des vecteurs de deplacement de chaque sphere (= somme des forces qui s'exerce sur chaque sommet)
-            deplacements[:, :] = 0 # raz
-            for source in range(nbs):
-                for dest in range(source+1, nbs):
-                    if dists[source, dest] < dists_min[source, dest]:
-                        # vecteur de deplacement de source vers dest
-                        vect_depl = layout_mat[dest] - layout_mat[source]
-                        # deplacement aléatoire si chevauchement parfait
-                        vnorm = np.linalg.norm(vect_depl)
-                        if vnorm < 1e-10:
-                            vect_depl = np.random.random(nbdim)
-                            vnorm = np.linalg.norm(vect_depl)
-                        vect_depl /= vnorm # normalisation
-                        # force = prop a la difference entre dist min et dist réel
-                        force = self.kelastic * (dists_min[source, dest] - dists[source, dest])
-                        deplacements[source, :] += - force * vect_depl
-                        deplacements[dest, :] -= - force * vect_depl
+            source, dest = source[overlap], dest[overlap]
+            vect_depl, dists, dists_min = vect_depl[overlap], dists[overlap], dists_min[overlap]
+            # deplacement aléatoire si chevauchement parfait
+            same = np.sqrt((vect_depl ** 2).sum(1)) < 1e-10
+            if same.any():
+                vect_depl[same] = np.random.random((same.sum(), nbdim))
+            vect_depl /= np.sqrt((vect_depl ** 2).sum(1))[:, None] # normalisation
+            # force = prop a la difference entre dist min et dist réel
+            force = (self.kelastic * (dists_min - dists))[:, None] * vect_depl
+            # somme des forces qui s'exerce sur chaque sommet
+            deplacements = np.zeros((nbs, nbdim))
+            np.add.at(deplacements, source, - force)
+            np.add.at(deplacements, dest, force)
             # mise a jour des positions
-            layout_mat += deplacements
+            moved = np.unique(np.concatenate((source, dest)))
+            layout_mat[moved] += deplacements[moved]
+            stale[moved] = True
 
-        layout = ig.Layout(layout_mat.tolist())
-        layout = normalise(layout)
-        return layout
+        return ig.Layout(normalise_array(layout_mat).tolist())
 
     def __call__(self, layout):
         """ Process the shaking !
@@ -305,6 +649,56 @@ class Shaker(Composable):
 
 
 
+def _tiny_layout(graph, dim):
+    """ Closed-form layout of a graph of 1 to 3 vertices, in a box of width 1
+    centered on the origin
+    """
+    coords = np.zeros((graph.vcount(), dim))
+    if graph.vcount() == 2:
+        coords[:, 0] = [-0.5, 0.5]
+    elif graph.vcount() == 3:
+        if dim > 1 and (graph.ecount() >= 3 or min(graph.degree()) == 0):
+            # triangle
+            coords[:, 0] = [-0.5, 0.5, 0.]
+            coords[:, 1] = [-0.5, -0.5, 0.5]
+        else:
+            # path (or line in 1D), the middle vertex at the center
+            middle = int(np.argmax(graph.degree()))
+            ends = [vid for vid in range(3) if vid != middle]
+            coords[ends, 0] = [-0.5, 0.5]
+    return coords
+
+
+def _component_layout(args):
+    """ Layout of one connected component (run in a worker process)
+    """
+    layout_mth, graph, kwargs = args
+    return np.array(layout_mth(graph, **kwargs).coords, dtype=np.float64).reshape(graph.vcount(), -1)
+
+
+def shelf_packing(sides, ratio=1.):
+    """ Packs squares of the given sides in rows ("shelves"), the biggest
+    first, the rows have about the width of a square of the same area.
+
+    :returns: the centers of the squares, a `(len(sides), 2)` array
+
+    >>> shelf_packing([2., 1., 1., 1.]).tolist()
+    [[1.0, 1.0], [0.5, 2.5], [1.5, 2.5], [0.5, 3.5]]
+    """
+    sides = np.asarray(sides, dtype=np.float64)
+    width = max(np.sqrt((sides ** 2).sum() * ratio), sides.max() if len(sides) else 0.)
+    centers = np.zeros((len(sides), 2))
+    pos_x, pos_y, shelf_height = 0., 0., 0.
+    for idx in np.argsort(-sides, kind="stable"):
+        side = sides[idx]
+        if pos_x > 0 and pos_x + side > width:
+            pos_x, pos_y, shelf_height = 0., pos_y + shelf_height, 0.
+        centers[idx] = (pos_x + side / 2., pos_y + side / 2.)
+        pos_x += side
+        shelf_height = max(shelf_height, side)
+    return centers
+
+
 class ByConnectedComponent(Optionable):
     """ Compute a given layout on each connected component, and then merge it.
     
@@ -316,49 +710,118 @@ class ByConnectedComponent(Optionable):
     >>> layout
     <Layout with 5 vertices and 3 dimensions>
 
+    Components of 1 to 3 vertices are placed without running the layout, and
+    components are packed in rows (see :func:`shelf_packing`), the area of
+    each component being proportional to its number of vertices:
+
+    >>> graph = ig.Graph.Formula("a--b--c--d--a, e--f, g, h")
+    >>> coords = np.array(merge_layout(graph).coords)
+    >>> coords[4:].round(2).tolist()
+    [[0.04, 1.5, 0.0], [0.75, 1.5, 0.0], [1.06, 1.39, 0.0], [0.28, 2.17, 0.0]]
+
+    The layouts of the components may be computed in parallel, either in a
+    pool created for each call or in a given pool (or executor):
+
+    >>> merge_layout = ByConnectedComponent(layout=KamadaKawaiLayout(), processes=2)
+    >>> merge_layout(graph)
+    <Layout with 8 vertices and 3 dimensions>
+    >>> from concurrent.futures import ThreadPoolExecutor
+    >>> with ThreadPoolExecutor(2) as executor:
+    ...     ByConnectedComponent(layout=KamadaKawaiLayout(), pool=executor)(graph)
+    <Layout with 8 vertices and 3 dimensions>
+
+    Layouts are computed in the current process when it is itself a
+    daemonic worker, or when the layout component can not be pickled.
+    In one dimension components are placed side by side:
+
+    >>> coords = ByConnectedComponent(layout=KamadaKawaiLayout(), dim=1)(graph).coords
+    >>> [round(x[0], 2) for x in coords[4:]]
+    [1.15, 1.86, 2.17, 2.73]
     """
-    def __init__(self, layout, dim=3):
+    def __init__(self, layout, dim=3, processes=1, pool=None):
+        """
+        :param layout: the layout component used on each connected component
+        :param dim: number of dimensions of the merged layout
+        :param processes: number of processes used to compute the layouts of
+            the components, 1 to compute them in the current process, None for
+            one per cpu
+        :param pool: a pool of workers (with a `map` method, as
+            :class:`multiprocessing.pool.Pool` or
+            :class:`concurrent.futures.Executor`) used instead of creating one
+        """
         super(ByConnectedComponent, self).__init__()
         self._layout_mth = layout
         self._merge_dim = dim #TODO make it an option
+        self.processes = processes
+        self.pool = pool
         # expose layout option
         if isinstance(self._layout_mth, Optionable):
             pass
             # TODO
 
+    def _can_fork(self):
+        """ Whether the layouts may be computed in a new pool: not from a
+        daemonic process, and with a picklable layout component
+        """
+        import pickle
+        from multiprocessing import current_process
+        if current_process().daemon:
+            self._logger.info("In a daemonic process, layouts computed serially")
+            return False
+        try:
+            pickle.dumps(self._layout_mth)
+        except Exception as err:
+            self._logger.warning("Layout component not picklable (%s), layouts computed serially" % err)
+            return False
+        return True
+
+    def _layouts(self, subgraphs, kwargs):
+        """ Layouts (numpy arrays) of the components with more than 3 vertices
+        """
+        tasks = [(self._layout_mth, subgraph, kwargs) for subgraph in subgraphs]
+        if self.pool is not None and len(tasks) > 1:
+            return list(self.pool.map(_component_layout, tasks))
+        if self.processes == 1 or len(tasks) < 2 or not self._can_fork():
+            return [_component_layout(task) for task in tasks]
+        from multiprocessing import Pool, cpu_count
+        processes = self.processes or cpu_count()
+        pool = Pool(min(processes, len(tasks)))
+        try:
+            return pool.map(_component_layout, tasks)
+        finally:
+            pool.terminate()
+
     def __call__(self, graph, **kwargs):
+        dim = self._merge_dim
         # split the graph in N connected components
         connected_components = graph.clusters()
-        subgraphs = connected_components.subgraphs()
-        # compute a list of vertex position (cc id, and id in subgraph)
-        vertex_cc = []
-        next_by_cc = [0] * len(connected_components)
-        for cc_num in connected_components.membership:
-            v_num = next_by_cc[cc_num]
-            next_by_cc[cc_num] += 1
-            vertex_cc.append((cc_num, v_num))
-        # compute layout for each cc
-        layout_mth = self._layout_mth
-        layouts = [layout_mth(cc, **kwargs) for cc in subgraphs]
-        # move each layout
-        nb_cc = len(connected_components)
-        ## full graph of CC
-        cc_graph = ig.Graph.Full(nb_cc)
-        ## compute a weight for each CC, the more nodes the more weight
-        #cc_weight = [np.log(len(cc) + 1) for cc in connected_components]
-        cc_weight = [len(cc) for cc in connected_components]
-        #print(cc_weight)
-        ## weights for the edges between CC
-        wmax = 1.*max(cc_weight)
-        weights = [2.*wmax - (cc_weight[edg.source] + cc_weight[edg.target]) for edg in cc_graph.es]
-        ## Compute CC graph layout
-        cc_layout = cc_graph.layout_fruchterman_reingold(weights=weights, dim=self._merge_dim)
-        for cc_num, layout in enumerate(layouts):
-            cc_position = cc_layout[cc_num]
-            # resize each small layout
-            layout.fit_into([cc_weight[cc_num]/wmax] * layout.dim)
-            layout.center(cc_position)
-        # merge layouts
-        layout = [layouts[cc_num][v_num] for cc_num, v_num in vertex_cc]
-        return ig.Layout(layout)
+        sizes = np.array(connected_components.sizes(), dtype=np.int64)
+        big = np.flatnonzero(sizes > 3)
+        layouts = dict(zip(big.tolist(),
+                           self._layouts([connected_components.subgraph(cc_num) for cc_num in big], kwargs)))
+        ## each CC in a square box, the more nodes the bigger
+        sides = np.sqrt(sizes / float(sizes.max())) if len(sizes) else sizes
+        margin = 0.9
+        if dim == 1:
+            centers = np.cumsum(sides / margin) - sides / margin / 2.
+            centers = centers.reshape(-1, 1)
+        else:
+            centers = shelf_packing(sides / margin)
+        coords = np.zeros((graph.vcount(), dim))
+        for cc_num, vids in enumerate(connected_components):
+            if sizes[cc_num] == 1:
+                mat = np.zeros((1, dim))
+            elif sizes[cc_num] <= 3:
+                mat = _tiny_layout(graph.subgraph(vids), dim)
+            else:
+                mat = layouts[cc_num][:, :dim]
+                if mat.shape[1] < dim:
+                    mat = np.hstack((mat, np.zeros((len(mat), dim - mat.shape[1]))))
+                # fit into a box of width 1 centered on the origin
+                mins, maxs = mat.min(0), mat.max(0)
+                mat = (mat - (mins + maxs) / 2.) / max((maxs - mins).max(), 1e-12)
+            mat = mat * sides[cc_num]
+            mat[:, :min(dim, 2)] += centers[cc_num, :dim]
+            coords[vids] = mat
+        return ig.Layout(coords.tolist())
 
@@ -12,5 +12,6 @@ SubModules
     cello.providers.es
     cello.providers.solr
     cello.providers.igraphGraph
+    cello.providers.snapshot
 
 """
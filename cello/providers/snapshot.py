@@ -0,0 +1,248 @@
+#-*- coding:utf-8 -*-
+""" :mod:`cello.providers.snapshot`
+==================================
+
+.. currentmodule:: cello.providers.snapshot
+
+Binary snapshot of a (global) graph, much faster to load than graphml or
+picklez and without the transient memory overhead.
+
+A snapshot is either a directory of `.npy` files (that can be memory mapped)
+or a single `.npz` file. It contains:
+
+* the adjacency in CSR form (`indptr`, `indices`), each edge is stored once
+  from its source, `eids` gives the igraph edge id of each CSR entry ;
+* one column per vertex and edge attribute, numeric columns are stored as is
+  and string columns are dictionary encoded (`codes` and `values`) ;
+* the `gid` (global ids of the vertices, kept from the `gid` vertex
+  attribute if any, vertex indices otherwise) and `degree` vectors.
+
+>>> import tempfile, os
+>>> from cello.providers.igraphGraph import IgraphGraph
+>>> graph = IgraphGraph.Formula("a--b, a--c, a--d, a--f, d--f")
+>>> graph.es["weight"] = [4., 4., 5., 5., 1.]
+>>> graph["title"] = "test"
+>>> path = os.path.join(tempfile.mkdtemp(), "global")
+>>> write_snapshot(graph, path)
+>>> snap = read_snapshot(path)
+>>> print(snap.summary())
+IGRAPH UNW- 5 5 --
++ attr: title (g), gid (v), name (v), weight (e)
+>>> snap.get_edgelist() == graph.get_edgelist()
+True
+>>> snap.vs["name"], snap.vs["gid"]
+(['a', 'b', 'c', 'd', 'f'], [0, 1, 2, 3, 4])
+
+Global ids of a graph that already has some (a local graph extracted from a
+global one) are kept:
+
+>>> local = graph.subgraph([1, 3, 4])
+>>> local.vs["gid"] = [1, 3, 4]
+>>> write_snapshot(local, path + "_local")
+>>> read_snapshot(path + "_local").vs["gid"]
+[1, 3, 4]
+>>> read_snapshot_arrays(path + "_local")["gid"]
+memmap([1, 3, 4])
+
+The arrays can also be used directly, without building the graph:
+
+>>> arrays = read_snapshot_arrays(path)
+>>> arrays["indptr"], arrays["indices"]
+(memmap([0, 4, 4, 4, 5, 5]), memmap([1, 2, 3, 4, 4]))
+>>> arrays["degree"]
+memmap([4, 1, 1, 2, 2])
+>>> arrays["es"]["weight"]
+memmap([4., 4., 5., 5., 1.])
+>>> decode(arrays["vs"]["name"])
+['a', 'b', 'c', 'd', 'f']
+
+"""
+from builtins import range
+
+import os
+import json
+import logging
+
+import six
+import numpy as np
+
+from cello.providers.igraphGraph import IgraphGraph
+
+_logger = logging.getLogger("cello.providers.snapshot")
+
+SNAPSHOT_VERSION = 1
+
+
+def _encode(values):
+    """ Encode a column of attribute values, returns `(kind, arrays)` or
+    `(None, None)` if the column can not be encoded.
+
+    >>> _encode([1, 2, 3])
+    ('int', {'data': array([1, 2, 3])})
+    >>> _encode(['b', None, 'a', 'b'])
+    ('str', {'codes': array([ 1, -1,  0,  1], dtype=int32), 'values': array(['a', 'b'], dtype='<U1')})
+    >>> _encode([1, None])
+    (None, None)
+    """
+    if all(isinstance(val, bool) for val in values):
+        return "bool", {"data": np.array(values, dtype=np.bool_)}
+    if all(isinstance(val, six.integer_types + (np.integer,)) and not isinstance(val, bool) for val in values):
+        return "int", {"data": np.array(values, dtype=np.int64)}
+    if all(isinstance(val, six.integer_types + (float, np.integer, np.floating)) for val in values):
+        return "float", {"data": np.array(values, dtype=np.float64)}
+    if all(val is None or isinstance(val, six.string_types) for val in values):
+        isnone = np.array([val is None for val in values], dtype=np.bool_)
+        strings = np.array([u"" if val is None else val for val in values], dtype=np.str_)
+        uniques, codes = np.unique(strings[~isnone], return_inverse=True)
+        full_codes = np.full(len(values), -1, dtype=np.int32)
+        full_codes[~isnone] = codes
+        return "str", {"codes": full_codes, "values": uniques}
+    return None, None
+
+def decode(column):
+    """ Decode a column (as given by :func:`read_snapshot_arrays`) to a list of
+    python values
+    """
+    if isinstance(column, dict):
+        lookup = np.append(np.asarray(column["values"]).astype(object), None)
+        return lookup[column["codes"]].tolist()
+    return np.asarray(column).tolist()
+
+def _encode_attrs(seq, prefix, arrays):
+    """ Encode all attributes of a vertex or edge sequence into `arrays`,
+    returns the meta data describing the stored columns.
+    """
+    attrs = []
+    for num, attr in enumerate(sorted(seq.attribute_names())):
+        kind, columns = _encode(seq[attr])
+        if kind is None:
+            _logger.warning("%s attribute '%s' can not be stored in a snapshot, skipped" % (prefix, attr))
+            continue
+        attrs.append({"name": attr, "kind": kind, "key": "%s%d" % (prefix, num)})
+        for suffix, array in six.iteritems(columns):
+            arrays["%s%d_%s" % (prefix, num, suffix)] = array
+    return attrs
+
+def _global_ids(graph):
+    """ The `gid` vector: the `gid` vertex attribute if the graph has integer
+    global ids (as a :class:`cello.graphs.builder.Subgraph` output), else the
+    vertex indices
+    """
+    if "gid" in graph.vs.attributes():
+        kind, columns = _encode(graph.vs["gid"])
+        if kind == "int":
+            return columns["data"]
+    return np.arange(graph.vcount(), dtype=np.int64)
+
+def write_snapshot(graph, path):
+    """ Write a binary snapshot of the graph.
+
+    :param graph: the graph to store
+    :type graph: :class:`igraph.Graph`
+    :param path: a directory (created if needed) or, if it ends with `.npz`,
+        a single (not memory mappable) file.
+
+    Vertex and edge attributes that are neither numeric nor strings are
+    skipped, as well as non JSON serialisable graph attributes.
+    """
+    n, m = graph.vcount(), graph.ecount()
+    edges = np.array(graph.get_edgelist(), dtype=np.int64).reshape(m, 2)
+    eids = np.argsort(edges[:, 0], kind="stable")
+    arrays = {
+        "indptr": np.concatenate(([0], np.cumsum(np.bincount(edges[:, 0], minlength=n)))).astype(np.int64),
+        "indices": edges[eids, 1],
+        "eids": eids.astype(np.int64),
+        "gid": _global_ids(graph),
+        "degree": np.array(graph.degree(), dtype=np.int64),
+    }
+    gattrs = {}
+    for attr in graph.attributes():
+        try:
+            json.dumps(graph[attr])
+            gattrs[attr] = graph[attr]
+        except (TypeError, ValueError):
+            _logger.warning("graph attribute '%s' can not be stored in a snapshot, skipped" % attr)
+    meta = {
+        "version": SNAPSHOT_VERSION,
+        "directed": graph.is_directed(),
+        "vcount": n,
+        "ecount": m,
+        "gattrs": gattrs,
+        "vattrs": _encode_attrs(graph.vs, "v", arrays),
+        "eattrs": _encode_attrs(graph.es, "e", arrays),
+    }
+    arrays["meta"] = np.array(json.dumps(meta))
+    if path.endswith(".npz"):
+        np.savez(path, **arrays)
+    else:
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for key, array in six.iteritems(arrays):
+            np.save(os.path.join(path, "%s.npy" % key), array)
+
+def read_snapshot_arrays(path, mmap=True):
+    """ Read the arrays of a snapshot (see :func:`write_snapshot`).
+
+    :param path: path of the snapshot
+    :param mmap: if True (and the snapshot is a directory) arrays are memory
+        mapped rather than read
+
+    :returns: a dict with the keys `meta`, `indptr`, `indices`, `eids`, `gid`,
+        `degree`, `vs` and `es` ; `vs` and `es` are dicts of columns, a string
+        column is a dict with `codes` and `values` (see :func:`decode`).
+    """
+    if path.endswith(".npz"):
+        raw = np.load(path)
+    else:
+        mmap_mode = "r" if mmap else None
+        raw = {fname[:-4]: np.load(os.path.join(path, fname), mmap_mode=mmap_mode)
+                    for fname in os.listdir(path) if fname.endswith(".npy")}
+    meta = json.loads(str(raw["meta"][()]))
+    if meta["version"] != SNAPSHOT_VERSION:
+        raise ValueError("Unsupported snapshot version: %s" % meta["version"])
+    arrays = {key: raw[key] for key in ("indptr", "indices", "eids", "gid", "degree")}
+    arrays["meta"] = meta
+    for seq, attrs in (("vs", meta["vattrs"]), ("es", meta["eattrs"])):
+        arrays[seq] = {}
+        for attr in attrs:
+            if attr["kind"] == "str":
+                column = {"codes": raw["%s_codes" % attr["key"]],
+                          "values": raw["%s_values" % attr["key"]]}
+            else:
+                column = raw["%s_data" % attr["key"]]
+            arrays[seq][attr["name"]] = column
+    return arrays
+
+def read_snapshot(path, degree_attr=None):
+    """ Load a graph from a snapshot (see :func:`write_snapshot`), the graph
+    is built in bulk from the arrays.
+
+    :param path: path of the snapshot
+    :param degree_attr: if not None, vertex attribute in which the stored
+        degree vector is copied
+    :returns: the graph, with a `gid` vertex attribute (the stored one, or
+        the vertex indices of the stored graph if it had none)
+    :rtype: :class:`.IgraphGraph`
+    """
+    arrays = read_snapshot_arrays(path, mmap=True)
+    meta = arrays["meta"]
+    n = meta["vcount"]
+    # CSR to edge list, in igraph edge id order
+    sources = np.repeat(np.arange(n, dtype=np.int64), np.diff(arrays["indptr"]))
+    edges = np.empty((meta["ecount"], 2), dtype=np.int64)
+    edges[arrays["eids"], 0] = sources
+    edges[arrays["eids"], 1] = arrays["indices"]
+
+    vertex_attrs = {name: decode(column) for name, column in six.iteritems(arrays["vs"])}
+    if "gid" not in vertex_attrs:
+        vertex_attrs["gid"] = np.asarray(arrays["gid"]).tolist()
+    if degree_attr is not None:
+        vertex_attrs[degree_attr] = np.asarray(arrays["degree"]).tolist()
+    edge_attrs = {name: decode(column) for name, column in six.iteritems(arrays["es"])}
+    graph = IgraphGraph(n=n,
+                        edges=edges,
+                        directed=meta["directed"],
+                        graph_attrs=meta["gattrs"],
+                        vertex_attrs=vertex_attrs,
+                        edge_attrs=edge_attrs)
+    return graph
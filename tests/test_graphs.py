@@ -6,7 +6,7 @@ import igraph
 
 import cello
 from cello.providers.igraphGraph import IgraphGraph
-from cello.graphs import random_vertex, read_json, export_graph
+from cello.graphs import random_vertex, read_json, export_graph, export_graph_columns
 from reliure.schema import Doc
 
 class TestGraph(unittest.TestCase):
@@ -51,6 +51,13 @@ class TestGraph(unittest.TestCase):
         assert graph.vs['name'] == self.formula.vs['name']
         assert graph.vcount() == self.formula.vcount()
         assert graph.ecount() == self.formula.ecount()
+
+    def test_should_read_columnar_json(self):
+        graph = read_json(export_graph_columns(self.formula))
+
+        assert graph.vs['name'] == self.formula.vs['name']
+        assert graph.vs['docnum'] == self.formula.vs['docnum']
+        assert graph.get_edgelist() == self.formula.get_edgelist()
     
     def test_should_select_random_vertex(self):
         vid = random_vertex(self.formula) 